@@ -1,10 +1,46 @@
 import streamlit as st
-import marqo
 from collections import defaultdict
 import traceback
 from data.data_schema import DatasetMetadata
-from data.utils import load_datasets
+from data.catalogue import CATALOGUE_DIR, Catalogue
+from data.facets import FacetIndex
+from data.ranges import RangeIndex
+from search.autocomplete import PREFIX_INDEX_DIR, PrefixIndex
+from search.backends import (
+    LOCAL_INDEX_DIR, HybridBackend, LocalBackend, MarqoBackend, RangeBackend, SearchBackend, build_filter_string
+)
+from search.filter_options import (
+    FACET_QUERY_DEPTH, get_all_filter_options as read_all_filter_options, get_filter_options_from_results
+)
+from search.lexical import LEXICAL_INDEX_DIR, LexicalIndex
+from search.related import RELATED_DIR, RelatedGraph
+from search.query_cache import TOP_QUERIES_PATH, QueryEmbeddingCache, QueryLog, load_top_queries, warm_up
+from search.index_alias import resolve_index
+from search.result_cache import ResultCache, normalize_query
+from search.storage import built_at as saved_built_at
+from search.service_client import ServiceBackend
+import metrics
+import atexit
+import calendar
 import os
+import time
+
+CONNECTION_URL = "https://74ab-75-50-53-185.ngrok-free.app" # TODO: Make this dynamic
+# "marqo" (default) or "local" to search the in-process index built with build_vector_db --backend local
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "marqo")
+# "hybrid" (default) fuses BM25 with the vector search when the lexical index exists; "vector" disables it
+SEARCH_MODE = os.environ.get("SEARCH_MODE", "hybrid")
+# The search box sends what has been typed after this pause in typing, to update the suggestions
+SUGGEST_PAUSE = "150ms"
+# ...and searches for it once typing has paused this much longer, so a query still being typed is never searched
+DEBOUNCE_SECONDS = float(os.environ.get("SEARCH_DEBOUNCE_SECONDS", "0.4"))
+# Queries whose embeddings are computed at startup, plus the most frequent logged queries
+WARMUP_QUERIES_FILE = os.environ.get("WARMUP_QUERIES_FILE", TOP_QUERIES_PATH)
+WARMUP_LOGGED_QUERIES = int(os.environ.get("WARMUP_LOGGED_QUERIES", "200"))
+# Serve Prometheus metrics on this port when set
+METRICS_PORT = os.environ.get("METRICS_PORT")
+# When set, search through the search service (search_service.py) instead of calling the backend from here
+SEARCH_SERVICE_URL = os.environ.get("SEARCH_SERVICE_URL")
 
 def format_size(size_in_bytes):
     # Convert bytes to human readable format (B, KB, MB, GB, TB, PB)
@@ -14,56 +50,146 @@ def format_size(size_in_bytes):
         size_in_bytes /= 1024
     return f"{size_in_bytes:.1f} PB"
 
-def get_unique_field_values(mq, index_name, field, limit=1000):
-    results = mq.index(index_name).search(
-        "*",
-        limit=limit,
-        searchable_attributes=["searchable_content"],
-        show_highlights=False,
-        attributes_to_retrieve=[field]
-    )
-    
-    values = set()
-    for hit in results['hits']:
-        field_value = hit.get(field, [])
-        
-        if isinstance(field_value, list):
-            for value in field_value:
-                if value and value != "Not specified":
-                    values.add(value)
-        elif field_value and field_value != "Not specified":
-            values.add(field_value)
-    
-    return sorted(list(values))
+@st.cache_resource
+def get_client():
+    # Imported here, not at the top: it is slow to import and unused with a catalogue
+    # and the local backend or the search service
+    import marqo
+    # One client for the whole process; marqo.Client keeps a pooled requests session
+    return marqo.Client(url=CONNECTION_URL)
 
-def search_datasets(query, filters=None, limit=10):
-    connection_url = "https://74ab-75-50-53-185.ngrok-free.app" # TODO: Make this dynamic
-    mq = marqo.Client(url=connection_url)
-    
-    filter_conditions = []
-    if filters:
-        if filters.get('modality'):
-            filter_conditions.append(f"modalities:{filters['modality']}")
-        if filters.get('min_size') is not None:
-            filter_conditions.append(f"size:[{filters['min_size']} TO *]")
-        if filters.get('max_size') is not None:
-            filter_conditions.append(f"size:[* TO {filters['max_size']}]")
-        if filters.get('species'):
-            filter_conditions.append(f"species:{filters['species']}")
-        if filters.get('tasks'):
-            filter_conditions.append(f"tasks:{filters['tasks']}")
-            
-    filter_string = " AND ".join(filter_conditions) if filter_conditions else None
-    
+@st.cache_resource
+def get_result_cache():
+    cache = ResultCache(max_size=512, ttl=300)
+    metrics.REGISTRY.add_collector(lambda: cache_counters("results", cache))
+    return cache
+
+def cache_counters(name, cache):
+    return {
+        ('cache_hits_total', (('cache', name),)): cache.hits,
+        ('cache_misses_total', (('cache', name),)): cache.misses,
+    }
+
+@st.cache_resource
+def start_metrics_server():
+    return metrics.serve(int(METRICS_PORT)) if METRICS_PORT else None
+
+@st.cache_resource
+def get_query_cache():
+    cache = QueryEmbeddingCache()
+    metrics.REGISTRY.add_collector(lambda: cache_counters("query_embeddings", cache))
+    # put() saves periodically; this catches whatever was added since
+    atexit.register(cache.save)
+    return cache
+
+@st.cache_resource
+def get_query_log():
+    return QueryLog()
+
+@st.cache_resource
+def warm_query_cache(embedding_space):
+    """Embed the configured and most-searched queries once per embedding space"""
+    backend = get_backend()
+    queries = load_top_queries(WARMUP_QUERIES_FILE) + get_query_log().top_queries(WARMUP_LOGGED_QUERIES)
+    try:
+        return warm_up(backend, get_query_cache(), queries)
+    except Exception as e:
+        # Warm-up is an optimization; searches still embed on demand
+        print(f"Could not warm up query embeddings: {str(e)}")
+        return 0
+
+@st.cache_data(ttl=30)
+def get_active_index():
+    # Resolved on every query (cached briefly) so an alias switch takes effect without a restart
+    return resolve_index(get_client())
+
+@st.cache_data(ttl=30)
+def built_at(path):
+    # Re-read every 30 seconds, like the index alias, so the loaders keyed on it pick up
+    # a rebuild without a restart
+    return saved_built_at(path)
+
+@st.cache_resource(max_entries=1)
+def load_local_backend(version):
+    return LocalBackend(LOCAL_INDEX_DIR, query_cache=get_query_cache())
+
+def get_local_backend():
+    return load_local_backend(built_at(LOCAL_INDEX_DIR))
+
+@st.cache_resource(max_entries=1)
+def load_lexical_index(version):
+    # Built alongside the index by build_vector_db; None if it hasn't been built
+    return LexicalIndex.load()
+
+def get_lexical_index():
+    return load_lexical_index(built_at(LEXICAL_INDEX_DIR))
+
+@st.cache_resource
+def get_service_backend():
+    # One pooled HTTP session to the service for the whole process
+    return ServiceBackend(SEARCH_SERVICE_URL)
+
+def get_backend() -> SearchBackend:
+    if SEARCH_SERVICE_URL:
+        return get_service_backend()
+    if SEARCH_BACKEND == "local":
+        backend = get_local_backend()
+    else:
+        backend = MarqoBackend(get_client(), get_active_index(), query_cache=get_query_cache())
+    lexical = get_lexical_index() if SEARCH_MODE == "hybrid" else None
+    if lexical is not None:
+        backend = HybridBackend(backend, lexical)
+    ranges = get_range_index()
+    if ranges is not None:
+        # Size, date and subject-count ranges and sorting are applied from the catalogue
+        backend = RangeBackend(backend, ranges, get_facet_index())
+    return backend
+
+# Everything a result card shows; descriptions are loaded separately, only when opened
+RESULT_FIELDS = ['id', 'name', 'source', 'modalities', 'species', 'tasks', 'size', 'doi', 'date_created',
+                 'data_standard', 'subject_count', 'aliases', 'alias_sources']
+PAGE_SIZES = [10, 20, 50, 100]
+RELATED_LIMIT = 5
+
+def debounce():
+    """Wait briefly before searching a newly typed query. If the user types on
+    meanwhile, the search box reruns, Streamlit stops this run at the next element
+    update and the expensive search never fires."""
+    status = st.empty()
+    time.sleep(DEBOUNCE_SECONDS)
+    status.caption("Searching…")
+
+def show_active_filters(filters):
+    filter_string = build_filter_string(filters)
     if filter_string:
         st.sidebar.write("Active filters:", filter_string)
+
+def should_log(query):
+    """Whether this is a new query for the session; logged once, not on every rerun, so counts reflect searches"""
+    if query == "*" or st.session_state.get("logged_query") == query:
+        return False
+    st.session_state["logged_query"] = query
+    return True
+
+def search_datasets(query, filters=None, limit=10, offset=0, attributes_to_retrieve=RESULT_FIELDS, log=False):
+    show_active_filters(filters)
     
-    results = mq.index("neuroscience_datasets").search(
-        query if query else "*",
-        limit=limit,
-        filter_string=filter_string
-    )
-    return results["hits"]
+    query = normalize_query(query) or "*"
+    backend = get_backend()
+    if not SEARCH_SERVICE_URL:
+        # The service warms up and logs queries itself
+        warm_query_cache(backend.embedding_space)
+        if log and should_log(query):
+            get_query_log().record(query)
+    cache = get_result_cache()
+    cache.set_version(backend.version)
+    cache_key = (query, tuple(sorted((filters or {}).items())), limit, offset, tuple(attributes_to_retrieve or ()))
+    hits = cache.get(cache_key)
+    if hits is None:
+        with metrics.timer("search_seconds", backend=SEARCH_BACKEND):
+            hits = backend.search(query, filters, limit=limit, offset=offset, attributes_to_retrieve=attributes_to_retrieve)
+        cache.set(cache_key, hits)
+    return hits
 
 def format_array_field(value):
     if isinstance(value, list):
@@ -78,88 +204,376 @@ def format_dataset_url(dataset_id: str, source: str) -> str:
     else:
         return "#"
 
-def get_filter_options_from_results(results):
-    modalities = set()
-    species = set()
-    tasks = set()
-    
-    for result in results:
-        if isinstance(result.get('modalities'), list):
-            for m in result['modalities']:
-                if m and m != "Not specified":
-                    modalities.add(m)
-                    
-        # Handle species as either a string or a list
-        if result.get('species'):
-            if isinstance(result.get('species'), list):
-                for s in result['species']:
-                    if s and s != "Not specified":
-                        species.add(s)
-            elif result['species'] != "Not specified":
-                species.add(result['species'])
-            
-        if isinstance(result.get('tasks'), list):
-            for t in result['tasks']:
-                if t and t != "Not specified":
-                    tasks.add(t)
-    
-    return {
-        'modalities': sorted(list(modalities)),
-        'species': sorted(list(species)),
-        'tasks': sorted(list(tasks))
-    }
+def best_passage(result):
+    # The passage that matched the query best, from the local index or Marqo's highlights
+    highlights = result.get('_highlights') or []
+    if isinstance(highlights, dict):
+        highlights = [highlights]
+    for highlight in highlights:
+        for field in ['description', 'searchable_content']:
+            if highlight.get(field):
+                return highlight[field]
+    return None
+
+@st.cache_resource(max_entries=1)
+def load_catalogue(version):
+    # Built alongside the index by build_vector_db; None if it hasn't been built
+    return Catalogue.load()
+
+def get_catalogue():
+    return load_catalogue(built_at(CATALOGUE_DIR))
+
+def catalogue_version(catalogue):
+    """Key for the indexes built from `catalogue`, so they are rebuilt with it"""
+    return catalogue.meta.get('built_at') if catalogue is not None else None
+
+@st.cache_data(max_entries=256)
+def get_description(dataset_id, index_version):
+    # Read from the catalogue's memory-mapped description column; fall back to fetching the document
+    catalogue = get_catalogue()
+    if catalogue is not None:
+        index = catalogue.index_of(dataset_id)
+        try:
+            if index is not None:
+                return catalogue.text('description', index)
+        except FileNotFoundError:
+            pass  # catalogue built before descriptions were stored
+    documents = get_backend().get_documents([dataset_id])
+    return documents[0].get('description', "") if documents else ""
+
+@st.cache_resource(max_entries=1)
+def load_related_graph(version):
+    # Built alongside the index by build_vector_db; None if it hasn't been built
+    return RelatedGraph.load()
+
+def get_related_graph():
+    return load_related_graph(built_at(RELATED_DIR))
+
+def render_related(dataset_id):
+    """Links to the most similar datasets, read from the precomputed neighbour graph"""
+    graph = get_related_graph()
+    catalogue = get_catalogue()
+    if graph is None or catalogue is None:
+        return
+    links = []
+    for related_id, _ in graph.related(dataset_id, limit=RELATED_LIMIT):
+        index = catalogue.index_of(related_id)
+        if index is not None:
+            url = format_dataset_url(related_id, catalogue.values('source', index)[0])
+            links.append(f"[{catalogue.text('name', index)}]({url})")
+    if links:
+        st.markdown("**Related datasets**: " + " · ".join(links))
+
+def render_description(dataset_id):
+    if not st.toggle("Show Description", key=f"show_desc_{dataset_id}"):
+        return
+    description = get_description(dataset_id, get_backend().version)
+    if not description or description == "Not specified":
+        st.caption("No description available.")
+        return
+    preview = description[:500] + "..." if len(description) > 500 else description
+    readme_container = st.empty()
+    readme_container.text(preview)
+    if len(description) > 500:
+        if st.button("Show Full Description", key=f"desc_{dataset_id}"):
+            readme_container.text(description)
+
+def current_page(query, filters, page_size):
+    """Page number from session state, back to the first page whenever the search changes"""
+    search_key = (query, tuple(sorted(filters.items())), page_size)
+    if st.session_state.get("search_key") != search_key:
+        st.session_state["search_key"] = search_key
+        st.session_state["page"] = 0
+    return st.session_state["page"]
+
+def change_page(step):
+    st.session_state["page"] = max(st.session_state.get("page", 0) + step, 0)
+
+# Leading underscore: Streamlit keys the cache on the version alone, not the catalogue object
+@st.cache_resource(max_entries=1)
+def load_prefix_index(version, saved_version, _catalogue):
+    if _catalogue is None:
+        return None
+    # Saved by build_vector_db alongside the catalogue; only built here if that is missing or stale
+    saved = PrefixIndex.load(PREFIX_INDEX_DIR, catalogue_version=version)
+    return saved if saved is not None else PrefixIndex.from_catalogue(_catalogue)
+
+def get_prefix_index():
+    catalogue = get_catalogue()
+    return load_prefix_index(catalogue_version(catalogue), built_at(PREFIX_INDEX_DIR), catalogue)
+
+# suggestion kind -> filter key it sets
+SUGGESTION_FILTERS = {'modality': 'modality', 'species': 'species', 'task': 'tasks'}
+SUGGESTION_LABELS = {'modality': "modality", 'species': "species", 'task': "task", 'id': "id", 'name': "dataset"}
+
+def apply_suggestion():
+    # Runs before the rerun, so widget values can still be changed here
+    choice = st.session_state.get("suggestion")
+    if not choice:
+        return
+    kind, text = choice.split(":", 1)
+    if kind in SUGGESTION_FILTERS:
+        st.session_state[f"filter_{SUGGESTION_FILTERS[kind]}"] = text
+        st.session_state["query"] = ""
+    else:
+        st.session_state["query"] = text
+    st.session_state["suggestion"] = None
+    # A picked suggestion is searched straight away
+    st.session_state["search_now"] = True
+
+def render_suggestions(query):
+    prefix_index = get_prefix_index()
+    if prefix_index is None or not query:
+        return
+    suggestions = prefix_index.suggest(query)
+    if not suggestions:
+        return
+    st.pills(
+        "Suggestions",
+        options=[f"{suggestion['kind']}:{suggestion['text']}" for suggestion in suggestions],
+        format_func=lambda option: f"{option.split(':', 1)[1]} · {SUGGESTION_LABELS[option.split(':', 1)[0]]}",
+        key="suggestion",
+        on_change=apply_suggestion,
+        label_visibility="collapsed"
+    )
+
+@st.fragment
+def search_box():
+    """The query box and its suggestions. While the user types, only this fragment
+    reruns, which is cheap: the suggestions update on every pause, and the page with
+    its search only reruns once the query has stayed unchanged for DEBOUNCE_SECONDS."""
+    query = st.text_input("Search datasets", placeholder="Enter keywords, modalities, species, etc.", key="query",
+                          live=SUGGEST_PAUSE)
+    render_suggestions(query)
+    # Page runs record the query they search, so only the fragment's own reruns get here with a new one
+    if query != st.session_state.get("searched_query", ""):
+        if not st.session_state.pop("search_now", False):
+            debounce()
+        st.rerun(scope="app")
+    return query
+
+@st.cache_resource(max_entries=1)
+def load_facet_index(version, _catalogue):
+    return FacetIndex(_catalogue) if _catalogue is not None else None
+
+def get_facet_index():
+    catalogue = get_catalogue()
+    return load_facet_index(catalogue_version(catalogue), catalogue)
+
+@st.cache_resource(max_entries=1)
+def load_range_index(version, _catalogue):
+    return RangeIndex(_catalogue) if _catalogue is not None else None
+
+def get_range_index():
+    catalogue = get_catalogue()
+    return load_range_index(catalogue_version(catalogue), catalogue)
+
+# (catalogue field, filter key, label, placeholder)
+FACET_FILTERS = [
+    ('modalities', 'modality', "Modality", "All Modalities"),
+    ('species', 'species', "Species", "All Species"),
+    ('tasks', 'tasks', "Tasks", "All Tasks"),
+    ('source', 'source', "Source", "All Sources"),
+    ('data_standard', 'data_standard', "Data Standard", "All Standards"),
+]
+
+def size_range_bytes(min_size, max_size):
+    # Convert GB to bytes, but ensure at least 1 byte by default
+    min_size_bytes = max(int(min_size * 1_000_000_000), 1) if min_size > 0 else None
+    max_size_bytes = int(max_size * 1_000_000_000) if max_size > 0 else None
+    return min_size_bytes, max_size_bytes
+
+SORT_LABELS = {"": "Relevance", "newest": "Newest first", "size": "Largest first", "subjects": "Most subjects"}
+
+def range_filters(min_date, max_date, min_subjects, sort):
+    """Filters for the publication dates (whole days, UTC), subject count and sort order"""
+    filters = {}
+    if min_date is not None:
+        filters['min_date'] = calendar.timegm(min_date.timetuple())
+    if max_date is not None:
+        filters['max_date'] = calendar.timegm(max_date.timetuple()) + 86399
+    if min_subjects:
+        filters['min_subjects'] = int(min_subjects)
+    if sort:
+        filters['sort'] = sort
+    return filters
+
+def session_range_filters():
+    return range_filters(
+        st.session_state.get("min_date"),
+        st.session_state.get("max_date"),
+        st.session_state.get("min_subjects", 0),
+        st.session_state.get("sort", "")
+    )
+
+def query_candidates(facet_index, query):
+    """Bitmap of the datasets the query matches, with no filters, since counts apply those
+    themselves: the datasets its terms match in the lexical index, or without one its top
+    FACET_QUERY_DEPTH hits. None for no query, or none of its terms in the index."""
+    if normalize_query(query) in ("", "*"):
+        return None
+    catalogue = get_catalogue()
+    lexical = get_lexical_index()
+    if lexical is not None:
+        ids = lexical.matches(query)
+        if ids is None:
+            return None
+    else:
+        ids = [hit['_id'] for hit in search_datasets(query, None, FACET_QUERY_DEPTH, attributes_to_retrieve=['id'])]
+    positions = [catalogue.index_of(dataset_id) for dataset_id in ids]
+    return facet_index.from_indices(position for position in positions if position is not None)
+
+def get_facet_counts(facet_index, query):
+    """Counts for every facet value over everything the current query and filters match.
+    Widgets haven't been drawn yet, so their values come from session state."""
+    selections = {field: st.session_state.get(f"filter_{key}", "") for field, key, _, _ in FACET_FILTERS}
+    size_range = size_range_bytes(st.session_state.get("min_size", 0.000000001), st.session_state.get("max_size", 0.0))
+    candidates = query_candidates(facet_index, query)
+    # Sizes are counted per bucket by the facet index itself; the other ranges narrow what is counted
+    mask = get_range_index().mask(session_range_filters(), fields=['date_created', 'subject_count'])
+    if mask is not None:
+        candidates = facet_index.from_mask(mask) if candidates is None else candidates & facet_index.from_mask(mask)
+    return facet_index.counts(selections, size_range, candidates)
+
+def build_filters(selected, min_size, max_size, ranges=None):
+    min_size_bytes, max_size_bytes = size_range_bytes(min_size, max_size)
+    filters = {key: value for key, value in selected.items() if value}
+    if min_size > 0:
+        filters['min_size'] = min_size_bytes
+    if max_size > 0:
+        filters['max_size'] = max_size_bytes
+    filters.update(ranges or {})
+    return filters
+
+def fetch_page(service):
+    """Stats, facet counts and the current page of results from the search service in
+    one request, which it answers concurrently. Widgets haven't been drawn yet, so
+    their values come from session state; render_page checks they still match."""
+    query = st.session_state.get("query", "")
+    filters = build_filters(
+        {key: st.session_state.get(f"filter_{key}", "") for _, key, _, _ in FACET_FILTERS},
+        st.session_state.get("min_size", 0.000000001),
+        st.session_state.get("max_size", 0.0),
+        session_range_filters()
+    )
+    page_size = st.session_state.get("page_size", PAGE_SIZES[0])
+    search = bool(query or filters)
+    page = current_page(query, filters, page_size) if search else 0
+    normalized = normalize_query(query) or "*"
+    # One extra hit tells us whether there is a next page
+    data = service.page(normalized, filters, page_size + 1, offset=page * page_size, attributes_to_retrieve=RESULT_FIELDS,
+                        search=search, log=search and should_log(normalized))
+    data['key'] = (normalized, filters, page_size, page)
+    return data
 
 @st.cache_data(ttl=3600)
-def get_all_filter_options():
-    connection_url = "https://74ab-75-50-53-185.ngrok-free.app" # TODO: Make this dynamic
-    mq = marqo.Client(url=connection_url)
-    return {
-        'modalities': get_unique_field_values(mq, "neuroscience_datasets", "modalities"),
-        'species': get_unique_field_values(mq, "neuroscience_datasets", "species"),
-        'tasks': get_unique_field_values(mq, "neuroscience_datasets", "tasks")
-    }
+def get_all_filter_options(index_version):
+    catalogue = get_catalogue()
+    if catalogue is not None:
+        return {
+            'modalities': catalogue.facet_values('modalities'),
+            'species': catalogue.facet_values('species'),
+            'tasks': catalogue.facet_values('tasks')
+        }
+
+    return read_all_filter_options(get_backend())
+
+def render_result(result):
+    with st.container():
+        dataset_url = format_dataset_url(result['id'], result['source'])
+        st.markdown(f"### [{result['name']}]({dataset_url})")
+        st.markdown(f"**ID**: {result['id']}")
+        if result.get('aliases'):
+            links = [f"[{alias}]({format_dataset_url(alias, source)})"
+                     for alias, source in zip(result['aliases'], result.get('alias_sources') or [])]
+            st.markdown("**Also available as**: " + ", ".join(links))
+        passage = best_passage(result)
+        if passage:
+            st.caption(f"…{passage}…")
+
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.write("**Modalities:**", format_array_field(result['modalities']))
+            if result.get('species'):
+                st.write("**Species:**", format_array_field(result['species']))
+        with col2:
+            if result.get('doi'):
+                st.write("**DOI:**", result['doi'])
+            st.write("**Published:**", result['date_created'])
+            if result.get('data_standard'):
+                st.write("**Standard:**", result['data_standard'])
+        with col3:
+            st.write("**Size:**", format_size(result['size']))
+            st.write("**Tasks:**", format_array_field(result['tasks']))
+            if result.get('subject_count'):
+                st.write("**Subjects:**", result['subject_count'])
+
+        render_related(result['id'])
+        render_description(result['id'])
+        st.markdown("---")
 
 def main():
+    start_metrics_server()
+    with metrics.timer("page_seconds"):
+        render_page()
+
+def render_page():
     st.title("Neuroscience Dataset Search") # TODO: Make this dynamic
-    connection_url = "https://74ab-75-50-53-185.ngrok-free.app" 
-    mq = marqo.Client(url=connection_url)
-    index_stats = mq.index("neuroscience_datasets").get_stats()
-    st.markdown(f"Search a list of :blue[**{index_stats['numberOfDocuments']}**] neuroscience datasets from OpenNeuro, DANDI, and more using natural language.")
+    st.session_state["searched_query"] = st.session_state.get("query", "")
+    st.session_state.pop("search_now", None)
+    prefetched = None
+    if SEARCH_SERVICE_URL:
+        with metrics.timer("fetch_page_seconds"):
+            prefetched = fetch_page(get_service_backend())
+    catalogue = get_catalogue()
+    if prefetched is not None:
+        total_datasets = prefetched['stats']['numberOfDocuments']
+    elif catalogue is not None:
+        total_datasets = catalogue.total
+    else:
+        total_datasets = get_backend().get_stats()['numberOfDocuments']
+    st.markdown(f"Search a list of :blue[**{total_datasets}**] neuroscience datasets from OpenNeuro, DANDI, and more using natural language.")
     
     col1, col2 = st.columns([3, 1])
     
     with col1:
-        query = st.text_input("Search datasets", placeholder="Enter keywords, modalities, species, etc.")
+        query = search_box()
     
     with col2:
-        limit = st.number_input("Results limit", min_value=1, max_value=100, value=10)
+        page_size = st.selectbox("Results per page", options=PAGE_SIZES, index=0, key="page_size")
     
-    initial_results = search_datasets("dataset", None, limit)
-    
-    if query == "":
-        filter_options = get_all_filter_options()
+    facet_index = get_facet_index()
+    if prefetched is not None:
+        facet_counts = prefetched['facets']
     else:
-        filter_options = get_filter_options_from_results(initial_results)
+        with metrics.timer("filter_options_seconds", source="catalogue" if facet_index is not None else "backend"):
+            if facet_index is not None:
+                facet_counts = get_facet_counts(facet_index, query)
+            else:
+                if query == "":
+                    filter_options = get_all_filter_options(get_backend().version)
+                else:
+                    initial_results = search_datasets(query, None, page_size, attributes_to_retrieve=['modalities', 'species', 'tasks'])
+                    filter_options = get_filter_options_from_results(initial_results)
+                facet_counts = {field: dict.fromkeys(filter_options.get(field, [])) for field, _, _, _ in FACET_FILTERS}
 
     st.sidebar.header("Filters")
     
-    modality = st.sidebar.selectbox(
-        "Modality",
-        options=[""] + filter_options['modalities'],
-        format_func=lambda x: "All Modalities" if x == "" else x
-    )
-    
-    species = st.sidebar.selectbox(
-        "Species",
-        options=[""] + filter_options['species'],
-        format_func=lambda x: "All Species" if x == "" else x
-    )
-    
-    tasks = st.sidebar.selectbox(
-        "Tasks",
-        options=[""] + filter_options['tasks'],
-        format_func=lambda x: "All Tasks" if x == "" else x
-    )
+    selected = {}
+    for field, key, label, placeholder in FACET_FILTERS:
+        counts = facet_counts[field]
+        current = st.session_state.get(f"filter_{key}", "")
+        options = [""] + list(counts)
+        if current and current not in counts:
+            options.append(current)
+        selected[key] = st.sidebar.selectbox(
+            label,
+            options=options,
+            key=f"filter_{key}",
+            format_func=lambda x, counts=counts, placeholder=placeholder: placeholder if x == "" else (
+                x if counts.get(x) is None else f"{x} ({counts[x]})"
+            )
+        )
     
     st.sidebar.subheader("Dataset Size")
     col1, col2 = st.sidebar.columns(2)
@@ -169,7 +583,8 @@ def main():
             min_value=0.0, 
             value=0.000000001,  # Default to 1 byte (in GB)
             step=1.0,
-            format="%.9f"
+            format="%.9f",
+            key="min_size"
         )
     with col2:
         max_size = st.number_input(
@@ -177,63 +592,54 @@ def main():
             min_value=0.0, 
             value=0.0,
             step=1.0,
-            help="Set to 0 for no maximum limit"
+            help="Set to 0 for no maximum limit",
+            key="max_size"
         )
-    
-    # Convert to bytes, but ensure at least 1 byte by default
-    min_size_bytes = max(int(min_size * 1_000_000_000), 1)
-    max_size_bytes = int(max_size * 1_000_000_000) if max_size > 0 else None
-    
-    filters = {}
-    if modality:
-        filters['modality'] = modality
-    if species:
-        filters['species'] = species
-    if tasks:
-        filters['tasks'] = tasks
-    if min_size > 0:
-        filters['min_size'] = min_size_bytes
-    if max_size > 0:
-        filters['max_size'] = max_size_bytes
+    if facet_counts.get('size'):
+        st.sidebar.caption("By size: " + " · ".join(f"{bucket} ({count})" for bucket, count in facet_counts['size'].items()))
+
+    ranges = {}
+    # Date and subject-count ranges and sorting need the catalogue, here or in the service
+    if SEARCH_SERVICE_URL or catalogue is not None:
+        st.sidebar.subheader("Published")
+        col1, col2 = st.sidebar.columns(2)
+        with col1:
+            min_date = st.date_input("From", value=None, key="min_date")
+        with col2:
+            max_date = st.date_input("Until", value=None, key="max_date")
+        min_subjects = st.sidebar.number_input("Min Subjects", min_value=0, value=0, step=1, key="min_subjects")
+        sort = st.sidebar.selectbox("Sort by", options=list(SORT_LABELS), format_func=SORT_LABELS.get, key="sort")
+        ranges = range_filters(min_date, max_date, min_subjects, sort)
+
+    filters = build_filters(selected, min_size, max_size, ranges)
     
     if query or filters:
-        results = search_datasets(query if query else "*", filters, limit)
+        page = current_page(query, filters, page_size)
+        if prefetched is not None and prefetched['key'] == (normalize_query(query) or "*", filters, page_size, page):
+            show_active_filters(filters)
+            results = prefetched['hits']
+        else:
+            # One extra hit tells us whether there is a next page
+            with metrics.timer("search_datasets_seconds"):
+                results = search_datasets(query if query else "*", filters, page_size + 1, offset=page * page_size, log=True)
+        has_next = len(results) > page_size
+        results = results[:page_size]
         
         if not results:
             st.warning("No results found matching your criteria.")
         
-        for result in results:
-            with st.container():
-                dataset_url = format_dataset_url(result['id'], result['source'])
-                st.markdown(f"### [{result['name']}]({dataset_url})")
-                st.markdown(f"**ID**: {result['id']}")
-                
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.write("**Modalities:**", format_array_field(result['modalities']))
-                    if result.get('species'):
-                        st.write("**Species:**", format_array_field(result['species']))
-                with col2:
-                    if result.get('doi'):
-                        st.write("**DOI:**", result['doi'])
-                    st.write("**Published:**", result['date_created'])
-                    if result.get('data_standard'):
-                        st.write("**Standard:**", result['data_standard'])
-                with col3:
-                    st.write("**Size:**", format_size(result['size']))
-                    st.write("**Tasks:**", format_array_field(result['tasks']))
-                    if result.get('subject_count'):
-                        st.write("**Subjects:**", result['subject_count'])
-                
-                if result.get('description'):
-                    with st.expander("Show Description"):
-                        preview = result['description'][:500] + "..." if len(result['description']) > 500 else result['description']
-                        readme_container = st.empty()
-                        readme_container.text(preview)
-                        if len(result['description']) > 500:
-                            if st.button("Show Full Description", key=f"desc_{result['id']}"):
-                                readme_container.text(result['description'])
-                st.markdown("---")
+        with metrics.timer("render_results_seconds"):
+            for result in results:
+                render_result(result)
+        
+        if page > 0 or has_next:
+            col1, col2, col3 = st.columns([1, 2, 1])
+            with col1:
+                st.button("← Previous", disabled=page == 0, on_click=change_page, args=(-1,))
+            with col2:
+                st.markdown(f"Page {page + 1} · results {page * page_size + 1}–{page * page_size + len(results)}")
+            with col3:
+                st.button("Next →", disabled=not has_next, on_click=change_page, args=(1,))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
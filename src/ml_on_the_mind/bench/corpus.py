@@ -0,0 +1,186 @@
+"""Synthetic corpora for the benchmarks.
+
+Record `i` of a corpus is generated from (seed, i) alone, so a stub server can
+serve any page of a million-record corpus without holding it in memory, and two
+runs with the same seed see identical data. Descriptions follow a log-normal
+length distribution (median ~250 words, a long tail of multi-thousand-word
+readmes, some empty) over a Zipf-distributed vocabulary, so chunking, BM25 and
+dedup see realistic text rather than a dozen repeated words.
+"""
+import math
+import random
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+from typing import Dict, Iterator, List, Optional
+import numpy as np
+from ..data.cache_io import JsonlWriter
+
+SOURCES = ["openneuro", "dandi"]
+MEDIAN_DESCRIPTION_WORDS = 250
+MAX_DESCRIPTION_WORDS = 5000
+EMPTY_DESCRIPTION_RATE = 0.08
+# Every DUPLICATE_EVERY-th DANDI record copies the preceding OpenNeuro record's text, for dedup
+DUPLICATE_EVERY = 50
+VOCABULARY_SIZE = 5000
+MODALITIES = ["MRI", "mri", "fMRI", "EEG", "eeg", "MEG", "iEEG", "beh", "dwi", "pet",
+              "ElectricalSeries", "TwoPhotonSeries", "ImageSeries", "Units", "LFP"]
+SPECIES = ["Human", "human", "Homo sapiens", "Homo sapiens - Human", "Mus musculus - House mouse",
+           "mouse", "Rattus norvegicus - Norway rat", "Macaca mulatta", "Danio rerio", None]
+STANDARDS = ["BIDS", "NWB", "Neurodata Without Borders (NWB)", None]
+TECHNIQUES = ["two-photon microscopy technique", "patch clamp technique", "multi electrode extracellular electrophysiology recording technique",
+              "behavioral technique", "analytical technique", "surgical technique", "spike sorting technique"]
+EPOCH = datetime(2015, 1, 1, tzinfo=timezone.utc)
+
+def _vocabulary(size: int = VOCABULARY_SIZE) -> List[str]:
+    rng = random.Random(0)
+    onsets = ["b", "c", "d", "f", "g", "h", "l", "m", "n", "p", "r", "s", "t", "v", "st", "tr", "pl", "cr"]
+    nuclei = ["a", "e", "i", "o", "u", "io", "ea", "ou"]
+    codas = ["", "n", "r", "s", "l", "x", "nt", "ct", "m"]
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(onsets) + rng.choice(nuclei) + rng.choice(codas)
+                          for _ in range(rng.randint(1, 4))))
+    return sorted(words)
+
+VOCABULARY = _vocabulary()
+# Zipf weights: a few very common words, a long tail of rare ones
+CUMULATIVE_WEIGHTS = list(accumulate(1.0 / rank for rank in range(1, VOCABULARY_SIZE + 1)))
+_WORDS = np.array(VOCABULARY, dtype=object)
+_CUMULATIVE_PROBABILITIES = np.asarray(CUMULATIVE_WEIGHTS) / CUMULATIVE_WEIGHTS[-1]
+TASKS = [f"{VOCABULARY[i]} {VOCABULARY[i + 1]}" for i in range(0, 1000, 2)]
+
+def _rng(seed: int, i: int) -> random.Random:
+    return random.Random(seed * 1_000_003 + i)
+
+def _description(rng: random.Random, seed: int, i: int) -> str:
+    if rng.random() < EMPTY_DESCRIPTION_RATE:
+        return ""
+    words = min(int(rng.lognormvariate(math.log(MEDIAN_DESCRIPTION_WORDS), 1.0)), MAX_DESCRIPTION_WORDS)
+    # Sampling hundreds of words is most of the generation cost; NumPy does it ~3x faster
+    uniform = np.random.default_rng([seed, i]).random(words)
+    return " ".join(_WORDS[np.searchsorted(_CUMULATIVE_PROBABILITIES, uniform)])
+
+def source_of(i: int) -> str:
+    return SOURCES[i % len(SOURCES)]
+
+def synthetic_record(i: int, seed: int = 0) -> Dict:
+    """Record `i` as the crawlers cache it (before cleaning), with the messy
+    spellings and stringly-typed counts seen in real caches"""
+    rng = _rng(seed, i)
+    source = source_of(i)
+    created = EPOCH + timedelta(seconds=rng.randint(0, 10 * 365 * 86400))
+    name = " ".join(rng.choices(VOCABULARY, cum_weights=CUMULATIVE_WEIGHTS, k=rng.randint(3, 12))).capitalize()
+    description = _description(rng, seed, i)
+    if source == "dandi" and i % DUPLICATE_EVERY == 1:
+        # The same study deposited in both archives
+        twin = synthetic_record(i - 1, seed)
+        name, description = twin['name'], twin['description']
+    dataset_id = f"ds{i:06d}" if source == "openneuro" else f"{i:06d}/draft"
+    return {
+        'id': dataset_id,
+        'name': name,
+        'description': description,
+        'modalities': rng.sample(MODALITIES, rng.randint(0, 3)),
+        'species': [species] if (species := rng.choice(SPECIES)) else [],
+        'tasks': rng.sample(TASKS, rng.randint(0, 4)) if source == "openneuro" else rng.sample(TECHNIQUES, rng.randint(0, 3)),
+        'size': rng.choice([rng.randint(0, 10**12), str(rng.randint(0, 10**12))]),
+        'doi': f"10.18112/openneuro.ds{i:06d}.v1.0.0" if rng.random() < 0.5 else None,
+        'url': f"https://example.org/{dataset_id}",
+        'source': source,
+        'date_created': created.isoformat(),
+        'authors': [f"{rng.choice(VOCABULARY).capitalize()} {rng.choice(VOCABULARY).capitalize()}"
+                    for _ in range(rng.randint(0, 6))] if source == "dandi" else [],
+        'license': "spdx:CC-BY-4.0" if source == "dandi" else None,
+        'subject_count': rng.choice([rng.randint(0, 300), str(rng.randint(0, 300)), None]),
+        'data_standard': rng.choice(STANDARDS),
+    }
+
+def iter_corpus(count: int, seed: int = 0, source: Optional[str] = None) -> Iterator[Dict]:
+    for i in range(count):
+        if source is None or source_of(i) == source:
+            yield synthetic_record(i, seed)
+
+def source_count(count: int, source: str) -> int:
+    """Records of `source` among the first `count`"""
+    offset = SOURCES.index(source)
+    return max((count - offset + len(SOURCES) - 1) // len(SOURCES), 0)
+
+def source_record(k: int, source: str, seed: int = 0) -> Dict:
+    """The k-th record of `source`"""
+    return synthetic_record(k * len(SOURCES) + SOURCES.index(source), seed)
+
+def write_cache(count: int, data_dir: str, seed: int = 0) -> Dict[str, int]:
+    """Write the corpus as crawler cache files, one per source, without holding it in memory"""
+    counts = {}
+    for source in SOURCES:
+        with JsonlWriter(f"{data_dir}/{source}_datasets.jsonl") as writer:
+            for record in iter_corpus(count, seed, source):
+                writer.write(record)
+        counts[source] = writer.count
+    return counts
+
+# Upstream API payloads, for the stub servers
+
+def openneuro_node(record: Dict) -> Dict:
+    """A node of OpenNeuro's GraphQL `datasets` listing, readme included"""
+    return {
+        'id': record['id'],
+        'metadata': {
+            'species': record['species'][0] if record['species'] else None,
+            'datasetId': record['id'],
+            'datasetName': record['name'],
+            'associatedPaperDOI': record['doi'],
+            'modalities': record['modalities'],
+            'tasksCompleted': record['tasks'],
+            'datasetUrl': record['url'],
+        },
+        'name': record['name'],
+        'draft': {'size': record['size'], 'modified': record['date_created'], 'readme': record['description']},
+        'publishDate': record['date_created'],
+    }
+
+def _dandi_version(record: Dict) -> Dict:
+    return {
+        'version': "draft",
+        'name': record['name'],
+        'asset_count': 1,
+        'size': int(record['size']),
+        'created': record['date_created'],
+        'modified': record['date_created'],
+        'status': "Valid",
+    }
+
+def dandi_listing(record: Dict) -> Dict:
+    """An entry of the DANDI API's /dandisets/ listing"""
+    return {
+        'identifier': record['id'].split("/", 1)[0],
+        'created': record['date_created'],
+        'modified': record['date_created'],
+        'contact_person': record['authors'][0] if record['authors'] else "",
+        'embargo_status': "OPEN",
+        'most_recent_published_version': None,
+        'draft_version': _dandi_version(record),
+    }
+
+def dandi_metadata(record: Dict) -> Dict:
+    """Raw metadata of a dandiset version, as /dandisets/{id}/versions/{version}/ returns it"""
+    identifier = record['id'].split("/", 1)[0]
+    return {
+        'identifier': f"DANDI:{identifier}",
+        'version': "draft",
+        'name': record['name'],
+        'description': record['description'],
+        'url': f"https://dandiarchive.org/dandiset/{identifier}/draft",
+        'doi': record['doi'] or "",
+        'dateCreated': record['date_created'],
+        'license': [record['license']],
+        'contributor': [{'name': author, 'roleName': ["dcite:Author"]} for author in record['authors']],
+        'assetsSummary': {
+            'species': [{'name': species} for species in record['species']],
+            'variableMeasured': record['modalities'],
+            'measurementTechnique': [{'name': task} for task in record['tasks']],
+            'numberOfBytes': int(record['size']),
+            'numberOfSubjects': record['subject_count'],
+            'dataStandard': [{'name': record['data_standard']}] if record['data_standard'] else [],
+        },
+    }
@@ -0,0 +1,270 @@
+"""End-to-end benchmark: crawl, clean, index and query a synthetic corpus against local stubs.
+
+Each stage runs in a fresh process, so its peak RSS is its own, while the stub
+servers run in this one. Results are written to cache/benchmarks/<timestamp>.json
+and compared against a baseline:
+
+    python -m src.ml_on_the_mind.bench.run --records 10000 --save-baseline
+    # ...make a change...
+    python -m src.ml_on_the_mind.bench.run --records 10000
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from .corpus import MODALITIES, VOCABULARY, write_cache
+from .stubs import dandi_stub, marqo_stub, openneuro_stub
+
+RESULTS_DIR = os.path.join("cache", "benchmarks")
+BASELINE_PATH = os.path.join(RESULTS_DIR, "baseline.json")
+INDEX_NAME = "benchmark"
+# Relative change beyond which a metric is reported as a regression
+TOLERANCE = 0.10
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+def _rate(count: int, elapsed: float) -> float:
+    return count / max(elapsed, 1e-9)
+
+def _percentiles(latencies: List[float], prefix: str) -> Dict[str, float]:
+    milliseconds = np.asarray(latencies) * 1000
+    return {f"{prefix}_p50_ms": float(np.percentile(milliseconds, 50)),
+            f"{prefix}_p99_ms": float(np.percentile(milliseconds, 99))}
+
+# Stages run in child processes with the work directory as their cwd, so the
+# crawlers and build steps read and write its cache/ exactly as they do in production
+
+def crawl_stage(openneuro_url: str, dandi_url: str) -> Dict[str, float]:
+    from ..download.dandi_downloader import DandiDownloader
+    from ..download.openneuro_downloader import OpenNeuroDownloader
+
+    start = time.perf_counter()
+    openneuro = OpenNeuroDownloader(api_url=f"{openneuro_url}/crn/graphql").fetch_datasets()
+    openneuro_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    dandi = DandiDownloader(api_url=f"{dandi_url}/api", requests_per_second=0).fetch_datasets()
+    dandi_elapsed = time.perf_counter() - start
+    return {
+        'openneuro_records_per_sec': _rate(len(openneuro), openneuro_elapsed),
+        'dandi_records_per_sec': _rate(len(dandi), dandi_elapsed),
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+def clean_stage() -> Dict[str, float]:
+    from ..data.dedup import dedupe_datasets
+    from ..data.utils import iter_datasets
+
+    start = time.perf_counter()
+    datasets = list(iter_datasets())
+    clean_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    dedupe_datasets(datasets)
+    dedupe_elapsed = time.perf_counter() - start
+    return {
+        'clean_records_per_sec': _rate(len(datasets), clean_elapsed),
+        'dedupe_records_per_sec': _rate(len(datasets), dedupe_elapsed),
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+def index_marqo_stage(marqo_url: str, batch_size: int, workers: int) -> Dict[str, float]:
+    import marqo
+    from ..build_vector_db import MODEL, TEXT_PREPROCESSING, build_documents, cleaned_datasets, index_documents
+
+    documents = list(build_documents(cleaned_datasets()))
+    mq = marqo.Client(url=marqo_url)
+    mq.create_index(INDEX_NAME, model=MODEL, text_preprocessing=TEXT_PREPROCESSING)
+    start = time.perf_counter()
+    indexed, _ = index_documents(mq, INDEX_NAME, documents, batch_size=batch_size, workers=workers)
+    return {'marqo_docs_per_sec': _rate(indexed, time.perf_counter() - start), 'peak_rss_mb': _peak_rss_mb()}
+
+def index_local_stage(embedder: str) -> Dict[str, float]:
+    from ..build_vector_db import build_documents, cleaned_datasets
+    from ..search.backends import LOCAL_INDEX_DIR, build_local_index
+    from ..search.embedders import load_embedder
+    from ..search.lexical import LexicalIndexBuilder
+
+    lexical = LexicalIndexBuilder()
+    documents = list(build_documents(lexical.track(cleaned_datasets())))
+    start = time.perf_counter()
+    build_local_index(documents, load_embedder(embedder), path=LOCAL_INDEX_DIR)
+    local_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    lexical.save()
+    return {
+        'local_docs_per_sec': _rate(len(documents), local_elapsed),
+        'lexical_save_seconds': time.perf_counter() - start,
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+def benchmark_queries(count: int, seed: int = 0) -> List[tuple]:
+    """(query, filters) pairs: popular queries plus random vocabulary, a fifth of them filtered"""
+    from ..search.query_cache import load_top_queries
+
+    rng = np.random.default_rng(seed)
+    top = load_top_queries()
+    queries = []
+    for i in range(count):
+        query = top[i % len(top)] if i % 2 == 0 and top else " ".join(rng.choice(VOCABULARY[:500], size=rng.integers(1, 4)))
+        filters = {'modality': str(rng.choice(MODALITIES))} if i % 5 == 0 else None
+        queries.append((query, filters))
+    return queries
+
+def query_stage(marqo_url: str, embedder: str, count: int) -> Dict[str, float]:
+    import marqo
+    from ..search.backends import LocalBackend, HybridBackend, MarqoBackend
+    from ..search.embedders import load_embedder
+    from ..search.lexical import LexicalIndex
+
+    local = LocalBackend(embedder=load_embedder(embedder))
+    backends = {
+        'marqo': MarqoBackend(marqo.Client(url=marqo_url), INDEX_NAME),
+        'local': local,
+        'hybrid': HybridBackend(local, LexicalIndex.load()),
+    }
+    queries = benchmark_queries(count)
+    results = {}
+    for name, backend in backends.items():
+        # One untimed query loads models and pages in the index
+        backend.search(queries[0][0], limit=10)
+        latencies = []
+        for query, filters in queries:
+            start = time.perf_counter()
+            backend.search(query, filters, limit=10)
+            latencies.append(time.perf_counter() - start)
+        results.update(_percentiles(latencies, f"{name}_query"))
+    results['peak_rss_mb'] = _peak_rss_mb()
+    return results
+
+def _in_workdir(workdir: str, function: Callable, *args) -> Dict[str, float]:
+    os.chdir(workdir)
+    os.environ.setdefault("TQDM_DISABLE", "1")
+    # Don't let the DANDI client check PyPI for updates on every run
+    os.environ.setdefault("DANDI_NO_ET", "1")
+    return function(*args)
+
+def run_stage(workdir: str, function: Callable, *args) -> Dict[str, float]:
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        return executor.submit(_in_workdir, workdir, function, *args).result()
+
+def run_benchmarks(args) -> Dict:
+    workdir = args.workdir or tempfile.mkdtemp(prefix="ml_on_the_mind_bench_")
+    os.makedirs(os.path.join(workdir, "cache"), exist_ok=True)
+    latency = args.latency_ms / 1000
+    results = {}
+    try:
+        with openneuro_stub(args.records, args.seed, latency) as openneuro, \
+                dandi_stub(args.records, args.seed, latency) as dandi, \
+                marqo_stub(latency) as marqo_server:
+            stages = [
+                ('crawl', crawl_stage, openneuro.url, dandi.url),
+                ('clean', clean_stage),
+                ('index_marqo', index_marqo_stage, marqo_server.url, args.batch_size, args.workers),
+                ('index_local', index_local_stage, args.embedder),
+                ('query', query_stage, marqo_server.url, args.embedder, args.queries),
+            ]
+            if args.skip_crawl:
+                # Write the cache directly; crawling a million records over HTTP takes a while
+                counts = write_cache(args.records, os.path.join(workdir, "cache"), args.seed)
+                print(f"Wrote synthetic cache: {counts}")
+                stages = stages[1:]
+            for name, function, *stage_args in stages:
+                print(f"Running {name} benchmark...")
+                start = time.perf_counter()
+                results[name] = run_stage(workdir, function, *stage_args)
+                print(f"  {name}: {time.perf_counter() - start:.1f}s {results[name]}")
+    finally:
+        if not args.workdir and not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def save_results(report: Dict, path: str):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results to {path}")
+
+def _higher_is_better(metric: str) -> bool:
+    return metric.endswith("_per_sec")
+
+def compare(report: Dict, baseline: Dict, tolerance: float = TOLERANCE) -> List[str]:
+    """Print each metric against the baseline; returns the metrics that regressed by more than `tolerance`"""
+    settings = ['records', 'embedder', 'latency_ms', 'crawled']
+    if [baseline.get(key) for key in settings] != [report.get(key) for key in settings]:
+        # Crawled and generated caches differ in shape (e.g. mapped vs. raw counts), so cleaning isn't comparable either
+        print("Warning: the baseline was run with different settings: " + ", ".join(
+            f"{key} {baseline.get(key)} -> {report.get(key)}" for key in settings if baseline.get(key) != report.get(key)))
+    regressions = []
+    print(f"{'metric':<40} {'baseline':>12} {'current':>12} {'change':>8}")
+    for stage, metrics in report['results'].items():
+        for metric, value in metrics.items():
+            previous = baseline.get('results', {}).get(stage, {}).get(metric)
+            if previous is None:
+                continue
+            change = (value - previous) / previous if previous else 0.0
+            worse = -change if _higher_is_better(metric) else change
+            flag = "  REGRESSION" if worse > tolerance else ""
+            if flag:
+                regressions.append(f"{stage}.{metric}")
+            print(f"{stage + '.' + metric:<40} {previous:>12.2f} {value:>12.2f} {change:>+7.1%}{flag}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark crawl, cleaning, indexing and queries on a synthetic corpus")
+    parser.add_argument("--records", type=int, default=10_000, help="Synthetic datasets in the corpus (1k-1M)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=200, help="Queries timed per backend")
+    parser.add_argument("--embedder", default="hashing", help="Encoder for the local index (e5 needs sentence-transformers)")
+    parser.add_argument("--batch-size", type=int, default=100, help="Documents per Marqo add_documents request")
+    parser.add_argument("--workers", type=int, default=4, help="Marqo batches indexed concurrently")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Added to every stub response, to mimic a network hop")
+    parser.add_argument("--skip-crawl", action="store_true", help="Generate the cache directly instead of crawling the stubs")
+    parser.add_argument("--workdir", help="Directory for the benchmark's cache (default: a temporary directory)")
+    parser.add_argument("--keep-workdir", action="store_true", help="Don't delete the temporary work directory")
+    parser.add_argument("--output", help=f"Results file (default: {RESULTS_DIR}/<timestamp>.json)")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Also save these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="Relative change reported as a regression")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args)
+    report = {
+        'created': datetime.now().isoformat(timespec="seconds"),
+        'commit': _git_commit(),
+        'records': args.records,
+        'embedder': args.embedder,
+        'latency_ms': args.latency_ms,
+        'crawled': not args.skip_crawl,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    save_results(report, args.output or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d_%H%M%S}.json"))
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+    if args.save_baseline:
+        save_results(report, args.baseline)
+    if regressions:
+        print(f"{len(regressions)} metrics regressed by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
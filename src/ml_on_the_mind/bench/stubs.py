@@ -0,0 +1,305 @@
+"""Local stand-ins for the OpenNeuro GraphQL API, the DANDI API and Marqo.
+
+They speak just enough of each protocol for the real clients used by the
+crawlers and the app (requests, DandiAPIClient, marqo.Client) to run against
+them unchanged, serve the synthetic corpus from `corpus.py`, and can add a fixed
+per-request latency to mimic a network hop. Marqo's stand-in embeds with the
+hashing embedder and scores brute force, so it measures client, protocol and
+pipeline overhead, not Marqo's own search speed.
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+import numpy as np
+from marqo.version import minimum_supported_marqo_version
+from ..search.embedders import HashingEmbedder
+from .corpus import dandi_listing, dandi_metadata, openneuro_node, source_count, source_record
+
+class StubServer:
+    """Runs a handler on a free local port in a daemon thread"""
+
+    def __init__(self, handler: type, latency: float = 0.0, **state):
+        handler_class = type(handler.__name__, (handler,), {'latency': latency, **state})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler_class)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self) -> "StubServer":
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.server.shutdown()
+        self.server.server_close()
+        return False
+
+class _JsonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def _reply(self, payload, status: int = 200):
+        if self.latency:
+            time.sleep(self.latency)
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _not_found(self):
+        self._reply({'detail': f"Not found: {self.path}"}, 404)
+
+class OpenNeuroHandler(_JsonHandler):
+    """POST /crn/graphql: the paginated `datasets` listing, and aliased `dataset(id:)` readme batches"""
+    count = 0
+    seed = 0
+
+    def do_POST(self):
+        request = self._body() or {}
+        query = request.get('query', "")
+        variables = request.get('variables') or {}
+        if "datasets(" in query:
+            self._reply(self._datasets_page(variables))
+        elif "dataset(id:" in query:
+            self._reply({'data': self._readmes(variables)})
+        else:
+            self._reply({'errors': [{'message': "Unsupported query"}]})
+
+    def _datasets_page(self, variables: Dict) -> Dict:
+        total = source_count(self.count, "openneuro")
+        start = int(variables.get('after') or 0)
+        end = min(start + int(variables.get('first') or 100), total)
+        edges = []
+        for k in range(start, end):
+            node = openneuro_node(source_record(k, "openneuro", self.seed))
+            # Readmes are fetched in a second pass, as from the real API's lightweight listing
+            node['draft'] = {key: value for key, value in node['draft'].items() if key != 'readme'}
+            edges.append({'node': node})
+        return {'data': {'datasets': {'edges': edges, 'pageInfo': {'hasNextPage': end < total, 'endCursor': str(end)}}}}
+
+    def _readmes(self, variables: Dict) -> Dict:
+        data = {}
+        for name, dataset_id in variables.items():
+            # ds000042 is the 21st OpenNeuro record: corpus ids are global record numbers
+            record = source_record(int(dataset_id[2:]) // 2, "openneuro", self.seed)
+            data[f"d{name[2:]}"] = {'draft': {'readme': record['description']}}
+        return data
+
+class DandiHandler(_JsonHandler):
+    """Server info, the /api/dandisets/ listing (page-numbered, like the real API) and version metadata"""
+    count = 0
+    seed = 0
+    VERSION_PATH = re.compile(r"^/api/dandisets/(?P<id>\d+)/versions/(?P<version>[^/]+)/$")
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path in ("/server-info", "/api/info/"):
+            self._reply(self._server_info())
+        elif url.path == "/api/dandisets/":
+            self._reply(self._listing(url.path, dict(parse_qsl(url.query))))
+        elif (match := self.VERSION_PATH.match(url.path)):
+            self._reply(dandi_metadata(source_record(int(match.group('id')) // 2, "dandi", self.seed)))
+        else:
+            self._not_found()
+
+    def _base_url(self) -> str:
+        return f"http://{self.headers['Host']}"
+
+    def _server_info(self) -> Dict:
+        return {
+            'version': "0.0.0",
+            'services': {'api': {'url': f"{self._base_url()}/api"}, 'webui': {'url': self._base_url()}},
+            'cli-minimal-version': "0.0.0",
+            'cli-bad-versions': [],
+        }
+
+    def _listing(self, path: str, params: Dict) -> Dict:
+        total = source_count(self.count, "dandi")
+        page = int(params.get('page', 1))
+        page_size = int(params.get('page_size', 100))
+        start = (page - 1) * page_size
+        end = min(start + page_size, total)
+        next_url = f"{self._base_url()}{path}?{urlencode({**params, 'page': page + 1})}" if end < total else None
+        return {
+            'count': total,
+            'next': next_url,
+            'previous': None,
+            'results': [dandi_listing(source_record(k, "dandi", self.seed)) for k in range(start, end)],
+        }
+
+class _StubIndex:
+    def __init__(self, embedder: HashingEmbedder):
+        self.embedder = embedder
+        self.documents: Dict[str, Dict] = {}
+        self.rows: Dict[str, int] = {}
+        self.vectors: List[np.ndarray] = []
+        self.ids: List[Optional[str]] = []
+        self._matrix = None
+
+    def add(self, documents: List[Dict], tensor_fields: List[str]) -> List[Dict]:
+        texts = [" ".join(str(doc.get(field, "")) for field in tensor_fields) for doc in documents]
+        vectors = self.embedder.embed(texts, kind="passage")
+        for doc, vector in zip(documents, vectors):
+            doc_id = doc['_id']
+            self.documents[doc_id] = {key: value for key, value in doc.items() if key not in tensor_fields or key == 'name'}
+            if doc_id in self.rows:
+                self.vectors[self.rows[doc_id]] = vector
+            else:
+                self.rows[doc_id] = len(self.ids)
+                self.ids.append(doc_id)
+                self.vectors.append(vector)
+        self._matrix = None
+        return [{'_id': doc['_id'], 'status': 200} for doc in documents]
+
+    def delete(self, ids: List[str]):
+        for doc_id in ids:
+            if self.documents.pop(doc_id, None) is not None:
+                self.ids[self.rows.pop(doc_id)] = None
+        self._matrix = None
+
+    def matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            self._matrix = np.stack(self.vectors) if self.vectors else np.zeros((0, self.embedder.dimension), dtype=np.float32)
+        return self._matrix
+
+def _matches(doc: Dict, filter_string: Optional[str]) -> bool:
+    """The subset of Marqo's filter DSL that build_filter_string produces"""
+    if not filter_string:
+        return True
+    for condition in filter_string.split(" AND "):
+        field, _, value = condition.partition(":")
+        actual = doc.get(field)
+        if value.startswith("[") and value.endswith("]"):
+            low, _, high = value[1:-1].partition(" TO ")
+            number = float(actual or 0)
+            if (low != "*" and number < float(low)) or (high != "*" and number > float(high)):
+                return False
+        elif value not in (actual if isinstance(actual, list) else [actual]):
+            return False
+    return True
+
+class MarqoHandler(_JsonHandler):
+    """Index management, add/get/delete documents, search (by text or context vector), embed and stats"""
+    indexes: Dict[str, _StubIndex] = None
+    lock: threading.Lock = None
+    dimension = 64
+    INDEX_PATH = re.compile(r"^/indexes/(?P<name>[^/]+)(?P<rest>/.*)?$")
+
+    def _index(self) -> Tuple[Optional[str], Optional[_StubIndex], str]:
+        match = self.INDEX_PATH.match(urlsplit(self.path).path)
+        if not match:
+            return None, None, ""
+        return match.group('name'), self.indexes.get(match.group('name')), match.group('rest') or ""
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path in ("", "/"):
+            # Whatever the installed client requires, so it doesn't warn about the stub
+            self._reply({'message': "Welcome to Marqo", 'version': minimum_supported_marqo_version()})
+            return
+        if path == "/indexes":
+            self._reply({'results': [{'indexName': name} for name in self.indexes]})
+            return
+        name, index, rest = self._index()
+        if index is None:
+            self._reply({'message': f"Index {name} not found", 'code': "index_not_found"}, 404)
+        elif rest == "/stats":
+            self._reply({'numberOfDocuments': len(index.documents), 'numberOfVectors': len(index.documents)})
+        elif rest == "/documents":
+            ids = self._body() or []
+            self._reply({'results': [{**index.documents[doc_id], '_found': True} if doc_id in index.documents
+                                     else {'_id': doc_id, '_found': False} for doc_id in ids]})
+        elif rest.startswith("/documents/"):
+            doc = index.documents.get(rest[len("/documents/"):])
+            if doc is None:
+                self._not_found()
+            else:
+                self._reply(doc)
+        elif rest in ("/settings", "/health"):
+            self._reply({'status': "green"})
+        else:
+            self._not_found()
+
+    def do_POST(self):
+        name, index, rest = self._index()
+        body = self._body()
+        if name is None:
+            self._not_found()
+        elif rest == "":
+            with self.lock:
+                self.indexes[name] = _StubIndex(HashingEmbedder(self.dimension))
+            self._reply({'acknowledged': True, 'index': name})
+        elif index is None:
+            self._reply({'message': f"Index {name} not found", 'code': "index_not_found"}, 404)
+        elif rest == "/documents":
+            with self.lock:
+                items = index.add(body['documents'], body.get('tensorFields') or [])
+            self._reply({'errors': False, 'items': items, 'processingTimeMs': 0})
+        elif rest == "/documents/delete-batch":
+            with self.lock:
+                index.delete(body)
+            self._reply({'details': {'deletedDocuments': len(body)}})
+        elif rest == "/search":
+            self._reply(self._search(index, body))
+        elif rest == "/embed":
+            content = body['content'] if isinstance(body['content'], list) else [body['content']]
+            self._reply({'content': body['content'], 'embeddings': index.embedder.embed(content, kind="query").tolist()})
+        else:
+            self._not_found()
+
+    def do_DELETE(self):
+        name, index, _ = self._index()
+        with self.lock:
+            self.indexes.pop(name, None)
+        self._reply({'acknowledged': True})
+
+    def _search(self, index: _StubIndex, body: Dict) -> Dict:
+        limit = body.get('limit', 10)
+        offset = body.get('offset', 0)
+        query = body.get('q')
+        with self.lock:
+            matrix = index.matrix()
+            ids = list(index.ids)
+        if body.get('context'):
+            vector = np.sum([np.asarray(item['vector'], dtype=np.float32) * item.get('weight', 1)
+                             for item in body['context']['tensor']], axis=0)
+            scores = matrix @ vector
+        elif query and query != "*":
+            scores = matrix @ index.embedder.embed([query], kind="query")[0]
+        else:
+            scores = np.zeros(len(ids), dtype=np.float32)
+        hits = []
+        attributes = body.get('attributesToRetrieve')
+        for row in np.argsort(-scores, kind="stable"):
+            doc = index.documents.get(ids[row]) if ids[row] is not None else None
+            if doc is None or not _matches(doc, body.get('filter')):
+                continue
+            if len(hits) >= offset + limit:
+                break
+            fields = {key: doc[key] for key in attributes if key in doc} if attributes else dict(doc)
+            hits.append({**fields, '_id': doc['_id'], '_score': float(scores[row]), '_highlights': []})
+        return {'hits': hits[offset:], 'query': query, 'limit': limit, 'offset': offset, 'processingTimeMs': 0}
+
+def openneuro_stub(count: int, seed: int = 0, latency: float = 0.0) -> StubServer:
+    """Point OpenNeuroDownloader's api_url at `<url>/crn/graphql`"""
+    return StubServer(OpenNeuroHandler, latency, count=count, seed=seed)
+
+def dandi_stub(count: int, seed: int = 0, latency: float = 0.0) -> StubServer:
+    """Point DandiAPIClient's api_url at `<url>/api`"""
+    return StubServer(DandiHandler, latency, count=count, seed=seed)
+
+def marqo_stub(latency: float = 0.0, dimension: int = 64) -> StubServer:
+    return StubServer(MarqoHandler, latency, indexes={}, lock=threading.Lock(), dimension=dimension)
@@ -1,14 +1,46 @@
 import marqo
-from typing import List
+import argparse
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from tqdm import tqdm
+from .data.catalogue import CatalogueBuilder
 from .data.data_schema import DatasetMetadata
-from .data.utils import load_datasets
+from .data.dedup import dedupe_datasets
+from .data.snapshot import load_cleaned_datasets, source_fingerprint
+from .data.utils import iter_datasets
+from .search.autocomplete import PrefixIndex
+from .search.backends import LOCAL_INDEX_DIR, MarqoBackend, SearchBackend, build_local_index
+from .search.chunking import CHUNK_OVERLAP, CHUNK_WORDS
+from .search.embedders import load_embedder
+from .search.lexical import LexicalIndexBuilder
+from .search.marqo_pool import size_connection_pool
+from .search.related import RelatedGraph
+from .search.index_alias import (
+    BASE_INDEX_NAME, get_alias, list_versioned_indexes, resolve_index, set_alias, versioned_index_name
+)
+from . import metrics
 import os
 
 if os.path.exists(".env"):
     from dotenv import load_dotenv
     load_dotenv()
 
+INDEX_NAME = BASE_INDEX_NAME
+MODEL = "hf/e5-base-v2"
+# The description is already part of searchable_content, so it isn't embedded a second time
+TENSOR_FIELDS = ["searchable_content", "name"]
+# Marqo embeds each tensor field as overlapping word windows and returns the
+# best-matching one in _highlights; same passage size as the local index
+TEXT_PREPROCESSING = {"splitMethod": "word", "splitLength": CHUNK_WORDS, "splitOverlap": CHUNK_OVERLAP}
+# Fields that feed create_searchable_content
+CONTENT_FIELDS = ["name", "description", "modalities", "species", "tasks", "source", "data_standard"]
+MANIFEST_PATH = os.path.join("cache", "index_manifest.json")
+# Vectors stored by Marqo are only comparable, and reusable by the related-datasets graph, within this
+MARQO_VECTOR_SPACE = f"marqo:{MODEL}:{CHUNK_WORDS}/{CHUNK_OVERLAP}"
+
 def create_searchable_content(dataset: DatasetMetadata) -> str:
     return f"""
         Dataset: {dataset['name']}
@@ -20,7 +52,7 @@ def create_searchable_content(dataset: DatasetMetadata) -> str:
         Data Standard: {dataset['data_standard']}
     """.strip()
 
-def create_marqo_index():
+def connect_marqo() -> marqo.Client:
     connection_url = "https://74ab-75-50-53-185.ngrok-free.app" # Railway variables are broken worthless peices of shit
     try:
         print(f"Connecting to Marqo at {connection_url}")
@@ -32,46 +64,453 @@ def create_marqo_index():
         raise
 
     print(f"Connected to Marqo at {connection_url}")
+    return mq
 
-    index_name = "neuroscience_datasets"
-    try:
-        mq.index(index_name).delete()
-        print(f"Deleted existing index {index_name}")
-    except Exception as e:
-        print(f"Could not delete index {index_name}: {str(e)}")
+def cleaned_datasets(catalogue: Optional[CatalogueBuilder] = None) -> List[DatasetMetadata]:
+    """Cleaned and deduplicated datasets: read from the crawl's snapshot (or the last
+    build's catalogue) while the cache is unchanged, otherwise cleaned from the cache.
+    The cache fingerprint is recorded on `catalogue` so the next build can reuse it."""
+    sources = source_fingerprint()
+    if catalogue is not None:
+        catalogue.sources = sources
+    with metrics.timer("snapshot_load_seconds"):
+        datasets = load_cleaned_datasets(sources)
+    if datasets is not None:
+        return datasets
+    # Dedup needs every record anyway, so cleaning is timed on its own first
+    datasets = list(metrics.timed_iter("clean_seconds", iter_datasets()))
+    with metrics.timer("dedupe_seconds"):
+        return dedupe_datasets(datasets)
 
-    print(f"Creating index {index_name}")
-    mq.create_index(index_name, model="hf/e5-base-v2")
-    print(f"Created index {index_name}")
+def save_catalogue(catalogue: CatalogueBuilder, **build_info):
+    """Save the catalogue, plus the autocomplete index built from it so the app doesn't build it at startup"""
+    saved = catalogue.save(**build_info)
+    PrefixIndex.from_catalogue(saved).save(catalogue_version=saved.meta['built_at'])
 
-    datasets = load_datasets()
-    
-    print(f"Loaded {len(datasets)} datasets")
+def save_related(backend: SearchBackend, hashes: Dict[str, Dict[str, str]], space: str):
+    """Update the related-datasets graph over the indexed documents, reading vectors
+    from the backend only for documents whose content changed since the last build"""
+    ids = list(hashes)
+    try:
+        with metrics.timer("related_graph_seconds"):
+            graph = RelatedGraph.build(ids, [hashes[doc_id]['content'] for doc_id in ids], backend.document_vectors,
+                                       space, previous=RelatedGraph.load())
+        graph.save()
+    except Exception as e:
+        # Related datasets are an extra; the index is usable without them
+        print(f"Could not build the related-datasets graph: {str(e)}")
 
-    documents = []
+def build_documents(datasets: Iterable[DatasetMetadata]) -> Iterator[Dict]:
+    """Turn cleaned datasets into Marqo documents keyed by dataset id"""
     for dataset in datasets:
         try:
-            doc = {
+            yield {
                 **dataset,
+                '_id': dataset['id'],
                 'searchable_content': create_searchable_content(dataset)
             }
-            documents.append(doc)
         except Exception as e:
             print(f"Failed to process dataset {dataset.get('id', 'unknown')}: {str(e)}")
-    
-    print(f"Indexing {len(documents)} documents")
-
-    batch_size = 100
-    for i in tqdm(range(0, len(documents), batch_size), desc="Indexing documents"):
-        batch = documents[i:i+batch_size]
-        for doc in batch:
-            try:
-                mq.index(index_name).add_documents(
-                    [doc],
-                    tensor_fields=["searchable_content", "name", "description"]
-                )
-            except Exception as e:
-                print(f"Failed to index document {doc.get('id', 'unknown')}: {str(e)}")
+
+def _hash(payload) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+def document_hashes(doc: Dict) -> Dict[str, str]:
+    """Hash of the fields that get embedded, and of the whole stored record.
+    A change to `content` needs re-embedding; a change to `record` alone only
+    needs the stored metadata refreshed."""
+    return {
+        'content': _hash({field: doc.get(field) for field in CONTENT_FIELDS + TENSOR_FIELDS}),
+        'record': _hash(doc),
+    }
+
+def track_hashes(documents: Iterable[Dict], hashes: Dict[str, Dict[str, str]]) -> Iterator[Dict]:
+    """Pass documents through while recording their hashes for the manifest"""
+    for doc in documents:
+        hashes[doc['_id']] = document_hashes(doc)
+        yield doc
+
+def index_settings() -> Dict:
+    """What documents are embedded with; an index built with other settings needs a full rebuild"""
+    return {'model': MODEL, 'tensor_fields': TENSOR_FIELDS, 'text_preprocessing': TEXT_PREPROCESSING}
+
+def read_manifest(path: str = MANIFEST_PATH) -> Dict:
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Could not read manifest {path}: {str(e)}")
+        return {}
+
+def load_manifest(index_name: str, path: str = MANIFEST_PATH) -> Dict[str, Dict[str, str]]:
+    """Load the id -> hashes manifest, or an empty one if it doesn't describe this index"""
+    manifest = read_manifest(path)
+    if manifest.get('index_name') != index_name or any(manifest.get(key) != value for key, value in index_settings().items()):
+        if manifest:
+            print(f"Manifest {path} was built for a different index configuration, ignoring it")
+        return {}
+    return manifest.get('documents', {})
+
+def changed_settings(mq: marqo.Client, index_name: str, path: str = MANIFEST_PATH) -> List[str]:
+    """Settings the existing `index_name` was built with that differ from the current ones.
+    Upserting documents can't change them: Marqo fixes the model and chunking when it
+    creates an index, and documents already in it keep their tensor fields."""
+    changed = []
+    manifest = read_manifest(path)
+    if manifest.get('index_name') == index_name:
+        changed = [key for key, value in index_settings().items() if key in manifest and manifest[key] != value]
+    try:
+        settings = mq.index(index_name).get_settings()
+    except Exception as e:
+        print(f"Could not read the settings of {index_name}: {str(e)}")
+        return changed
+    chunking = settings.get('textPreprocessing') or {}
+    if any(key in chunking and chunking[key] != value for key, value in TEXT_PREPROCESSING.items()):
+        changed.append('text_preprocessing')
+    if settings.get('model') not in (None, MODEL):
+        changed.append('model')
+    return sorted(set(changed))
+
+def save_manifest(index_name: str, documents: Dict[str, Dict[str, str]], path: str = MANIFEST_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'index_name': index_name, **index_settings(), 'documents': documents}, f)
+    os.replace(tmp_path, path)
+    print(f"Saved manifest for {len(documents)} documents to {path}")
+
+def existing_indexes(mq: marqo.Client) -> set:
+    return {index['indexName'] for index in mq.get_indexes().get('results', [])}
+
+def create_marqo_index(batch_size: int = 100, workers: int = 4, keep: int = 2):
+    """Build the index from scratch. Once an index is serving, deleting and recreating
+    it would take search offline (and, behind an alias, describe an index the app
+    doesn't use), so the rebuild goes into a new versioned index instead."""
+    mq = connect_marqo()
+
+    index_name = INDEX_NAME
+    if get_alias(mq) is not None or index_name in existing_indexes(mq):
+        print(f"{resolve_index(mq)} is serving; building a new versioned index instead of replacing it")
+        build_versioned_index(batch_size=batch_size, workers=workers, keep=keep)
+        return
+
+    print(f"Creating index {index_name}")
+    mq.create_index(index_name, model=MODEL, text_preprocessing=TEXT_PREPROCESSING)
+    print(f"Created index {index_name}")
+
+    # Datasets are streamed from the cache straight into indexing batches
+    hashes = {}
+    catalogue = CatalogueBuilder()
+    lexical = LexicalIndexBuilder()
+    documents = track_hashes(build_documents(catalogue.track(lexical.track(cleaned_datasets(catalogue)))), hashes)
+    _, failed = index_documents(mq, index_name, documents, batch_size=batch_size, workers=workers)
+    save_catalogue(catalogue, index_name=index_name)
+    lexical.save()
+
+    failed = set(failed)
+    indexed = {doc_id: doc_hashes for doc_id, doc_hashes in hashes.items() if doc_id not in failed}
+    save_manifest(index_name, indexed)
+    save_related(MarqoBackend(mq, index_name), indexed, MARQO_VECTOR_SPACE)
+
+def sync_marqo_index(batch_size: int = 100, workers: int = 4, keep: int = 2):
+    """Bring the index in line with the cache without rebuilding it: upsert new
+    and changed documents, delete ones that disappeared, leave the rest alone.
+    An index built with other settings is rebuilt blue/green instead."""
+    mq = connect_marqo()
+
+    index_name = resolve_index(mq, default=INDEX_NAME)
+    print(f"Syncing index {index_name}")
+    if index_name in existing_indexes(mq):
+        changed = changed_settings(mq, index_name)
+        if changed:
+            # New passages would sit next to documents embedded the old way
+            print(f"{index_name} was built with a different {', '.join(changed)}; rebuilding instead of syncing")
+            build_versioned_index(batch_size=batch_size, workers=workers, keep=keep)
+            return
+        manifest = load_manifest(index_name)
+    else:
+        print(f"Creating index {index_name}")
+        mq.create_index(index_name, model=MODEL, text_preprocessing=TEXT_PREPROCESSING)
+        manifest = {}
+
+    current = {}
+    metadata_only = []
+    unchanged = 0
+    catalogue = CatalogueBuilder()
+    lexical = LexicalIndexBuilder()
+
+    def changed_documents():
+        nonlocal unchanged
+        # Changed documents stream straight into indexing; metadata-only updates
+        # are set aside because they are sent with use_existing_tensors
+        for doc in build_documents(catalogue.track(lexical.track(cleaned_datasets(catalogue)))):
+            hashes = document_hashes(doc)
+            current[doc['_id']] = hashes
+            previous = manifest.get(doc['_id'])
+            if previous is None or previous['content'] != hashes['content']:
+                yield doc
+            elif previous['record'] != hashes['record']:
+                metadata_only.append(doc)
+            else:
+                unchanged += 1
+
+    failed = set()
+    changed, changed_failed = index_documents(mq, index_name, changed_documents(), batch_size=batch_size, workers=workers)
+    failed.update(changed_failed)
+    changed += len(changed_failed)
+    removed = [doc_id for doc_id in manifest if doc_id not in current]
+
+    print(f"{changed} new or changed, {len(metadata_only)} metadata-only updates, "
+          f"{len(removed)} removed, {unchanged} unchanged")
+
+    if metadata_only:
+        # The embedded fields are unchanged, so reuse the stored tensors instead of re-embedding
+        _, metadata_failed = index_documents(mq, index_name, metadata_only, batch_size=batch_size,
+                                             workers=workers, use_existing_tensors=True)
+        failed.update(metadata_failed)
+    save_catalogue(catalogue, index_name=index_name)
+    lexical.save()
+
+    deleted = []
+    for i in range(0, len(removed), batch_size):
+        batch = removed[i:i+batch_size]
+        try:
+            mq.index(index_name).delete_documents(batch)
+            deleted.extend(batch)
+        except Exception as e:
+            print(f"Failed to delete {len(batch)} documents: {str(e)}")
+    if removed:
+        print(f"Deleted {len(deleted)} documents")
+
+    # Failed documents keep their old hashes (or none), so the next run retries them
+    deleted = set(deleted)
+    documents = {doc_id: hashes for doc_id, hashes in manifest.items() if doc_id not in deleted}
+    for doc_id, hashes in current.items():
+        if doc_id not in failed:
+            documents[doc_id] = hashes
+        elif doc_id not in manifest:
+            documents.pop(doc_id, None)
+    save_manifest(index_name, documents)
+    save_related(MarqoBackend(mq, index_name), documents, MARQO_VECTOR_SPACE)
+
+def smoke_test_index(mq: marqo.Client, index_name: str, expected_documents: int) -> bool:
+    """Check a freshly built index is fully populated and answers queries"""
+    if expected_documents == 0:
+        print(f"Smoke test failed: no documents were submitted to {index_name}")
+        return False
+    try:
+        stats = mq.index(index_name).get_stats()
+        if stats.get('numberOfDocuments', 0) < expected_documents:
+            print(f"Smoke test failed: {index_name} has {stats.get('numberOfDocuments', 0)} documents, expected {expected_documents}")
+            return False
+        hits = mq.index(index_name).search("dataset", limit=1)['hits']
+        if not hits:
+            print(f"Smoke test failed: {index_name} returned no hits")
+            return False
+    except Exception as e:
+        print(f"Smoke test failed for {index_name}: {str(e)}")
+        return False
+    print(f"Smoke test passed for {index_name}")
+    return True
+
+def prune_versioned_indexes(mq: marqo.Client, keep: int = 2):
+    """Delete old versioned indexes, always keeping the active one and its rollback target"""
+    alias = get_alias(mq) or {}
+    versioned = list_versioned_indexes(mq)
+    protected = {alias.get('index_name'), alias.get('previous_index')} & set(versioned)
+    unprotected = [name for name in versioned if name not in protected]
+    spare = max(keep - len(protected), 0)
+    for name in unprotected[:len(unprotected) - spare]:
+        try:
+            mq.index(name).delete()
+            print(f"Deleted old index {name}")
+        except Exception as e:
+            print(f"Could not delete index {name}: {str(e)}")
+
+def build_versioned_index(batch_size: int = 100, workers: int = 4, keep: int = 2):
+    """Build into a new timestamped index while the current one keeps serving,
+    then switch the alias once the new index passes a smoke test."""
+    mq = connect_marqo()
+
+    index_name = versioned_index_name()
+    print(f"Creating index {index_name}")
+    mq.create_index(index_name, model=MODEL, text_preprocessing=TEXT_PREPROCESSING)
+
+    print(f"Indexing into {index_name}")
+    hashes = {}
+    catalogue = CatalogueBuilder()
+    lexical = LexicalIndexBuilder()
+    documents = track_hashes(build_documents(catalogue.track(lexical.track(cleaned_datasets(catalogue)))), hashes)
+    _, failed = index_documents(mq, index_name, documents, batch_size=batch_size, workers=workers)
+
+    # Every submitted document must be in the index before it serves, or the catalogue
+    # saved with it would list documents it lacks
+    if failed:
+        print(f"{len(failed)} of {len(hashes)} documents failed to index")
+    if failed or not smoke_test_index(mq, index_name, len(hashes)):
+        print(f"Leaving the alias on {resolve_index(mq)}; {index_name} was kept for inspection")
+        return
+
+    save_catalogue(catalogue, index_name=index_name)
+    lexical.save()
+
+    # Before the first switch, the base index is what the app serves, so it is the rollback target
+    previous_index = resolve_index(mq, default=INDEX_NAME if INDEX_NAME in existing_indexes(mq) else "")
+    set_alias(mq, index_name, previous_index)
+    print(f"Alias now points to {index_name} (previous: {previous_index or 'none'})")
+
+    save_manifest(index_name, hashes)
+    save_related(MarqoBackend(mq, index_name), hashes, MARQO_VECTOR_SPACE)
+    prune_versioned_indexes(mq, keep=keep)
+
+def rollback_index():
+    """Point the alias back at the previous index"""
+    mq = connect_marqo()
+    alias = get_alias(mq)
+    if not alias or not alias.get('previous_index'):
+        print("No previous index to roll back to")
+        return
+    set_alias(mq, alias['previous_index'], alias['index_name'])
+    print(f"Alias now points to {alias['previous_index']} (previous: {alias['index_name']})")
+
+def _batches(documents: Iterable[Dict], batch_size: int) -> Iterator[List[Dict]]:
+    batch = []
+    for doc in documents:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _index_batch(index, batch: List[Dict], tensor_fields: List[str], use_existing_tensors: bool = False) -> Tuple[int, List[str]]:
+    """Send a whole batch in one request. If the request fails, split the batch
+    in half and retry each half so a single bad document can't sink the rest.
+    Returns (number indexed, ids that failed)."""
+    try:
+        response = index.add_documents(batch, tensor_fields=tensor_fields, use_existing_tensors=use_existing_tensors)
+    except Exception as e:
+        if len(batch) == 1:
+            doc_id = batch[0].get('_id', batch[0].get('id', 'unknown'))
+            print(f"Failed to index document {doc_id}: {str(e)}")
+            return 0, [doc_id]
+        middle = len(batch) // 2
+        left_indexed, left_failed = _index_batch(index, batch[:middle], tensor_fields, use_existing_tensors)
+        right_indexed, right_failed = _index_batch(index, batch[middle:], tensor_fields, use_existing_tensors)
+        return left_indexed + right_indexed, left_failed + right_failed
+
+    # Marqo reports per-document errors in the response rather than failing the request
+    failed = []
+    for item in response.get('items', []):
+        if item.get('status', 200) >= 400:
+            failed.append(item.get('_id', 'unknown'))
+            print(f"Failed to index document {item.get('_id', 'unknown')}: {item.get('message', item.get('error'))}")
+    return len(batch) - len(failed), failed
+
+def _timed_index_batch(index, batch: List[Dict], tensor_fields: List[str], use_existing_tensors: bool) -> Tuple[int, List[str], int, float]:
+    start = time.perf_counter()
+    indexed, failed = _index_batch(index, batch, tensor_fields, use_existing_tensors)
+    elapsed = time.perf_counter() - start
+    metrics.observe("index_batch_seconds", elapsed, backend="marqo")
+    metrics.inc("indexed_documents_total", indexed, backend="marqo")
+    if failed:
+        metrics.inc("index_failures_total", len(failed), backend="marqo")
+    return indexed, failed, len(batch), elapsed
+
+def index_documents(
+    mq: marqo.Client,
+    index_name: str,
+    documents: Iterable[Dict],
+    batch_size: int = 100,
+    workers: int = 4,
+    tensor_fields: List[str] = TENSOR_FIELDS,
+    use_existing_tensors: bool = False,
+) -> Tuple[int, List[str]]:
+    """Bulk index documents with up to `workers` batches in flight at once.
+    Documents can be any iterable; at most 2 * workers batches are held in memory.
+    Returns (number indexed, ids that failed)."""
+    size_connection_pool(workers)
+    index = mq.index(index_name)
+    total_indexed = 0
+    all_failed = []
+    start = time.perf_counter()
+    pbar = tqdm(desc="Indexing documents", unit=" docs")
+
+    def collect(futures):
+        nonlocal total_indexed
+        for future in futures:
+            indexed, failed, size, elapsed = future.result()
+            total_indexed += indexed
+            all_failed.extend(failed)
+            pbar.update(size)
+            pbar.set_postfix({'failed': len(all_failed)})
+            tqdm.write(f"Indexed batch of {size} documents in {elapsed:.2f}s ({size / max(elapsed, 1e-9):.1f} docs/sec, {len(failed)} failed)")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = set()
+        for batch in _batches(documents, batch_size):
+            if len(in_flight) >= workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight.add(executor.submit(_timed_index_batch, index, batch, tensor_fields, use_existing_tensors))
+        collect(wait(in_flight).done)
+
+    pbar.close()
+    elapsed = time.perf_counter() - start
+    print(f"Indexed {total_indexed} documents in {elapsed:.1f}s ({total_indexed / max(elapsed, 1e-9):.1f} docs/sec), {len(all_failed)} failed")
+    return total_indexed, all_failed
+
+def create_local_index(embedder: str = "e5", dtype: str = "float16", batch_size: int = 64, path: str = LOCAL_INDEX_DIR,
+                       workers: int = 1):
+    """Build the in-process index used when the app runs with SEARCH_BACKEND=local"""
+    hashes = {}
+    catalogue = CatalogueBuilder()
+    lexical = LexicalIndexBuilder()
+    documents = track_hashes(build_documents(catalogue.track(lexical.track(cleaned_datasets(catalogue)))), hashes)
+    encoder = load_embedder(embedder)
+    # Each call embeds one batch of passages
+    encoder.embed = metrics.timed("index_batch_seconds", backend="local")(encoder.embed)
+    backend = build_local_index(
+        tqdm(documents, desc="Embedding datasets", unit="doc"),
+        encoder,
+        path=path,
+        dtype=dtype,
+        batch_size=batch_size,
+        workers=workers
+    )
+    save_catalogue(catalogue, index_name="local", embedder=embedder)
+    lexical.save()
+    save_related(backend, hashes, f"local:{encoder.name}:{CHUNK_WORDS}/{CHUNK_OVERLAP}")
 
 if __name__ == "__main__":
-    create_marqo_index()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build the Marqo index from the cached datasets")
+    parser.add_argument("--batch-size", type=int, default=100, help="Documents per add_documents request")
+    parser.add_argument("--workers", type=int, default=4, help="Batches indexed concurrently")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only upsert new/changed datasets and delete removed ones instead of rebuilding")
+    parser.add_argument("--blue-green", action="store_true",
+                        help="Build into a new timestamped index and switch the alias to it once it is ready")
+    parser.add_argument("--keep", type=int, default=2, help="Versioned indexes to keep after a blue/green build")
+    parser.add_argument("--rollback", action="store_true", help="Point the alias back at the previous index")
+    parser.add_argument("--backend", choices=["marqo", "local"], default="marqo",
+                        help="Index into Marqo, or embed in-process into cache/local_index")
+    parser.add_argument("--embedder", default="e5",
+                        help="Encoder for --backend local: e5, or hashing[:dim] for an offline stub")
+    parser.add_argument("--dtype", choices=["float16", "int8"], default="float16",
+                        help="Storage type for local embeddings")
+    parser.add_argument("--embed-workers", type=int, default=1,
+                        help="Processes embedding new passages for --backend local (resumable when > 1)")
+    args = parser.parse_args()
+    if args.backend == "local":
+        create_local_index(embedder=args.embedder, dtype=args.dtype, workers=args.embed_workers)
+    elif args.rollback:
+        rollback_index()
+    elif args.blue_green:
+        build_versioned_index(batch_size=args.batch_size, workers=args.workers, keep=args.keep)
+    elif args.incremental:
+        sync_marqo_index(batch_size=args.batch_size, workers=args.workers, keep=args.keep)
+    else:
+        create_marqo_index(batch_size=args.batch_size, workers=args.workers, keep=args.keep)
+    print(metrics.REGISTRY.summary())
@@ -0,0 +1,104 @@
+import gzip
+import json
+import os
+import re
+from typing import Dict, Iterator, List, Optional
+
+# Cache files are <source>_datasets.<extension>. If a source has several (e.g. after
+# the compression setting changed), the newest is read, with JSONL variants taking
+# priority over a legacy JSON array written at the same time
+CACHE_FILE_PATTERN = re.compile(r"^(?P<source>.+)_datasets\.(?P<extension>json|jsonl|jsonl\.gz|jsonl\.zst)$")
+EXTENSION_PRIORITY = ["jsonl.zst", "jsonl.gz", "jsonl", "json"]
+COMPRESSION_EXTENSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+def _open_zstd(filepath: str, mode: str):
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading or writing .zst cache files requires the zstandard package (pip install zstandard)")
+    return zstandard.open(filepath, mode)
+
+def open_cache_file(filepath: str, mode: str = 'r'):
+    """Open a cache file in text mode, transparently (de)compressing .gz and .zst"""
+    text_mode = mode + 't'
+    if filepath.endswith('.gz'):
+        return gzip.open(filepath, text_mode, encoding='utf-8')
+    if filepath.endswith('.zst'):
+        return _open_zstd(filepath, text_mode)
+    return open(filepath, mode, encoding='utf-8')
+
+def cache_filename(source: str, compression: Optional[str] = None) -> str:
+    """e.g. openneuro_datasets.jsonl.gz"""
+    if compression not in COMPRESSION_EXTENSIONS:
+        raise ValueError(f"Unknown compression {compression!r}, expected one of {list(COMPRESSION_EXTENSIONS)}")
+    return f"{source}_datasets.jsonl{COMPRESSION_EXTENSIONS[compression]}"
+
+def _recency(data_dir: str, filename: str):
+    extension = CACHE_FILE_PATTERN.match(filename).group('extension')
+    return (os.stat(os.path.join(data_dir, filename)).st_mtime_ns, -EXTENSION_PRIORITY.index(extension))
+
+def find_cache_files(data_dir: str) -> List[str]:
+    """One cache file per source: the most recently written one"""
+    best: Dict[str, str] = {}
+    for filename in sorted(os.listdir(data_dir)):
+        match = CACHE_FILE_PATTERN.match(filename)
+        if not match:
+            continue
+        source = match.group('source')
+        current = best.get(source)
+        if current is None or _recency(data_dir, filename) > _recency(data_dir, current):
+            best[source] = filename
+    return [os.path.join(data_dir, filename) for filename in sorted(best.values())]
+
+def _other_variants(filepath: str) -> List[str]:
+    """The source's cache files in other formats next to `filepath`"""
+    data_dir, filename = os.path.split(filepath)
+    source = CACHE_FILE_PATTERN.match(filename).group('source')
+    return [os.path.join(data_dir, other) for other in os.listdir(data_dir or ".")
+            if other != filename and (match := CACHE_FILE_PATTERN.match(other)) and match.group('source') == source]
+
+def iter_records(filepath: str) -> Iterator[Dict]:
+    """Stream raw records from a JSONL cache file, or load a legacy JSON array"""
+    if filepath.endswith('.json'):
+        with open(filepath, 'r') as f:
+            yield from json.load(f)
+        return
+    with open_cache_file(filepath, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+class JsonlWriter:
+    """Appends records to a JSONL cache file as they are produced.
+    Writes go to a temporary file that replaces the target on a clean close,
+    so a crashed crawl never leaves a truncated cache behind."""
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        # Keep the compression extension so open_cache_file picks the right codec
+        suffix = next((extension for extension in ('.gz', '.zst') if filepath.endswith(extension)), "")
+        self.tmp_path = f"{filepath}.tmp{suffix}"
+        self.count = 0
+        self.file = None
+
+    def __enter__(self) -> "JsonlWriter":
+        self.file = open_cache_file(self.tmp_path, 'w')
+        return self
+
+    def write(self, record: Dict):
+        self.file.write(json.dumps(record))
+        self.file.write('\n')
+        self.count += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        self.file.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.filepath)
+            # The new file holds everything now (merges read the old one first), so a
+            # variant in another format can't be mistaken for the current cache
+            if CACHE_FILE_PATTERN.match(os.path.basename(self.filepath)):
+                for other in _other_variants(self.filepath):
+                    os.remove(other)
+        else:
+            os.remove(self.tmp_path)
+        return False
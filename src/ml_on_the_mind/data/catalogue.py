@@ -0,0 +1,218 @@
+"""Columnar catalogue of the indexed datasets.
+
+Built at index time from the cleaned datasets and stored as plain NumPy arrays,
+so the app can memory-map it and answer facet, count and stats questions without
+a round trip to Marqo. It also keeps the cleaned records themselves, so it
+doubles as a snapshot the next index build can read instead of re-cleaning the
+crawl cache (see snapshot.py).
+
+Layout of the catalogue directory:
+    meta.json                   format, total, build info, the vocabulary and value counts of each
+                                categorical column, and the fingerprint of the cache files it came from
+    records_data.npy / _offsets.npy   the cleaned records as packed JSON
+    <text>_data.npy / _offsets.npy    utf-8 strings (ids, names, descriptions) packed into one byte array
+    size.npy, subject_count.npy       int64 per dataset
+    date_created.npy                  float64 epoch seconds, NaN when unknown
+    <field>_codes.npy                 int32 vocabulary code per dataset (single-valued columns)
+    <field>_codes.npy / _offsets.npy  flattened codes and per-dataset offsets (multi-valued columns)
+"""
+import json
+import os
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional
+import numpy as np
+from .data_schema import DatasetMetadata
+from .utils import parse_timestamp
+
+try:
+    from ..search.storage import replace_directory
+except ImportError:
+    # The app imports data/ and search/ as top-level packages
+    from search.storage import replace_directory
+
+CATALOGUE_DIR = os.path.join("cache", "catalogue")
+# Bumped whenever the layout changes; older catalogues still serve the app but not as snapshots
+CATALOGUE_FORMAT = 2
+NOT_SPECIFIED = "Not specified"
+TEXT_FIELDS = ["id", "name", "description"]
+NUMERIC_FIELDS = ["size", "subject_count"]
+CATEGORICAL_FIELDS = ["source", "data_standard", "license"]
+MULTI_VALUED_FIELDS = ["modalities", "species", "tasks"]
+
+def _pack_strings(values: List[str]):
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return data, offsets
+
+def _facet_counts(codes: np.ndarray, vocabulary: List[str]) -> Dict[str, int]:
+    counts = np.bincount(codes, minlength=len(vocabulary))
+    order = np.argsort(-counts, kind='stable')
+    return {
+        vocabulary[code]: int(counts[code]) for code in order
+        if counts[code] and vocabulary[code] != NOT_SPECIFIED
+    }
+
+class CatalogueBuilder:
+    """Accumulates datasets one at a time, dictionary-encoding categorical values as it goes"""
+
+    def __init__(self):
+        self.text = {field: [] for field in TEXT_FIELDS}
+        self.numeric = {field: [] for field in NUMERIC_FIELDS}
+        self.dates = []
+        self.vocabularies = {field: {} for field in CATEGORICAL_FIELDS + MULTI_VALUED_FIELDS}
+        self.codes = {field: [] for field in CATEGORICAL_FIELDS + MULTI_VALUED_FIELDS}
+        self.offsets = {field: [0] for field in MULTI_VALUED_FIELDS}
+        self.records: List[str] = []
+        # Fingerprint of the cache files the datasets were cleaned from (snapshot.source_fingerprint)
+        self.sources: Optional[Dict] = None
+
+    def _code(self, field: str, value) -> int:
+        vocabulary = self.vocabularies[field]
+        value = NOT_SPECIFIED if value is None else str(value)
+        if value not in vocabulary:
+            vocabulary[value] = len(vocabulary)
+        return vocabulary[value]
+
+    def add(self, dataset: DatasetMetadata):
+        self.records.append(json.dumps(dataset))
+        for field in TEXT_FIELDS:
+            self.text[field].append(str(dataset.get(field) or ""))
+        for field in NUMERIC_FIELDS:
+            self.numeric[field].append(int(dataset.get(field) or 0))
+        created = parse_timestamp(dataset.get('date_created'))
+        self.dates.append(created.timestamp() if created else np.nan)
+        for field in CATEGORICAL_FIELDS:
+            self.codes[field].append(self._code(field, dataset.get(field)))
+        for field in MULTI_VALUED_FIELDS:
+            # Each dataset lists a value at most once, so counting codes counts datasets
+            values = dict.fromkeys(dataset.get(field) or [])
+            self.codes[field].extend(self._code(field, value) for value in values)
+            self.offsets[field].append(len(self.codes[field]))
+
+    def track(self, datasets: Iterable[DatasetMetadata]) -> Iterator[DatasetMetadata]:
+        """Pass datasets through while adding them to the catalogue"""
+        for dataset in datasets:
+            self.add(dataset)
+            yield dataset
+
+    def save(self, path: str = CATALOGUE_DIR, **build_info) -> "Catalogue":
+        tmp_path = f"{path}.tmp"
+        os.makedirs(tmp_path, exist_ok=True)
+        for field, values in self.text.items():
+            data, offsets = _pack_strings(values)
+            np.save(os.path.join(tmp_path, f"{field}_data.npy"), data)
+            np.save(os.path.join(tmp_path, f"{field}_offsets.npy"), offsets)
+        for field, values in self.numeric.items():
+            np.save(os.path.join(tmp_path, f"{field}.npy"), np.asarray(values, dtype=np.int64))
+        np.save(os.path.join(tmp_path, "date_created.npy"), np.asarray(self.dates, dtype=np.float64))
+        for field, codes in self.codes.items():
+            np.save(os.path.join(tmp_path, f"{field}_codes.npy"), np.asarray(codes, dtype=np.int32))
+        for field, offsets in self.offsets.items():
+            np.save(os.path.join(tmp_path, f"{field}_offsets.npy"), np.asarray(offsets, dtype=np.int64))
+        data, offsets = _pack_strings(self.records)
+        np.save(os.path.join(tmp_path, "records_data.npy"), data)
+        np.save(os.path.join(tmp_path, "records_offsets.npy"), offsets)
+        with open(os.path.join(tmp_path, "meta.json"), 'w') as f:
+            json.dump({
+                'format': CATALOGUE_FORMAT,
+                'total': len(self.dates),
+                'built_at': datetime.now(timezone.utc).isoformat(),
+                'vocabularies': {field: list(vocabulary) for field, vocabulary in self.vocabularies.items()},
+                # Stored so the filter lists on the first page don't touch the arrays at all
+                'counts': {field: _facet_counts(np.asarray(codes, dtype=np.int64), list(self.vocabularies[field]))
+                           for field, codes in self.codes.items()},
+                'sources': self.sources,
+                **build_info,
+            }, f)
+
+        # Swap the whole directory in at once so readers never see a half-written catalogue
+        replace_directory(tmp_path, path)
+        print(f"Saved catalogue of {len(self.dates)} datasets to {path}")
+        return Catalogue(path)
+
+def build_catalogue(datasets: Iterable[DatasetMetadata], path: str = CATALOGUE_DIR, **build_info) -> "Catalogue":
+    builder = CatalogueBuilder()
+    for dataset in datasets:
+        builder.add(dataset)
+    return builder.save(path, **build_info)
+
+class Catalogue:
+    """Read-only, memory-mapped view of a saved catalogue"""
+
+    def __init__(self, path: str = CATALOGUE_DIR):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), 'r') as f:
+            self.meta = json.load(f)
+        self.total = self.meta['total']
+        self.vocabularies = self.meta['vocabularies']
+        self._id_lookup = None
+        self._arrays = {}
+
+    @classmethod
+    def load(cls, path: str = CATALOGUE_DIR) -> Optional["Catalogue"]:
+        """The catalogue at `path`, or None if it hasn't been built"""
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return None
+        return cls(path)
+
+    def __len__(self) -> int:
+        return self.total
+
+    def array(self, name: str) -> np.ndarray:
+        """Memory-map one column; only the pages that are read get loaded"""
+        if name not in self._arrays:
+            self._arrays[name] = np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode='r')
+        return self._arrays[name]
+
+    def text(self, field: str, index: int) -> str:
+        data = self.array(f"{field}_data")
+        offsets = self.array(f"{field}_offsets")
+        return bytes(data[offsets[index]:offsets[index + 1]]).decode('utf-8')
+
+    def texts(self, field: str) -> List[str]:
+        data = bytes(self.array(f"{field}_data"))
+        offsets = self.array(f"{field}_offsets").tolist()
+        return [data[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+
+    @property
+    def has_records(self) -> bool:
+        return self.meta.get('format') == CATALOGUE_FORMAT
+
+    def is_fresh(self, sources: Dict) -> bool:
+        """Whether the records were cleaned from exactly these cache files"""
+        return self.has_records and self.meta.get('sources') == sources
+
+    def record(self, index: int) -> DatasetMetadata:
+        return json.loads(self.text('records', index))
+
+    def records(self) -> Iterator[DatasetMetadata]:
+        data = self.array("records_data")
+        offsets = self.array("records_offsets")
+        for index in range(self.total):
+            yield json.loads(bytes(data[offsets[index]:offsets[index + 1]]))
+
+    def index_of(self, dataset_id: str) -> Optional[int]:
+        if self._id_lookup is None:
+            self._id_lookup = {value: index for index, value in enumerate(self.texts('id'))}
+        return self._id_lookup.get(dataset_id)
+
+    def values(self, field: str, index: int) -> List[str]:
+        """Decoded value(s) of a categorical column for one dataset"""
+        vocabulary = self.vocabularies[field]
+        codes = self.array(f"{field}_codes")
+        if field in MULTI_VALUED_FIELDS:
+            offsets = self.array(f"{field}_offsets")
+            return [vocabulary[code] for code in codes[offsets[index]:offsets[index + 1]]]
+        return [vocabulary[codes[index]]]
+
+    def facet_counts(self, field: str) -> Dict[str, int]:
+        """Number of datasets carrying each value of `field`, most common first"""
+        counts = self.meta.get('counts', {}).get(field)
+        if counts is not None:
+            return dict(counts)
+        return _facet_counts(self.array(f"{field}_codes"), self.vocabularies[field])
+
+    def facet_values(self, field: str) -> List[str]:
+        return sorted(self.facet_counts(field))
@@ -21,6 +21,8 @@ class DatasetMetadata(TypedDict):
             license: Optional[str]      # Dataset license
             subject_count: Optional[int] # Number of subjects in dataset
             data_standard: Optional[str] # Data standard used (e.g., 'BIDS', 'NWB')
+            aliases: List[str]          # Ids of other versions/copies folded into this one by dedup
+            alias_sources: List[str]    # Source repository of each alias
     """
     id: str                     # Unique identifier
     name: str                   # Dataset name
@@ -36,4 +38,6 @@ class DatasetMetadata(TypedDict):
     authors: List[str]         # Dataset authors
     license: Optional[str]      # Dataset license
     subject_count: Optional[int] # Number of subjects in dataset
-    data_standard: Optional[str] # Data standard used (e.g., 'BIDS', 'NWB')
\ No newline at end of file
+    data_standard: Optional[str] # Data standard used (e.g., 'BIDS', 'NWB')
+    aliases: List[str]          # Ids of other versions/copies folded into this one by dedup
+    alias_sources: List[str]    # Source repository of each alias
\ No newline at end of file
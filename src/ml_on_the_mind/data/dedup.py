@@ -0,0 +1,196 @@
+"""Collapse duplicate datasets before indexing.
+
+Two kinds of duplicates reach the cache: every DANDI version of a dandiset
+("000123/0.230101.1234", "000123/draft"), and the same study deposited in both
+OpenNeuro and DANDI. Versions are collapsed to one record per dandiset; cross-source
+duplicates are matched by DOI and by MinHash/LSH near-duplicate detection on name
+and description, which stays roughly linear instead of comparing every pair.
+
+Each group is emitted as one canonical record whose `aliases` / `alias_sources`
+list the records folded into it.
+"""
+import re
+from typing import Dict, Iterable, List, Optional, Set
+import numpy as np
+from .data_schema import DatasetMetadata
+from .utils import parse_timestamp
+
+NOT_SPECIFIED = "Not specified"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+SHINGLE_SIZE = 3
+# Only the start of a readme is shingled; enough to fingerprint it
+MAX_TOKENS = 300
+# Too few shingles make the Jaccard estimate meaningless, e.g. a bare title
+MIN_SHINGLES = 8
+NUM_PERM = 128
+BANDS = 16
+# Candidate pairs from LSH are confirmed on their exact shingle Jaccard similarity
+JACCARD_THRESHOLD = 0.8
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+
+def _base_id(dataset_id: str) -> str:
+    return dataset_id.split("/", 1)[0]
+
+def _version_key(dataset: DatasetMetadata):
+    """Newest published version first, then the draft"""
+    version = dataset['id'].split("/", 1)[1] if "/" in dataset['id'] else ""
+    published = version not in ("", "draft")
+    created = parse_timestamp(dataset.get('date_created'))
+    return (published, version if published else "", created.timestamp() if created else 0.0)
+
+def normalize_doi(doi: Optional[str]) -> Optional[str]:
+    if not doi or doi == NOT_SPECIFIED:
+        return None
+    doi = doi.strip().lower()
+    for prefix in ("https://doi.org/", "http://doi.org/", "https://dx.doi.org/", "doi:"):
+        if doi.startswith(prefix):
+            doi = doi[len(prefix):]
+    return doi or None
+
+def shingles(dataset: DatasetMetadata) -> Set[int]:
+    """Hashed word 3-grams of the name and the start of the description"""
+    text = dataset.get('name') or ""
+    if dataset.get('description') and dataset['description'] != NOT_SPECIFIED:
+        text += " " + dataset['description']
+    tokens = TOKEN_PATTERN.findall(text.lower())[:MAX_TOKENS]
+    # hash() is salted per process, which is fine: signatures are only compared within one run
+    return {
+        hash(tuple(tokens[i:i + SHINGLE_SIZE])) & 0xFFFFFFFF
+        for i in range(max(len(tokens) - SHINGLE_SIZE + 1, 0))
+    }
+
+class MinHasher:
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        # a * x stays below 2**63 for 32-bit shingle hashes, so uint64 never overflows
+        self.a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingle_set: Set[int]) -> np.ndarray:
+        values = np.fromiter(shingle_set, dtype=np.uint64, count=len(shingle_set))
+        return ((np.outer(values, self.a) + self.b) % MERSENNE_PRIME).min(axis=0)
+
+class _UnionFind:
+    """Union-find over records that only joins groups with no source in common, so a
+    group never holds two records of one source (linking is transitive: two OpenNeuro
+    datasets both resembling one DANDI record must not be merged with each other)"""
+
+    def __init__(self, sources: List[str]):
+        self.parent = list(range(len(sources)))
+        self.sources = [{source} for source in sources]
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i: int, j: int) -> bool:
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i == root_j:
+            return True
+        if self.sources[root_i] & self.sources[root_j]:
+            return False
+        self.parent[root_i] = root_j
+        self.sources[root_j] |= self.sources[root_i]
+        return True
+
+def collapse_versions(datasets: Iterable[DatasetMetadata]) -> List[DatasetMetadata]:
+    """One record per dandiset: the newest published version, or the draft if none is published"""
+    groups: Dict[str, List[DatasetMetadata]] = {}
+    for dataset in datasets:
+        key = f"{dataset['source']}:{_base_id(dataset['id'])}" if dataset['source'] == 'dandi' else \
+            f"{dataset['source']}:{dataset['id']}"
+        groups.setdefault(key, []).append(dataset)
+
+    collapsed = []
+    for versions in groups.values():
+        versions.sort(key=_version_key, reverse=True)
+        collapsed.append(_canonical(versions[0], versions[1:]))
+    return collapsed
+
+def _completeness(dataset: DatasetMetadata):
+    description = dataset.get('description') or ""
+    return (description != NOT_SPECIFIED, len(description), dataset['id'])
+
+def _canonical(dataset: DatasetMetadata, others: List[DatasetMetadata]) -> DatasetMetadata:
+    aliases = list(dataset.get('aliases') or [])
+    alias_sources = list(dataset.get('alias_sources') or [])
+    for other in others:
+        for alias, source in [(other['id'], other['source'])] + list(zip(other.get('aliases') or [], other.get('alias_sources') or [])):
+            if alias != dataset['id'] and alias not in aliases:
+                aliases.append(alias)
+                alias_sources.append(source)
+    return {**dataset, 'aliases': aliases, 'alias_sources': alias_sources}
+
+def find_duplicate_groups(datasets: List[DatasetMetadata]) -> List[List[int]]:
+    """Groups of indices of records from different sources that share a DOI or
+    are near-duplicates by name and description, at most one record per source.
+    DOI matches are linked first, then near-duplicates from most to least similar,
+    so a record joins the group it matches best."""
+    sources = [dataset['source'] for dataset in datasets]
+    union = _UnionFind(sources)
+
+    by_doi: Dict[str, int] = {}
+    for i, dataset in enumerate(datasets):
+        doi = normalize_doi(dataset.get('doi'))
+        if doi is None:
+            continue
+        # OpenNeuro's DOI is the associated paper's, which several datasets can share,
+        # so a DOI only links records from different sources
+        if doi in by_doi and sources[by_doi[doi]] != dataset['source']:
+            union.union(i, by_doi[doi])
+        by_doi.setdefault(doi, i)
+
+    hasher = MinHasher()
+    rows = NUM_PERM // BANDS
+    shingle_sets = [shingles(dataset) for dataset in datasets]
+    buckets: Dict[bytes, List[int]] = {}
+    for i, shingle_set in enumerate(shingle_sets):
+        if len(shingle_set) < MIN_SHINGLES:
+            continue
+        signature = hasher.signature(shingle_set)
+        for band in range(BANDS):
+            key = band.to_bytes(2, 'little') + signature[band * rows:(band + 1) * rows].tobytes()
+            buckets.setdefault(key, []).append(i)
+
+    checked = set()
+    similar = []
+    for members in buckets.values():
+        for x in range(len(members)):
+            for y in range(x + 1, len(members)):
+                i, j = members[x], members[y]
+                if sources[i] == sources[j] or (i, j) in checked:
+                    continue
+                checked.add((i, j))
+                a, b = shingle_sets[i], shingle_sets[j]
+                similarity = len(a & b) / len(a | b)
+                if similarity >= JACCARD_THRESHOLD:
+                    similar.append((similarity, i, j))
+    for _, i, j in sorted(similar, reverse=True):
+        union.union(i, j)
+
+    groups: Dict[int, List[int]] = {}
+    for i in range(len(datasets)):
+        groups.setdefault(union.find(i), []).append(i)
+    return [members for members in groups.values() if len(members) > 1]
+
+def dedupe_datasets(datasets: Iterable[DatasetMetadata]) -> List[DatasetMetadata]:
+    """Canonical records with their versions and cross-source duplicates folded into `aliases`"""
+    datasets = list(datasets)
+    collapsed = collapse_versions(datasets)
+    merged_into: Dict[int, List[int]] = {}
+    dropped = set()
+    for members in find_duplicate_groups(collapsed):
+        members.sort(key=lambda i: _completeness(collapsed[i]), reverse=True)
+        merged_into[members[0]] = members[1:]
+        dropped.update(members[1:])
+
+    result = []
+    for i, dataset in enumerate(collapsed):
+        if i in dropped:
+            continue
+        result.append(_canonical(dataset, [collapsed[j] for j in merged_into.get(i, [])]))
+    print(f"Deduplicated {len(datasets)} datasets to {len(result)} "
+          f"({len(datasets) - len(collapsed)} older versions, {len(dropped)} cross-source duplicates)")
+    return result
@@ -0,0 +1,136 @@
+"""Facet counts over the whole match set, computed from bitmaps over the catalogue.
+
+Every facet value gets a bitmap with one bit per dataset (packed into uint64 words),
+so the datasets matching a set of filters are a few ANDs and the count for every
+value of a field is one vectorised AND + popcount over that field's bitmap matrix.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from .catalogue import Catalogue, MULTI_VALUED_FIELDS, NOT_SPECIFIED
+
+FACET_FIELDS = ["modalities", "species", "tasks", "source", "data_standard"]
+GB = 1_000_000_000
+SIZE_BUCKETS = [
+    ("< 1 GB", 1, GB),
+    ("1-10 GB", GB, 10 * GB),
+    ("10-100 GB", 10 * GB, 100 * GB),
+    ("100 GB-1 TB", 100 * GB, 1000 * GB),
+    ("> 1 TB", 1000 * GB, None),
+]
+
+def _popcount(words: np.ndarray) -> np.ndarray:
+    return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+
+class FacetIndex:
+    def __init__(self, catalogue: Catalogue):
+        self.total = catalogue.total
+        self.words = max((self.total + 63) // 64, 1)
+        self.vocabularies: Dict[str, List[str]] = {}
+        self.bitmaps: Dict[str, np.ndarray] = {}
+        self.sizes = np.asarray(catalogue.array("size"))
+
+        for field in FACET_FIELDS:
+            codes = np.asarray(catalogue.array(f"{field}_codes"), dtype=np.int64)
+            if field in MULTI_VALUED_FIELDS:
+                offsets = np.asarray(catalogue.array(f"{field}_offsets"))
+                docs = np.repeat(np.arange(self.total), np.diff(offsets))
+            else:
+                docs = np.arange(self.total)
+            self.vocabularies[field] = catalogue.vocabularies[field]
+            self.bitmaps[field] = self._bitmap_matrix(codes, docs, len(catalogue.vocabularies[field]))
+
+        self.vocabularies['size'] = [label for label, _, _ in SIZE_BUCKETS]
+        self.bitmaps['size'] = np.stack([self.from_mask(self._size_mask(low, high)) for _, low, high in SIZE_BUCKETS]) \
+            if self.total else np.zeros((len(SIZE_BUCKETS), self.words), dtype=np.uint64)
+        self.codes = {field: {value: code for code, value in enumerate(vocabulary)}
+                      for field, vocabulary in self.vocabularies.items()}
+        self.all = self.from_mask(np.ones(self.total, dtype=bool))
+
+    def _bitmap_matrix(self, codes: np.ndarray, docs: np.ndarray, size: int) -> np.ndarray:
+        matrix = np.zeros((size, self.words), dtype=np.uint64)
+        bits = np.left_shift(np.uint64(1), (docs & 63).astype(np.uint64))
+        np.bitwise_or.at(matrix, (codes, docs >> 6), bits)
+        return matrix
+
+    def _size_mask(self, low: Optional[int], high: Optional[int], inclusive: bool = False) -> np.ndarray:
+        mask = np.ones(self.total, dtype=bool)
+        if low is not None:
+            mask &= self.sizes >= low
+        if high is not None:
+            mask &= (self.sizes <= high) if inclusive else (self.sizes < high)
+        return mask
+
+    def from_mask(self, mask: np.ndarray) -> np.ndarray:
+        """Pack a boolean array over datasets into a bitmap"""
+        padded = np.zeros(self.words * 64, dtype=bool)
+        padded[:len(mask)] = mask
+        return np.packbits(padded, bitorder='little').view(np.uint64)
+
+    def from_indices(self, indices: Iterable[int]) -> np.ndarray:
+        mask = np.zeros(self.total, dtype=bool)
+        mask[np.fromiter(indices, dtype=np.int64)] = True
+        return self.from_mask(mask)
+
+    def to_indices(self, bitmap: np.ndarray) -> np.ndarray:
+        """Dataset indices set in a bitmap, in catalogue order"""
+        return np.flatnonzero(np.unpackbits(bitmap.view(np.uint8), bitorder='little')[:self.total])
+
+    def value_bitmap(self, field: str, value: str) -> np.ndarray:
+        code = self.codes[field].get(value)
+        if code is None:
+            return np.zeros(self.words, dtype=np.uint64)
+        return self.bitmaps[field][code]
+
+    def _filter_bitmaps(self, selections: Dict[str, str], size_range: Tuple[Optional[int], Optional[int]]) -> Dict[str, np.ndarray]:
+        bitmaps = {field: self.value_bitmap(field, value) for field, value in selections.items() if value}
+        if size_range != (None, None):
+            # Inclusive like Marqo's size:[min TO max] range filter
+            bitmaps['size'] = self.from_mask(self._size_mask(*size_range, inclusive=True))
+        return bitmaps
+
+    def match(
+        self,
+        selections: Dict[str, str],
+        size_range: Tuple[Optional[int], Optional[int]] = (None, None),
+        candidates: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """Bitmap of the datasets matching every selected facet value and the size range"""
+        bitmap = self.all if candidates is None else candidates
+        for filter_bitmap in self._filter_bitmaps(selections, size_range).values():
+            bitmap = bitmap & filter_bitmap
+        return bitmap
+
+    def counts(
+        self,
+        selections: Dict[str, str],
+        size_range: Tuple[Optional[int], Optional[int]] = (None, None),
+        candidates: Optional[np.ndarray] = None,
+    ) -> Dict[str, Dict[str, int]]:
+        """Per-value dataset counts for every facet, most common first.
+
+        `selections` maps facet field -> selected value. Each field is counted with
+        every *other* filter applied, so the counts show what picking a different
+        value of that field would return. `candidates` optionally restricts the
+        match set further (e.g. to the datasets a lexical query matched).
+        """
+        filter_bitmaps = self._filter_bitmaps(selections, size_range)
+        base = self.all if candidates is None else candidates
+        results = {}
+        for field in FACET_FIELDS + ['size']:
+            mask = base
+            for other, filter_bitmap in filter_bitmaps.items():
+                if other != field:
+                    mask = mask & filter_bitmap
+            counts = _popcount(self.bitmaps[field] & mask)
+            vocabulary = self.vocabularies[field]
+            present = np.flatnonzero(counts)
+            if field != 'size':
+                present = present[np.argsort(-counts[present], kind='stable')]
+            results[field] = {
+                vocabulary[code]: int(counts[code]) for code in present.tolist()
+                if vocabulary[code] != NOT_SPECIFIED
+            }
+        return results
+
+    def count(self, bitmap: np.ndarray) -> int:
+        return int(_popcount(bitmap))
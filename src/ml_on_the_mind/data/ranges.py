@@ -0,0 +1,97 @@
+"""Range filters and sorting on size, publication date and subject count, from the catalogue.
+
+Each field's values are argsorted once, so the datasets within a range are one
+contiguous slice found with two binary searches, and listing datasets largest
+or newest first is a walk down the presorted positions. Dates are the
+catalogue's parsed epoch seconds; datasets without one never match a date range
+and sort last.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from .catalogue import Catalogue
+
+RANGE_FIELDS = ["size", "subject_count", "date_created"]
+# filter key -> (catalogue field, 0 for the lower bound or 1 for the upper bound), both inclusive
+RANGE_FILTERS = {
+    'min_size': ('size', 0),
+    'max_size': ('size', 1),
+    'min_date': ('date_created', 0),
+    'max_date': ('date_created', 1),
+    'min_subjects': ('subject_count', 0),
+    'max_subjects': ('subject_count', 1),
+}
+# `sort` filter value -> field, sorted largest/newest first
+SORTS = {'newest': 'date_created', 'size': 'size', 'subjects': 'subject_count'}
+
+class RangeIndex:
+    def __init__(self, catalogue: Catalogue):
+        self.catalogue = catalogue
+        self.total = catalogue.total
+        self.order: Dict[str, np.ndarray] = {}
+        self.sorted: Dict[str, np.ndarray] = {}
+        self.ranks: Dict[str, np.ndarray] = {}
+        for field in RANGE_FIELDS:
+            values = np.asarray(catalogue.array(field), dtype=np.float64)
+            known = np.flatnonzero(~np.isnan(values))
+            order = known[np.argsort(values[known], kind='stable')]
+            self.order[field] = order
+            self.sorted[field] = values[order]
+            # Position of each dataset in `order`; datasets without a value rank after all others
+            ranks = np.full(self.total, len(order), dtype=np.int64)
+            ranks[order] = np.arange(len(order))
+            self.ranks[field] = ranks
+
+    def positions(self, field: str, low: Optional[float] = None, high: Optional[float] = None) -> np.ndarray:
+        """Datasets with low <= value <= high, in ascending order of value"""
+        values = self.sorted[field]
+        start = 0 if low is None else np.searchsorted(values, low, side='left')
+        end = len(values) if high is None else np.searchsorted(values, high, side='right')
+        return self.order[field][start:end]
+
+    def constraints(self, filters: Optional[Dict], fields: Iterable[str] = RANGE_FIELDS) -> Dict[str, Tuple]:
+        """field -> (low, high) for the range filters set on `fields`"""
+        constraints: Dict[str, list] = {}
+        for key, (field, bound) in RANGE_FILTERS.items():
+            if field in fields and (filters or {}).get(key) is not None:
+                constraints.setdefault(field, [None, None])[bound] = filters[key]
+        return {field: tuple(bounds) for field, bounds in constraints.items()}
+
+    def mask(self, filters: Optional[Dict], fields: Iterable[str] = RANGE_FIELDS) -> Optional[np.ndarray]:
+        """Datasets passing every range filter on `fields`, or None if none is set"""
+        mask = None
+        for field, (low, high) in self.constraints(filters, fields).items():
+            field_mask = np.zeros(self.total, dtype=bool)
+            field_mask[self.positions(field, low, high)] = True
+            mask = field_mask if mask is None else mask & field_mask
+        return mask
+
+    def strip(self, filters: Optional[Dict]) -> Dict:
+        """The filters other than ranges and sorting, i.e. the ones backends apply themselves"""
+        return {key: value for key, value in (filters or {}).items() if key not in RANGE_FILTERS and key != 'sort'}
+
+    def ids(self, positions: Iterable[int]) -> List[str]:
+        return [self.catalogue.text('id', int(position)) for position in positions]
+
+    def positions_of(self, ids: Iterable[str]) -> np.ndarray:
+        """Catalogue position of each id, -1 for ids not in the catalogue"""
+        positions = [self.catalogue.index_of(dataset_id) for dataset_id in ids]
+        return np.array([-1 if position is None else position for position in positions], dtype=np.int64)
+
+    def ranked(self, sort: str, mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """Every dataset (or those in `mask`) by the sort's field, largest/newest first"""
+        field = SORTS[sort]
+        unknown = np.flatnonzero(self.ranks[field] == len(self.order[field]))
+        ranked = np.concatenate([self.order[field][::-1], unknown])
+        return ranked if mask is None else ranked[mask[ranked]]
+
+    def sort(self, positions: np.ndarray, sort: str) -> np.ndarray:
+        """A permutation of `positions` ordering them by the sort's field, largest/newest
+        first; stable, so ties keep their current (e.g. relevance) order"""
+        field = SORTS[sort]
+        ranks = self.ranks[field][positions]
+        known = len(self.order[field])
+        if not known:
+            return np.arange(len(positions))
+        # Sort on the values, not the ranks: equal values have distinct ranks, which would reorder ties
+        values = self.sorted[field][np.minimum(ranks, known - 1)]
+        return np.argsort(np.where(ranks < known, -values, np.inf), kind='stable')
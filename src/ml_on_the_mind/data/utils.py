@@ -1,7 +1,27 @@
-import json
 import os
-from typing import List, Dict
+from datetime import datetime, timezone
+from typing import Iterator, List, Dict, Optional
+from .cache_io import find_cache_files, iter_records
 from .data_schema import DatasetMetadata
+from .normalize import Normalizer
+
+# Records are normalized column-wise in chunks of this many, keeping streaming loads bounded
+NORMALIZE_CHUNK_SIZE = 10_000
+
+def parse_timestamp(value) -> Optional[datetime]:
+    """Parse an ISO timestamp from either API, treating naive ones as UTC"""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        try:
+            parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
 
 def clean_string(value: str) -> str:
     """Clean and standardize string values"""
@@ -22,7 +42,8 @@ def clean_array(value: List[str]) -> List[str]:
     return cleaned if cleaned else ["Not specified"]
 
 def clean_dataset(dataset: Dict) -> DatasetMetadata:
-    """Clean a single dataset entry"""
+    """Clean a single dataset entry. Loading goes through data.normalize.Normalizer,
+    which does the same cleaning column-wise plus synonym mapping."""
     return {
         'id': clean_string(dataset.get('id')),
         'name': clean_string(dataset.get('name')),
@@ -41,21 +62,34 @@ def clean_dataset(dataset: Dict) -> DatasetMetadata:
         'data_standard': clean_string(dataset.get('data_standard'))
     }
 
+def _chunks(records: Iterator[Dict], size: int) -> Iterator[List[Dict]]:
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def iter_datasets(data_dir: str = "cache", normalizer: Optional[Normalizer] = None) -> Iterator[DatasetMetadata]:
+    """Stream cleaned datasets from every cache file in data directory,
+    holding only one chunk of records in memory at a time for JSONL caches"""
+    normalizer = normalizer or Normalizer()
+    for filepath in find_cache_files(data_dir):
+        filename = os.path.basename(filepath)
+        count = 0
+        try:
+            for chunk in _chunks(iter_records(filepath), NORMALIZE_CHUNK_SIZE):
+                for dataset in normalizer.normalize(chunk):
+                    yield dataset
+                    count += 1
+            print(f"Loaded {count} datasets from {filename}")
+        except Exception as e:
+            print(f"Error loading {filename}: {e}")
+
 def load_datasets(data_dir: str = "cache") -> List[DatasetMetadata]:
-    """Load and clean all dataset JSON files from data directory"""
-    all_datasets = []
-    
-    for filename in os.listdir(data_dir):
-        if filename.endswith('_datasets.json'):
-            filepath = os.path.join(data_dir, filename)
-            try:
-                with open(filepath, 'r') as f:
-                    datasets = json.load(f)
-                cleaned_datasets = [clean_dataset(d) for d in datasets]
-                all_datasets.extend(cleaned_datasets)
-                print(f"Loaded {len(cleaned_datasets)} datasets from {filename}")
-            except Exception as e:
-                print(f"Error loading {filename}: {e}")
-    
+    """Load and clean all dataset cache files from data directory"""
+    all_datasets = list(iter_datasets(data_dir))
     print(f"Total datasets loaded: {len(all_datasets)}")
-    return all_datasets 
\ No newline at end of file
+    return all_datasets
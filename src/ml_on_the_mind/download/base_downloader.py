@@ -1,17 +1,67 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import List, Optional
 import json
 import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from ..data.cache_io import CACHE_FILE_PATTERN, JsonlWriter, cache_filename, find_cache_files, iter_records
 from ..data.data_schema import DatasetMetadata
+from .. import metrics
+
+class CountingRetry(Retry):
+    """Retry that counts every retry in `http_retries_total`, by host"""
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        metrics.inc("http_retries_total", host=getattr(_pool, 'host', None) or "unknown")
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+def create_session(retries: int = 5, backoff_factor: float = 1.0, pool_size: int = 10) -> requests.Session:
+    """Pooled HTTP session that retries with exponential backoff on 429/5xx"""
+    retry = CountingRetry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=None,  # GraphQL queries are POSTs but safe to repeat
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+class RateLimiter:
+    """Spaces out calls so that at most `rate` happen per second, across threads"""
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            scheduled = max(self.next_time, now)
+            self.next_time = scheduled + self.interval
+        if scheduled > now:
+            time.sleep(scheduled - now)
 
 class DatasetDownloader(ABC):
-    def __init__(self):
+    def __init__(self, compression: Optional[str] = None):
         self.data_dir = "cache"
+        self.compression = compression
+        self.crawl_state_file = os.path.join(self.data_dir, "crawl_state.json")
         os.makedirs(self.data_dir, exist_ok=True)
     
     @abstractmethod
-    def fetch_datasets(self) -> List[DatasetMetadata]:
-        """Fetch datasets and return in common format"""
+    def fetch_datasets(self, since: Optional[str] = None) -> List[DatasetMetadata]:
+        """Fetch datasets and return in common format.
+        If `since` is given, only fetch datasets created or modified after it
+        and merge them into the existing cache."""
         pass
     
     @abstractmethod
@@ -19,9 +69,89 @@ class DatasetDownloader(ABC):
         """Map repository-specific format to common format"""
         pass
     
+    def cache_filename(self, source: str) -> str:
+        return cache_filename(source, self.compression)
+
+    def open_writer(self, filename: str) -> JsonlWriter:
+        """Writer for appending datasets to a JSONL cache file as they are mapped"""
+        return JsonlWriter(os.path.join(self.data_dir, filename))
+    
     def save_datasets(self, datasets: List[DatasetMetadata], filename: str):
-        """Save datasets to JSON file"""
+        """Save datasets to a JSONL (or legacy JSON) cache file"""
+        filepath = os.path.join(self.data_dir, filename)
+        if filename.endswith('.json'):
+            with open(filepath, 'w') as f:
+                json.dump(datasets, f, indent=2)
+        else:
+            with self.open_writer(filename) as writer:
+                for dataset in datasets:
+                    writer.write(dataset)
+        print(f"Saved {len(datasets)} datasets to {filepath}")
+
+    def merge_datasets(self, datasets: List[DatasetMetadata], filename: str) -> int:
+        """Merge datasets into the existing cache for the same source by id.
+        The existing cache is streamed, so only the new datasets are held in memory.
+        Returns the number of datasets in the merged cache."""
+        source = CACHE_FILE_PATTERN.match(filename).group('source')
+        existing = next((filepath for filepath in find_cache_files(self.data_dir)
+                         if CACHE_FILE_PATTERN.match(os.path.basename(filepath)).group('source') == source), None)
+        new_ids = {dataset['id'] for dataset in datasets}
+        updated = 0
+        with self.open_writer(filename) as writer:
+            for dataset in datasets:
+                writer.write(dataset)
+            if existing:
+                for dataset in iter_records(existing):
+                    if dataset['id'] in new_ids:
+                        updated += 1
+                    else:
+                        writer.write(dataset)
+            total = writer.count
+        print(f"Merged {len(datasets)} datasets ({len(datasets) - updated} new, {updated} updated) into {writer.filepath}, {total} total")
+        return total
+
+    def load_high_water_mark(self, source: str) -> Optional[str]:
+        """Latest created/modified timestamp seen by the last successful crawl of `source`"""
+        if not os.path.exists(self.crawl_state_file):
+            return None
+        with open(self.crawl_state_file, 'r') as f:
+            return json.load(f).get(source)
+
+    def save_high_water_mark(self, source: str, mark: Optional[str]):
+        if not mark:
+            return
+        state = {}
+        if os.path.exists(self.crawl_state_file):
+            with open(self.crawl_state_file, 'r') as f:
+                state = json.load(f)
+        state[source] = mark
+        tmp_path = f"{self.crawl_state_file}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.crawl_state_file)
+        print(f"Recorded {source} high-water mark {mark}")
+
+    def load_checkpoint(self, filename: str) -> Optional[dict]:
+        """Load crawl progress saved by a previous, interrupted run"""
+        filepath = os.path.join(self.data_dir, filename)
+        if not os.path.exists(filepath):
+            return None
+        try:
+            with open(filepath, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Could not read checkpoint {filepath}: {e}")
+            return None
+
+    def save_checkpoint(self, filename: str, state: dict):
+        """Atomically save crawl progress so a crash can resume from it"""
+        filepath = os.path.join(self.data_dir, filename)
+        tmp_path = f"{filepath}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, filepath)
+
+    def clear_checkpoint(self, filename: str):
         filepath = os.path.join(self.data_dir, filename)
-        with open(filepath, 'w') as f:
-            json.dump(datasets, f, indent=2)
-        print(f"Saved {len(datasets)} datasets to {filepath}") 
\ No newline at end of file
+        if os.path.exists(filepath):
+            os.remove(filepath)
@@ -1,19 +1,70 @@
-from typing import List
-import requests
+import argparse
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Optional
+import json
+import os
 from tqdm import tqdm
 from dandi.dandiapi import DandiAPIClient
 from ..data.data_schema import DatasetMetadata
-from .base_downloader import DatasetDownloader
+from ..data.snapshot import build_snapshot
+from ..data.utils import parse_timestamp
+from .base_downloader import DatasetDownloader, RateLimiter
+from .. import metrics
 
 class DandiDownloader(DatasetDownloader):
-    def __init__(self):
-        super().__init__()
-        self.client = DandiAPIClient()
-        self.output_file = "dandi_datasets.json"
+    def __init__(self, workers: int = 8, requests_per_second: float = 10, compression: Optional[str] = None,
+                 api_url: Optional[str] = None):
+        super().__init__(compression)
+        # None is the public DANDI archive
+        self.client = DandiAPIClient(api_url=api_url)
+        self.output_file = self.cache_filename("dandi")
+        self.metadata_dir = os.path.join(self.data_dir, "dandi_metadata")
+        self.workers = workers
+        self.rate_limiter = RateLimiter(requests_per_second)
+
+    def _metadata_cache_path(self, dandiset) -> str:
+        return os.path.join(self.metadata_dir, dandiset.identifier, f"{dandiset.version_id}.json")
+
+    def _load_cached_metadata(self, dandiset) -> Optional[dict]:
+        """Published versions are immutable, so a cached copy is always valid.
+        Drafts are only reused if they haven't been modified since they were cached."""
+        filepath = self._metadata_cache_path(dandiset)
+        if not os.path.exists(filepath):
+            return None
+        try:
+            with open(filepath, 'r') as f:
+                cached = json.load(f)
+        except Exception:
+            return None
+        if dandiset.version_id == "draft" and cached.get('modified') != dandiset.version.modified.isoformat():
+            return None
+        return cached['metadata']
+
+    def _save_cached_metadata(self, dandiset, metadata: dict):
+        filepath = self._metadata_cache_path(dandiset)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        tmp_path = f"{filepath}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'modified': dandiset.version.modified.isoformat(), 'metadata': metadata}, f)
+        os.replace(tmp_path, filepath)
+
+    def get_raw_metadata(self, dandiset) -> dict:
+        metadata = self._load_cached_metadata(dandiset)
+        if metadata is None:
+            metrics.inc("cache_misses_total", cache="dandi_metadata")
+            self.rate_limiter.wait()
+            with metrics.timer("http_request_seconds", source="dandi", operation="metadata"):
+                metadata = dandiset.get_raw_metadata()
+            self._save_cached_metadata(dandiset, metadata)
+        else:
+            metrics.inc("cache_hits_total", cache="dandi_metadata")
+        return metadata
     
+    @metrics.timed("map_to_common_format_seconds", source="dandi")
     def map_to_common_format(self, dandiset) -> DatasetMetadata:
         try:
-            metadata = dandiset.get_raw_metadata()
+            metadata = self.get_raw_metadata(dandiset)
             summary = metadata.get('assetsSummary', {})
             
             species = []
@@ -63,25 +114,62 @@ class DandiDownloader(DatasetDownloader):
             print(f"Error mapping dandiset {dandiset.identifier}: {str(e)}")
             raise
     
-    def fetch_datasets(self) -> List[DatasetMetadata]:
+    def fetch_datasets(self, since: Optional[str] = None) -> List[DatasetMetadata]:
         print("Fetching datasets from DANDI...")
         datasets = []
+        since_time = parse_timestamp(since)
+        mark = None
+        failures = 0
         
         try:
-            dandisets = list(self.client.get_dandisets())
-            pbar = tqdm(dandisets, desc="Processing DANDI datasets")
-            
-            for dandiset in pbar:
-                try:
-                    dataset = self.map_to_common_format(dandiset)
-                    datasets.append(dataset)
-                    pbar.set_postfix({'total': len(datasets)})
-                    
-                except Exception as e:
-                    print(f"Error processing dandiset {dandiset.identifier}: {e}")
-                    continue
-            
-            self.save_datasets(datasets, self.output_file)
+            pbar = tqdm(desc="Processing DANDI datasets", unit=" datasets")
+
+            def collect(futures):
+                nonlocal failures
+                for future in futures:
+                    dandiset = in_flight.pop(future)
+                    try:
+                        dataset = future.result()
+                        datasets.append(dataset)
+                        if writer:
+                            writer.write(dataset)
+                        pbar.update(1)
+                        pbar.set_postfix({'total': len(datasets)})
+                    except Exception as e:
+                        failures += 1
+                        metrics.inc("crawl_failures_total", source="dandi")
+                        print(f"Error processing dandiset {dandiset.identifier}: {e}")
+
+            # A full crawl streams datasets to the cache as they are mapped; a delta
+            # crawl is merged into the existing cache at the end
+            # Listing pages are consumed lazily while earlier dandisets are being fetched
+            with (nullcontext() if since_time else self.open_writer(self.output_file)) as writer, \
+                    ThreadPoolExecutor(max_workers=self.workers) as executor:
+                in_flight = {}
+                # Most recently modified first, so a delta crawl can stop at the high-water mark
+                for dandiset in self.client.get_dandisets(order="-modified"):
+                    modified = parse_timestamp(dandiset.modified)
+                    if since_time and modified and modified <= since_time:
+                        break
+                    if modified and (mark is None or modified > mark):
+                        mark = modified
+                    if len(in_flight) >= self.workers * 4:
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        collect(done)
+                    in_flight[executor.submit(self.map_to_common_format, dandiset)] = dandiset
+                collect(list(in_flight))
+
+            pbar.close()
+            if since_time:
+                print(f"{len(datasets)} DANDI datasets changed since {since}")
+                self.merge_datasets(datasets, self.output_file)
+            else:
+                print(f"Saved {len(datasets)} datasets to {writer.filepath}")
+            if failures:
+                # Leave the mark where it was so the next delta crawl retries the failed dandisets
+                print(f"{failures} dandisets failed, not advancing the high-water mark")
+            else:
+                self.save_high_water_mark('dandi', mark.isoformat() if mark else None)
             
         except Exception as e:
             print(f"Error fetching DANDI datasets: {e}")
@@ -89,6 +177,15 @@ class DandiDownloader(DatasetDownloader):
         return datasets
 
 if __name__ == "__main__":
-    downloader = DandiDownloader()
-    datasets = downloader.fetch_datasets()
-    print(f"Total DANDI datasets downloaded: {len(datasets)}")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Download dataset metadata from DANDI")
+    parser.add_argument("--since-last-crawl", action="store_true",
+                        help="Only fetch dandisets created or modified since the last crawl and merge them into the cache")
+    parser.add_argument("--compression", choices=["gzip", "zstd"], help="Compress the JSONL cache file")
+    args = parser.parse_args()
+    downloader = DandiDownloader(compression=args.compression)
+    since = downloader.load_high_water_mark('dandi') if args.since_last_crawl else None
+    datasets = downloader.fetch_datasets(since=since)
+    print(f"Total DANDI datasets downloaded: {len(datasets)}")
+    # Cleaned once here rather than by every index build
+    build_snapshot(downloader.data_dir)
+    print(metrics.REGISTRY.summary())
@@ -1,23 +1,77 @@
-from typing import List
-import requests
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, List, Optional
 from tqdm import tqdm
 from ..data.data_schema import DatasetMetadata
-from .base_downloader import DatasetDownloader
+from ..data.snapshot import build_snapshot
+from ..data.utils import parse_timestamp
+from .base_downloader import DatasetDownloader, create_session
+from .. import metrics
+
+# Lightweight listing query: everything except the readme bodies
+DATASETS_QUERY = """
+    query($after: String, $first: Int = 100) {
+        datasets(first: $first, after: $after) {
+            edges {
+                node {
+                    id
+                    metadata {
+                        species
+                        datasetId
+                        datasetName
+                        associatedPaperDOI
+                        modalities
+                        tasksCompleted
+                        datasetUrl
+                    }
+                    name
+                    draft {
+                        size
+                        modified
+                    }
+                    publishDate
+                }
+            }
+            pageInfo {
+                hasNextPage
+                endCursor
+            }
+        }
+    }
+"""
 
 class OpenNeuroDownloader(DatasetDownloader):
-    def __init__(self):
-        super().__init__()
-        self.api_url = "https://openneuro.org/crn/graphql"
-        self.output_file = "openneuro_datasets.json"
+    def __init__(
+        self,
+        api_url: str = "https://openneuro.org/crn/graphql",
+        page_size: int = 100,
+        fetch_readmes: bool = True,
+        readme_workers: int = 8,
+        readme_batch_size: int = 10,
+        timeout: float = 60,
+        compression: Optional[str] = None,
+    ):
+        super().__init__(compression)
+        self.api_url = api_url
+        self.output_file = self.cache_filename("openneuro")
+        self.checkpoint_file = "openneuro_checkpoint.json"
+        self.page_size = page_size
+        self.fetch_readmes = fetch_readmes
+        self.readme_workers = readme_workers
+        self.readme_batch_size = readme_batch_size
+        self.timeout = timeout
+        self.session = create_session(pool_size=readme_workers)
     
+    @metrics.timed("map_to_common_format_seconds", source="openneuro")
     def map_to_common_format(self, dataset: dict) -> DatasetMetadata:
         metadata = dataset['metadata']
-        draft = dataset.get('draft', {})
+        draft = dataset.get('draft') or {}
         
         return {
             'id': metadata['datasetId'],
             'name': metadata['datasetName'],
-            'description': draft.get('readme', ''),
+            'description': draft.get('readme') or '',
             'modalities': metadata.get('modalities', []),
             'species': [metadata.get('species', '')] if metadata.get('species') else [],
             'tasks': metadata.get('tasksCompleted', []),
@@ -29,87 +83,147 @@ class OpenNeuroDownloader(DatasetDownloader):
             'authors': [],  # OpenNeuro doesn't provide this in the API
             'license': None  # OpenNeuro doesn't provide this in the API
         }
-    
-    def fetch_datasets(self) -> List[DatasetMetadata]:
-        query = """
-            query($after: String, $first: Int = 100) {
-                datasets(first: $first, after: $after) {
-                    edges {
-                        node {
-                            metadata {
-                                species
-                                datasetId
-                                datasetName
-                                associatedPaperDOI
-                                modalities
-                                tasksCompleted
-                                datasetUrl
-                            }
-                            name
-                            draft {
-                                readme
-                                size
-                            }
-                            publishDate
-                        }
-                    }
-                    pageInfo {
-                        hasNextPage
-                        endCursor
-                    }
-                }
-            }
-        """
-        
-        datasets = []
-        has_next_page = True
-        after_cursor = None
-        
-        pbar = tqdm(desc="Fetching OpenNeuro datasets", unit=" datasets")
-        
-        while has_next_page:
-            variables = {
-                "first": 100,
-                "after": after_cursor
-            }
-            
-            response = requests.post(
+
+    @staticmethod
+    def _last_changed(node: dict) -> Optional[datetime]:
+        timestamps = [
+            parse_timestamp((node.get('draft') or {}).get('modified')),
+            parse_timestamp(node.get('publishDate')),
+        ]
+        return max((timestamp for timestamp in timestamps if timestamp), default=None)
+
+    def _query(self, query: str, variables: dict, operation: str = "query") -> dict:
+        with metrics.timer("http_request_seconds", source="openneuro", operation=operation):
+            response = self.session.post(
                 self.api_url,
-                json={'query': query, 'variables': variables}
+                json={'query': query, 'variables': variables},
+                timeout=self.timeout
             )
             
             if response.status_code != 200:
                 raise Exception(f"Query failed with status code: {response.status_code}")
             
             result = response.json()
+        if result.get('errors'):
+            metrics.inc("graphql_errors_total", source="openneuro", operation=operation)
+            print(f"GraphQL errors: {result['errors']}")
+        return result
+
+    def _fetch_readmes(self, dataset_ids: List[str]) -> Dict[str, str]:
+        """Fetch several readmes in one request using one aliased field per dataset"""
+        variables = {f"id{i}": dataset_id for i, dataset_id in enumerate(dataset_ids)}
+        params = ", ".join(f"$id{i}: ID!" for i in range(len(dataset_ids)))
+        fields = "\n".join(f"d{i}: dataset(id: $id{i}) {{ draft {{ readme }} }}" for i in range(len(dataset_ids)))
+        result = self._query(f"query({params}) {{\n{fields}\n}}", variables, operation="readmes")
+
+        data = result.get('data') or {}
+        readmes = {}
+        for i, dataset_id in enumerate(dataset_ids):
+            dataset = data.get(f"d{i}") or {}
+            readmes[dataset_id] = (dataset.get('draft') or {}).get('readme') or ''
+        return readmes
+
+    def _fetch_metadata_pages(self, state: dict):
+        pbar = tqdm(desc="Fetching OpenNeuro datasets", unit=" datasets", initial=len(state['nodes']))
+        
+        while state['has_next_page']:
+            variables = {
+                "first": self.page_size,
+                "after": state['cursor']
+            }
+            result = self._query(DATASETS_QUERY, variables, operation="datasets")
             
-            if 'data' in result and 'datasets' in result['data']:
+            if 'data' in result and result['data'] and 'datasets' in result['data']:
                 current_datasets = result['data']['datasets']['edges']
-                
-                # Map each dataset to common format
-                mapped_datasets = [
-                    self.map_to_common_format(edge['node']) 
-                    for edge in current_datasets
-                ]
-                datasets.extend(mapped_datasets)
+                state['nodes'].extend(edge['node'] for edge in current_datasets)
                 
                 page_info = result['data']['datasets']['pageInfo']
-                has_next_page = page_info['hasNextPage']
-                after_cursor = page_info['endCursor']
+                state['has_next_page'] = page_info['hasNextPage']
+                state['cursor'] = page_info['endCursor']
+                self.save_checkpoint(self.checkpoint_file, state)
                 
-                pbar.update(len(mapped_datasets))
+                pbar.update(len(current_datasets))
             else:
-                print("No data received in response")
-                break
+                pbar.close()
+                # Stopping here would pass the pages so far off as the whole listing; the
+                # checkpoint keeps them, and the next run resumes from this cursor
+                raise Exception(f"No datasets received after cursor {state['cursor']}: {result.get('errors')}")
         
         pbar.close()
+
+    def _fetch_readme_pass(self, state: dict):
+        """Second pass: fetch the large readme bodies concurrently for nodes that don't have one yet"""
+        nodes_by_id = {node['id']: node for node in state['nodes']}
+        missing = [node['id'] for node in state['nodes'] if (node.get('draft') or {}).get('readme') is None]
+        if not missing:
+            return
+
+        batches = [missing[i:i+self.readme_batch_size] for i in range(0, len(missing), self.readme_batch_size)]
+        pbar = tqdm(total=len(missing), desc="Fetching OpenNeuro readmes", unit=" readmes")
+        with ThreadPoolExecutor(max_workers=self.readme_workers) as executor:
+            futures = [executor.submit(self._fetch_readmes, batch) for batch in batches]
+            for completed, future in enumerate(as_completed(futures), start=1):
+                readmes = future.result()
+                for dataset_id, readme in readmes.items():
+                    node = nodes_by_id[dataset_id]
+                    node['draft'] = {**(node.get('draft') or {}), 'readme': readme}
+                pbar.update(len(readmes))
+                if completed % 10 == 0:
+                    self.save_checkpoint(self.checkpoint_file, state)
+        pbar.close()
+        self.save_checkpoint(self.checkpoint_file, state)
+    
+    def fetch_datasets(self, since: Optional[str] = None) -> List[DatasetMetadata]:
+        state = self.load_checkpoint(self.checkpoint_file)
+        if state:
+            print(f"Resuming OpenNeuro crawl with {len(state['nodes'])} datasets already fetched")
+        else:
+            state = {'cursor': None, 'has_next_page': True, 'nodes': []}
+
+        # The listing is cheap, so it is always walked in full; a delta crawl only
+        # skips the expensive readme fetches for datasets that haven't changed
+        self._fetch_metadata_pages(state)
+        changed = [self._last_changed(node) for node in state['nodes']]
+        mark = max((timestamp for timestamp in changed if timestamp), default=None)
+        since_time = parse_timestamp(since)
+        if since_time:
+            state['nodes'] = [
+                node for node, timestamp in zip(state['nodes'], changed)
+                if timestamp is None or timestamp > since_time
+            ]
+            self.save_checkpoint(self.checkpoint_file, state)
+            print(f"{len(state['nodes'])} OpenNeuro datasets changed since {since}")
+
+        if self.fetch_readmes:
+            self._fetch_readme_pass(state)
         
-        # Save datasets to JSON file
-        self.save_datasets(datasets, self.output_file)
+        # Map each dataset to common format
+        if since_time:
+            datasets = [self.map_to_common_format(node) for node in state['nodes']]
+            self.merge_datasets(datasets, self.output_file)
+        else:
+            datasets = []
+            with self.open_writer(self.output_file) as writer:
+                for node in state['nodes']:
+                    dataset = self.map_to_common_format(node)
+                    writer.write(dataset)
+                    datasets.append(dataset)
+            print(f"Saved {len(datasets)} datasets to {writer.filepath}")
+        self.save_high_water_mark('openneuro', mark.isoformat() if mark else None)
+        self.clear_checkpoint(self.checkpoint_file)
         
         return datasets
 
 if __name__ == "__main__":
-    downloader = OpenNeuroDownloader()
-    datasets = downloader.fetch_datasets()
-    print(f"Total datasets downloaded: {len(datasets)}")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Download dataset metadata from OpenNeuro")
+    parser.add_argument("--since-last-crawl", action="store_true",
+                        help="Only fetch datasets created or modified since the last crawl and merge them into the cache")
+    parser.add_argument("--compression", choices=["gzip", "zstd"], help="Compress the JSONL cache file")
+    args = parser.parse_args()
+    downloader = OpenNeuroDownloader(compression=args.compression)
+    since = downloader.load_high_water_mark('openneuro') if args.since_last_crawl else None
+    datasets = downloader.fetch_datasets(since=since)
+    print(f"Total datasets downloaded: {len(datasets)}")
+    # Cleaned once here rather than by every index build
+    build_snapshot(downloader.data_dir)
+    print(metrics.REGISTRY.summary())
@@ -0,0 +1,250 @@
+"""Process-wide counters and latency histograms for the crawlers, index builds and the app.
+
+Recording is a lock, a bisect and a few additions, so it is cheap enough to
+leave on everywhere. Histograms use fixed log-spaced buckets (as Prometheus
+does), from which p50/p99 are estimated.
+
+Export:
+- METRICS_FILE=path appends a JSONL snapshot when the process exits (CLI tools),
+  or call `write_jsonl` yourself
+- `serve(port)` exposes the Prometheus text format at /metrics; the app does this
+  when METRICS_PORT is set
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Upper bounds in seconds, 0.1ms to ~2 minutes
+BUCKETS = [0.0001 * 2 ** i for i in range(21)]
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def _labels(labels: Dict) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+class Histogram:
+    def __init__(self, buckets: List[float] = BUCKETS):
+        self.buckets = buckets
+        # The last slot counts observations above the largest bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Estimated by interpolating within the bucket the quantile falls in,
+        clamped to the observed range"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = max(self.buckets[i - 1] if i > 0 else 0.0, self.min)
+                upper = min(self.buckets[i] if i < len(self.buckets) else self.max, self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+class Registry:
+    def __init__(self):
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        # Callbacks returning {(name, labels): value} for counters kept elsewhere, e.g. cache hit counts
+        self.collectors: List[Callable[[], Dict[Tuple[str, Labels], float]]] = []
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def timer(self, name: str, **labels) -> "_Timer":
+        """Observe the duration of the block in seconds; a block that raises also counts
+        `<name>_failures_total`. Blocks cut short by BaseExceptions (Ctrl-C, a Streamlit
+        rerun) aren't observed, since their duration means nothing."""
+        return _Timer(self, name, labels)
+
+    def timed(self, name: str, **labels):
+        """Decorator form of `timer`"""
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def timed_iter(self, name: str, iterable: Iterable, **labels) -> Iterator:
+        """Pass items through, observing the total time spent producing them once the
+        iterable is exhausted, and counting them in `<name>_items_total` (minus any `_seconds`)"""
+        items_name = f"{name[:-len('_seconds')] if name.endswith('_seconds') else name}_items_total"
+        elapsed = 0.0
+        count = 0
+        iterator = iter(iterable)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - start
+                count += 1
+                yield item
+        finally:
+            self.observe(name, elapsed, **labels)
+            self.inc(items_name, count, **labels)
+
+    def add_collector(self, collector: Callable[[], Dict[Tuple[str, Labels], float]]):
+        with self._lock:
+            self.collectors.append(collector)
+
+    def _counters(self) -> Dict[Tuple[str, Labels], float]:
+        with self._lock:
+            counters = dict(self.counters)
+            collectors = list(self.collectors)
+        for collector in collectors:
+            try:
+                counters.update(collector())
+            except Exception as e:
+                print(f"Metrics collector failed: {str(e)}")
+        return counters
+
+    def snapshot(self) -> Dict:
+        counters = self._counters()
+        with self._lock:
+            histograms = [(key, histogram.count, histogram.sum, histogram.quantile(0.5), histogram.quantile(0.99))
+                          for key, histogram in self.histograms.items()]
+        return {
+            'time': time.time(),
+            'pid': os.getpid(),
+            'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                         for (name, labels), value in sorted(counters.items())],
+            'timers': [{'name': name, 'labels': dict(labels), 'count': count, 'sum': total, 'p50': p50, 'p99': p99}
+                       for (name, labels), count, total, p50, p99 in sorted(histograms)],
+        }
+
+    def to_prometheus(self) -> str:
+        def format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+            pairs = list(labels) + ([extra] if extra else [])
+            if not pairs:
+                return ""
+            escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+            return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(self._counters().items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        with self._lock:
+            histograms = sorted((key, list(h.counts), h.count, h.sum, h.buckets) for key, h in self.histograms.items())
+        for (name, labels), counts, count, total, buckets in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{format_labels(labels, ('le', repr(bound)))} {cumulative}")
+            lines.append(f"{name}_bucket{format_labels(labels, ('le', '+Inf'))} {count}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write_jsonl(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, 'a') as f:
+            f.write(json.dumps(self.snapshot()) + "\n")
+
+    def summary(self) -> str:
+        """Human-readable table of timers and counters, for the end of a CLI run"""
+        snapshot = self.snapshot()
+        lines = []
+        for timer in snapshot['timers']:
+            labels = ",".join(f"{key}={value}" for key, value in timer['labels'].items())
+            lines.append(f"  {timer['name']}{'{' + labels + '}' if labels else ''}: {timer['count']} calls, "
+                         f"{timer['sum']:.2f}s total, p50 {timer['p50'] * 1000:.1f}ms, p99 {timer['p99'] * 1000:.1f}ms")
+        for counter in snapshot['counters']:
+            labels = ",".join(f"{key}={value}" for key, value in counter['labels'].items())
+            lines.append(f"  {counter['name']}{'{' + labels + '}' if labels else ''}: {counter['value']:g}")
+        return "\n".join(lines)
+
+class _Timer:
+    # A plain class rather than @contextmanager: it is entered on every search and fetch
+    __slots__ = ('registry', 'name', 'labels', 'start')
+
+    def __init__(self, registry: Registry, name: str, labels: Dict):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and not issubclass(exc_type, Exception):
+            return False
+        self.registry.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        if exc_type is not None:
+            self.registry.inc(f"{self.name}_failures_total", **self.labels)
+        return False
+
+REGISTRY = Registry()
+inc = REGISTRY.inc
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+timed = REGISTRY.timed
+timed_iter = REGISTRY.timed_iter
+
+def serve(port: int, registry: Registry = REGISTRY, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve the Prometheus text format at http://host:port/metrics from a daemon thread"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.to_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving metrics at http://{host}:{port}/metrics")
+    return server
+
+if os.environ.get("METRICS_FILE"):
+    atexit.register(REGISTRY.write_jsonl, os.environ["METRICS_FILE"])
@@ -0,0 +1,140 @@
+"""Prefix autocomplete over dataset names, ids, tasks, species and modalities.
+
+Keys live in lowercased, sorted arrays; a prefix is found with bisect and the
+matches are the contiguous run after it, so a lookup is a binary search plus a
+short scan. Names are also indexed from each word, so "visual" finds
+"Mouse visual cortex". Facet values (tasks, species, modalities) are few and
+have an array of their own that is scanned in full, so a short prefix shared by
+thousands of names can't push them out of the scan.
+
+Sorting the keys takes seconds for 100k datasets, so build_vector_db saves the
+index next to the catalogue as packed strings, and the app memory-maps it:
+    meta.json                       count, build time and the catalogue it was built from
+    [facet_]<keys|texts|kinds>_data.npy / _offsets.npy    utf-8 strings packed into one byte array
+    [facet_]weights.npy             int64 per key
+"""
+import json
+import os
+from bisect import bisect_left
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from .storage import replace_directory
+
+NOT_SPECIFIED = "Not specified"
+# catalogue field -> suggestion kind
+FACET_KINDS = {'modalities': 'modality', 'species': 'species', 'tasks': 'task'}
+# Facet values outrank names and ids of equal prefix
+FACET_BOOST = 1_000_000
+PREFIX_INDEX_DIR = os.path.join("cache", "prefix_index")
+PACKED_COLUMNS = ["keys", "texts", "kinds"]
+# Column prefix of the names and ids, and of the facet values
+GROUPS = ["", "facet_"]
+
+class _PackedStrings(Sequence):
+    """Read-only list of strings over memory-mapped utf-8 bytes; bisect works on it directly"""
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        return bytes(self.data[self.offsets[index]:self.offsets[index + 1]]).decode('utf-8')
+
+class PrefixIndex:
+    def __init__(self, entries: Iterable[Tuple[str, str, str, int]]):
+        """`entries` are (key, text, kind, weight): `key` is what's matched, `text` what's suggested"""
+        rows = sorted({(key.lower(), text, kind, weight) for key, text, kind, weight in entries if key})
+        facet_kinds = set(FACET_KINDS.values())
+        for group, facets in zip(GROUPS, [False, True]):
+            group_rows = [row for row in rows if (row[2] in facet_kinds) == facets]
+            for position, column in enumerate(PACKED_COLUMNS + ["weights"]):
+                setattr(self, group + column, [row[position] for row in group_rows])
+
+    @classmethod
+    def from_catalogue(cls, catalogue) -> "PrefixIndex":
+        entries = []
+        for field, kind in FACET_KINDS.items():
+            for value, count in catalogue.facet_counts(field).items():
+                entries.append((value, value, kind, FACET_BOOST + count))
+        for dataset_id in catalogue.texts('id'):
+            entries.append((dataset_id, dataset_id, 'id', 1))
+        for name in catalogue.texts('name'):
+            if not name or name == NOT_SPECIFIED:
+                continue
+            words = name.split()
+            for start in range(len(words)):
+                entries.append((" ".join(words[start:]), name, 'name', 1 if start == 0 else 0))
+        return cls(entries)
+
+    def save(self, path: str = PREFIX_INDEX_DIR, **build_info):
+        tmp_path = f"{path}.tmp"
+        os.makedirs(tmp_path, exist_ok=True)
+        for group in GROUPS:
+            for column in PACKED_COLUMNS:
+                encoded = [value.encode('utf-8') for value in getattr(self, group + column)]
+                offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+                np.cumsum([len(value) for value in encoded], out=offsets[1:])
+                np.save(os.path.join(tmp_path, f"{group}{column}_data.npy"),
+                        np.frombuffer(b"".join(encoded), dtype=np.uint8))
+                np.save(os.path.join(tmp_path, f"{group}{column}_offsets.npy"), offsets)
+            np.save(os.path.join(tmp_path, f"{group}weights.npy"), np.asarray(getattr(self, group + "weights"), dtype=np.int64))
+        with open(os.path.join(tmp_path, "meta.json"), 'w') as f:
+            json.dump({'count': len(self), 'built_at': datetime.now(timezone.utc).isoformat(), **build_info}, f)
+        replace_directory(tmp_path, path)
+        print(f"Saved autocomplete index of {len(self)} keys to {path}")
+
+    @classmethod
+    def load(cls, path: str = PREFIX_INDEX_DIR, catalogue_version: Optional[str] = None) -> Optional["PrefixIndex"]:
+        """The saved index, memory-mapped; None if it hasn't been built, or was built
+        from a catalogue other than `catalogue_version`"""
+        try:
+            with open(os.path.join(path, "meta.json"), 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if catalogue_version is not None and meta.get('catalogue_version') != catalogue_version:
+            return None
+        index = cls([])
+        try:
+            for group in GROUPS:
+                for column in PACKED_COLUMNS:
+                    setattr(index, group + column, _PackedStrings(
+                        np.load(os.path.join(path, f"{group}{column}_data.npy"), mmap_mode='r'),
+                        np.load(os.path.join(path, f"{group}{column}_offsets.npy"), mmap_mode='r')
+                    ))
+                setattr(index, group + "weights", np.load(os.path.join(path, f"{group}weights.npy"), mmap_mode='r'))
+        except OSError:
+            # Saved before facet values had their own arrays
+            return None
+        return index
+
+    def __len__(self) -> int:
+        return len(self.keys) + len(self.facet_keys)
+
+    def _scan(self, candidates: Dict, group: str, prefix: str, scan: Optional[int]):
+        keys, texts = getattr(self, group + "keys"), getattr(self, group + "texts")
+        kinds, weights = getattr(self, group + "kinds"), getattr(self, group + "weights")
+        start = bisect_left(keys, prefix)
+        end = len(keys) if scan is None else min(start + scan, len(keys))
+        for i in range(start, end):
+            if not keys[i].startswith(prefix):
+                break
+            text, kind, weight = texts[i], kinds[i], int(weights[i])
+            if candidates.get((text, kind), -1) < weight:
+                candidates[(text, kind)] = weight
+
+    def suggest(self, prefix: str, limit: int = 8, scan: int = 200) -> List[Dict]:
+        """Best `limit` completions of `prefix`: every matching facet value, and names
+        and ids from no more than `scan` matching keys"""
+        prefix = " ".join(prefix.lower().split())
+        if not prefix:
+            return []
+        candidates = {}
+        self._scan(candidates, "facet_", prefix, None)
+        self._scan(candidates, "", prefix, scan)
+        ranked = sorted(candidates.items(), key=lambda item: (-item[1], item[0][0]))[:limit]
+        return [{'text': text, 'kind': kind} for (text, kind), _ in ranked]
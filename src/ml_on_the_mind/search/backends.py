@@ -0,0 +1,602 @@
+"""Search backends: the Marqo service, or an in-process index of precomputed embeddings."""
+from abc import ABC, abstractmethod
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+from .chunking import CHUNK_OVERLAP, CHUNK_WORDS, document_passages, passage_hash, passage_snippet
+from .embedders import Embedder, load_embedder
+from .lexical import LexicalIndex
+from .parallel_embedding import embed_texts
+from .storage import replace_directory
+
+LOCAL_INDEX_DIR = os.path.join("cache", "local_index")
+# filter key -> document field for exact-match filters
+FILTER_FIELDS = {
+    'modality': 'modalities',
+    'species': 'species',
+    'tasks': 'tasks',
+    'source': 'source',
+    'data_standard': 'data_standard',
+}
+
+def build_filter_string(filters: Optional[Dict]) -> Optional[str]:
+    """Marqo filter string for the filters the app exposes"""
+    filter_conditions = []
+    if filters:
+        if filters.get('modality'):
+            filter_conditions.append(f"modalities:{filters['modality']}")
+        if filters.get('min_size') is not None:
+            filter_conditions.append(f"size:[{filters['min_size']} TO *]")
+        if filters.get('max_size') is not None:
+            filter_conditions.append(f"size:[* TO {filters['max_size']}]")
+        if filters.get('species'):
+            filter_conditions.append(f"species:{filters['species']}")
+        if filters.get('tasks'):
+            filter_conditions.append(f"tasks:{filters['tasks']}")
+        if filters.get('source'):
+            filter_conditions.append(f"source:{filters['source']}")
+        if filters.get('data_standard'):
+            filter_conditions.append(f"data_standard:{filters['data_standard']}")
+
+    return " AND ".join(filter_conditions) if filter_conditions else None
+
+def matches_filters(doc: Dict, filters: Optional[Dict]) -> bool:
+    """Whether a document passes the filters, with the same semantics as the filter string"""
+    filters = filters or {}
+    for key, field in FILTER_FIELDS.items():
+        if filters.get(key):
+            values = doc.get(field)
+            if filters[key] not in (values if isinstance(values, list) else [values]):
+                return False
+    size = int(doc.get('size') or 0)
+    if filters.get('min_size') is not None and size < filters['min_size']:
+        return False
+    if filters.get('max_size') is not None and size > filters['max_size']:
+        return False
+    return True
+
+class SearchBackend(ABC):
+    @property
+    @abstractmethod
+    def version(self) -> str:
+        """Changes whenever the underlying index does, for cache invalidation"""
+        pass
+
+    @abstractmethod
+    def search(
+        self,
+        query: str,
+        filters: Optional[Dict] = None,
+        limit: int = 10,
+        offset: int = 0,
+        attributes_to_retrieve: Optional[List[str]] = None,
+    ) -> List[Dict]:
+        """Hits for `query` ("*" for no query) in relevance order, each with `_id` and `_score`"""
+        pass
+
+    @abstractmethod
+    def get_documents(self, ids: List[str]) -> List[Dict]:
+        """Documents by id, skipping ids that aren't in the index"""
+        pass
+
+    @abstractmethod
+    def get_stats(self) -> Dict:
+        """At least {'numberOfDocuments': int}"""
+        pass
+
+    @property
+    def embedding_space(self) -> str:
+        """Identifies the model query vectors come from; cached vectors are only valid within it"""
+        return self.version
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Query vectors, for warming the query embedding cache"""
+        raise NotImplementedError(f"{type(self).__name__} can't embed queries")
+
+    def document_vectors(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        """id -> the mean of the document's passage vectors, for the related-datasets graph"""
+        raise NotImplementedError(f"{type(self).__name__} can't read document vectors")
+
+    def query_vector(self, query: str) -> Optional[np.ndarray]:
+        """The query's vector from the query cache, embedding and caching it on a miss.
+        None when the backend has no query cache."""
+        cache = getattr(self, 'query_cache', None)
+        if cache is None:
+            return None
+        cache.set_space(self.embedding_space)
+        vector = cache.get(query)
+        if vector is None:
+            vector = self.embed_queries([query])[0]
+            cache.put(query, vector)
+        return vector
+
+class MarqoBackend(SearchBackend):
+    def __init__(self, client, index_name: str, query_cache=None):
+        self.client = client
+        self.index_name = index_name
+        self.query_cache = query_cache
+
+    @property
+    def version(self) -> str:
+        return self.index_name
+
+    @property
+    def embedding_space(self) -> str:
+        # The model is a property of the index, so vectors are only reused within one index
+        return f"marqo:{self.index_name}"
+
+    def embed_queries(self, queries):
+        results = self.client.index(self.index_name).embed(queries, content_type="query")
+        return np.asarray(results["embeddings"], dtype=np.float32)
+
+    def search(self, query, filters=None, limit=10, offset=0, attributes_to_retrieve=None):
+        kwargs = {'q': query}
+        if query and query != "*":
+            try:
+                vector = self.query_vector(query)
+            except Exception as e:
+                # e.g. a Marqo server without the embed endpoint; let it embed the text itself
+                print(f"Could not embed query, searching by text: {str(e)}")
+                vector = None
+            if vector is not None:
+                # Search by the cached vector instead of having Marqo embed the text again
+                kwargs = {'q': None, 'context': {'tensor': [{'vector': vector.tolist(), 'weight': 1}]}}
+        results = self.client.index(self.index_name).search(
+            **kwargs,
+            limit=limit,
+            offset=offset,
+            filter_string=build_filter_string(filters),
+            attributes_to_retrieve=attributes_to_retrieve
+        )
+        return results["hits"]
+
+    def get_documents(self, ids):
+        if not ids:
+            return []
+        results = self.client.index(self.index_name).get_documents(ids)
+        return [doc for doc in results.get('results', []) if doc.get('_found', True)]
+
+    def document_vectors(self, ids, batch_size=100):
+        vectors = {}
+        index = self.client.index(self.index_name)
+        for start in range(0, len(ids), batch_size):
+            # expose_facets returns the stored vector of every chunk of every tensor field
+            results = index.get_documents(ids[start:start + batch_size], expose_facets=True)
+            for doc in results.get('results', []):
+                embeddings = [facet['_embedding'] for facet in doc.get('_tensor_facets') or [] if '_embedding' in facet]
+                if doc.get('_found', True) and embeddings:
+                    vectors[doc['_id']] = np.mean(np.asarray(embeddings, dtype=np.float32), axis=0)
+        return vectors
+
+    def get_stats(self):
+        return self.client.index(self.index_name).get_stats()
+
+def _quantize(vectors: np.ndarray, dtype: str):
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    if dtype == "int8":
+        # Symmetric per-row quantisation; scores are rescaled by the row scale at query time
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    raise ValueError(f"Unsupported embedding dtype {dtype!r}, expected float16 or int8")
+
+class _PreviousPassages:
+    """Vectors of the passages in the index already at `path`, if it was built the
+    same way, so unchanged passages don't need embedding again"""
+
+    def __init__(self, path: str, embedder: Embedder, chunk_words: int, chunk_overlap: int):
+        self.rows: Dict[str, int] = {}
+        try:
+            with open(os.path.join(path, "meta.json"), 'r') as f:
+                meta = json.load(f)
+            if (meta.get('embedder'), meta.get('chunk_words'), meta.get('chunk_overlap')) != \
+                    (embedder.name, chunk_words, chunk_overlap):
+                return
+            with open(os.path.join(path, "passage_hashes.json"), 'r') as f:
+                hashes = json.load(f)
+            self.embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode='r')
+            scales_path = os.path.join(path, "scales.npy")
+            self.scales = np.load(scales_path) if os.path.exists(scales_path) else None
+        except (OSError, ValueError):
+            return
+        self.rows = {key: row for row, key in enumerate(hashes)}
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        vector = np.asarray(self.embeddings[row], dtype=np.float32)
+        return vector * self.scales[row] if self.scales is not None else vector
+
+def build_local_index(
+    documents: Iterable[Dict],
+    embedder: Embedder,
+    path: str = LOCAL_INDEX_DIR,
+    dtype: str = "float16",
+    batch_size: int = 64,
+    text_field: str = "searchable_content",
+    chunk_words: int = CHUNK_WORDS,
+    chunk_overlap: int = CHUNK_OVERLAP,
+    workers: int = 1,
+) -> "LocalBackend":
+    """Split documents into passages, embed them and write a local index.
+    Passages identical to ones in the existing index at `path` reuse its vectors,
+    so a rebuild only embeds new or changed text. With `workers` > 1 the new
+    passages are embedded after the scan by a process pool (see parallel_embedding),
+    and an interrupted build resumes the embedding where it stopped."""
+    previous = _PreviousPassages(path, embedder, chunk_words, chunk_overlap)
+    tmp_path = f"{path}.tmp"
+    os.makedirs(tmp_path, exist_ok=True)
+
+    hashes: List[str] = []
+    offsets = [0]
+    vectors: Dict[str, np.ndarray] = {}
+    pending: Dict[str, str] = {}
+    reused = 0
+
+    def embed_pending():
+        texts = list(pending.values())
+        for passage, vector in zip(pending, embedder.embed(texts, kind="passage")):
+            vectors[passage] = vector
+        pending.clear()
+
+    def embed_pending_parallel():
+        embedded = embed_texts(list(pending.values()), embedder, os.path.join(tmp_path, "pending_embeddings"),
+                               workers=workers, batch_size=batch_size)
+        for passage, vector in zip(pending, embedded):
+            vectors[passage] = vector
+        pending.clear()
+
+    with open(os.path.join(tmp_path, "documents.jsonl"), 'w') as f:
+        for doc in documents:
+            f.write(json.dumps({key: value for key, value in doc.items() if key != text_field}))
+            f.write('\n')
+            for passage in document_passages(doc, chunk_words, chunk_overlap):
+                key = passage_hash(passage)
+                hashes.append(key)
+                if key in vectors or key in pending:
+                    continue
+                vector = previous.get(key)
+                if vector is not None:
+                    vectors[key] = vector
+                    reused += 1
+                    continue
+                pending[key] = passage
+                if workers <= 1 and len(pending) >= batch_size:
+                    embed_pending()
+            offsets.append(len(hashes))
+    if pending and workers > 1:
+        embed_pending_parallel()
+    elif pending:
+        embed_pending()
+    print(f"Embedded {len(vectors) - reused} new passages, reused {reused} unchanged")
+
+    matrix = np.stack([vectors[key] for key in hashes]) if hashes else np.zeros((0, embedder.dimension), dtype=np.float32)
+    stored, scales = _quantize(matrix.astype(np.float32), dtype)
+    np.save(os.path.join(tmp_path, "embeddings.npy"), stored)
+    # Only needed to resume an interrupted build
+    shutil.rmtree(os.path.join(tmp_path, "pending_embeddings"), ignore_errors=True)
+    if scales is not None:
+        np.save(os.path.join(tmp_path, "scales.npy"), scales)
+    np.save(os.path.join(tmp_path, "passage_offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    with open(os.path.join(tmp_path, "passage_hashes.json"), 'w') as f:
+        json.dump(hashes, f)
+    with open(os.path.join(tmp_path, "meta.json"), 'w') as f:
+        json.dump({
+            'embedder': embedder.name,
+            'dtype': dtype,
+            'count': len(offsets) - 1,
+            'passages': len(hashes),
+            'chunk_words': chunk_words,
+            'chunk_overlap': chunk_overlap,
+            'built_at': datetime.now(timezone.utc).isoformat(),
+        }, f)
+
+    replace_directory(tmp_path, path)
+    print(f"Saved local index of {len(offsets) - 1} documents and {len(hashes)} passages ({dtype}) to {path}")
+    return LocalBackend(path, embedder=embedder)
+
+class LocalBackend(SearchBackend):
+    """Brute-force nearest-neighbour search over a memory-mapped matrix of passage
+    embeddings. Filters are applied first, so only passages of matching datasets
+    are scored, and each dataset ranks by its best passage. For the few thousand
+    datasets we index this takes milliseconds and needs no ANN structure."""
+
+    def __init__(self, path: str = LOCAL_INDEX_DIR, embedder: Optional[Embedder] = None, query_cache=None):
+        self.path = path
+        self.query_cache = query_cache
+        with open(os.path.join(path, "meta.json"), 'r') as f:
+            self.meta = json.load(f)
+        self.embedder = embedder or load_embedder(self.meta['embedder'])
+        self.embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode='r')
+        scales_path = os.path.join(path, "scales.npy")
+        self.scales = np.load(scales_path) if os.path.exists(scales_path) else None
+        self.passage_offsets = np.load(os.path.join(path, "passage_offsets.npy"))
+        # dataset position of every passage row
+        self.passage_docs = np.repeat(np.arange(len(self.passage_offsets) - 1), np.diff(self.passage_offsets))
+
+        with open(os.path.join(path, "documents.jsonl"), 'r') as f:
+            self.documents = [json.loads(line) for line in f if line.strip()]
+        self.positions = {doc['id']: position for position, doc in enumerate(self.documents)}
+        self.sizes = np.array([int(doc.get('size') or 0) for doc in self.documents], dtype=np.int64)
+
+        # field -> value -> positions of the documents carrying it
+        self.postings: Dict[str, Dict[str, np.ndarray]] = {}
+        for field in FILTER_FIELDS.values():
+            postings: Dict[str, List[int]] = {}
+            for position, doc in enumerate(self.documents):
+                values = doc.get(field)
+                for value in (values if isinstance(values, list) else [values]):
+                    postings.setdefault(value, []).append(position)
+            self.postings[field] = {value: np.array(positions, dtype=np.int64) for value, positions in postings.items()}
+
+    @property
+    def version(self) -> str:
+        return self.meta['built_at']
+
+    @property
+    def embedding_space(self) -> str:
+        return self.embedder.name
+
+    def embed_queries(self, queries):
+        return self.embedder.embed(queries, kind="query")
+
+    def document_vectors(self, ids):
+        vectors = {}
+        for doc_id in ids:
+            position = self.positions.get(doc_id)
+            if position is None:
+                continue
+            start, end = self.passage_offsets[position], self.passage_offsets[position + 1]
+            if end > start:
+                rows = np.asarray(self.embeddings[start:end], dtype=np.float32)
+                if self.scales is not None:
+                    rows = rows * self.scales[start:end, None]
+                vectors[doc_id] = rows.mean(axis=0)
+        return vectors
+
+    def candidates(self, filters: Optional[Dict]) -> Optional[np.ndarray]:
+        """Positions of documents passing the filters, or None if nothing is filtered"""
+        mask = None
+        filters = filters or {}
+        for key, field in FILTER_FIELDS.items():
+            if filters.get(key):
+                field_mask = np.zeros(len(self.documents), dtype=bool)
+                field_mask[self.postings[field].get(filters[key], np.array([], dtype=np.int64))] = True
+                mask = field_mask if mask is None else mask & field_mask
+        if filters.get('min_size') is not None:
+            mask = (self.sizes >= filters['min_size']) if mask is None else mask & (self.sizes >= filters['min_size'])
+        if filters.get('max_size') is not None:
+            mask = (self.sizes <= filters['max_size']) if mask is None else mask & (self.sizes <= filters['max_size'])
+        return None if mask is None else np.flatnonzero(mask)
+
+    def score(self, query_vector: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Similarity of the query to every passage row (or just `rows`)"""
+        embeddings = self.embeddings if rows is None else self.embeddings[rows]
+        scores = np.asarray(embeddings, dtype=np.float32) @ query_vector
+        if self.scales is not None:
+            scores *= self.scales if rows is None else self.scales[rows]
+        return scores
+
+    def snippet(self, position: int, row: int) -> str:
+        """Text of passage `row` of a dataset, re-split from its description"""
+        passages = document_passages(self.documents[position], self.meta['chunk_words'], self.meta['chunk_overlap'])
+        return passage_snippet(passages[row - self.passage_offsets[position]])
+
+    def _hit(self, position: int, score: float, attributes_to_retrieve: Optional[List[str]]) -> Dict:
+        doc = self.documents[position]
+        if attributes_to_retrieve is not None:
+            doc = {key: doc[key] for key in attributes_to_retrieve if key in doc}
+        return {**doc, '_id': self.documents[position]['id'], '_score': float(score)}
+
+    def search(self, query, filters=None, limit=10, offset=0, attributes_to_retrieve=None):
+        positions = self.candidates(filters)
+        if not query or query == "*":
+            # Match-all: no ranking, just the filtered documents in index order
+            if positions is None:
+                positions = np.arange(len(self.documents))
+            selected = positions[offset:offset + limit]
+            return [self._hit(position, 0.0, attributes_to_retrieve) for position in selected]
+
+        rows = None
+        if positions is not None:
+            mask = np.zeros(len(self.documents), dtype=bool)
+            mask[positions] = True
+            rows = np.flatnonzero(mask[self.passage_docs])
+        query_vector = self.query_vector(query)
+        if query_vector is None:
+            query_vector = self.embedder.embed([query], kind="query")[0]
+        scores = self.score(query_vector, rows)
+        if rows is None:
+            rows = np.arange(len(scores))
+
+        # Collapse passages to their dataset's best one
+        order = np.argsort(-scores, kind='stable')
+        _, first = np.unique(self.passage_docs[rows[order]], return_index=True)
+        best = order[first]
+        best = best[np.argsort(-scores[best], kind='stable')][offset:offset + limit]
+
+        hits = []
+        for i in best:
+            position = int(self.passage_docs[rows[i]])
+            hit = self._hit(position, scores[i], attributes_to_retrieve)
+            if self.documents[position].get('description'):
+                hit['_highlights'] = [{'description': self.snippet(position, int(rows[i]))}]
+            hits.append(hit)
+        return hits
+
+    def get_documents(self, ids):
+        return [{**self.documents[self.positions[doc_id]], '_id': doc_id}
+                for doc_id in ids if doc_id in self.positions]
+
+    def get_stats(self):
+        return {'numberOfDocuments': len(self.documents)}
+
+class HybridBackend(SearchBackend):
+    """Fuses a vector backend with BM25 over the lexical index using reciprocal
+    rank fusion, so exact names, task labels and jargon rank well too.
+    Queries that are exactly a dataset id skip ranking altogether."""
+
+    def __init__(self, backend: SearchBackend, lexical: LexicalIndex, depth: int = 50, rrf_k: int = 60):
+        self.backend = backend
+        self.lexical = lexical
+        self.depth = depth
+        self.rrf_k = rrf_k
+
+    @property
+    def version(self) -> str:
+        return f"{self.backend.version}|{self.lexical.version}"
+
+    @property
+    def embedding_space(self) -> str:
+        return self.backend.embedding_space
+
+    def embed_queries(self, queries):
+        return self.backend.embed_queries(queries)
+
+    def search(self, query, filters=None, limit=10, offset=0, attributes_to_retrieve=None):
+        if not query or query == "*":
+            return self.backend.search(query, filters, limit, offset, attributes_to_retrieve)
+
+        dataset_id = self.lexical.lookup_id(query)
+        if dataset_id is not None:
+            hits = [{**doc, '_score': 1.0} for doc in self.backend.get_documents([dataset_id])
+                    if matches_filters(doc, filters)]
+            return _retrieve(hits, attributes_to_retrieve)[offset:offset + limit]
+
+        depth = max(offset + limit, self.depth)
+        vector_hits = self.backend.search(query, filters, limit=depth, attributes_to_retrieve=attributes_to_retrieve)
+        lexical_ids = [doc_id for doc_id, _ in self.lexical.search(query, limit=depth)]
+
+        fused: Dict[str, float] = {}
+        for ranking in ([hit['_id'] for hit in vector_hits], lexical_ids):
+            for rank, doc_id in enumerate(ranking):
+                fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+
+        documents = {hit['_id']: hit for hit in vector_hits}
+        ranked = sorted(fused, key=lambda doc_id: -fused[doc_id])
+        if filters:
+            # Lexical matches haven't been through the backend's filters yet, so all of them are fetched
+            documents.update(self._fetch([doc_id for doc_id in lexical_ids if doc_id not in documents],
+                                         filters, attributes_to_retrieve))
+            ranked = [doc_id for doc_id in ranked if doc_id in documents]
+        else:
+            # Only the lexical matches on the page are fetched
+            page = ranked[offset:offset + limit]
+            documents.update(self._fetch([doc_id for doc_id in page if doc_id not in documents],
+                                         filters, attributes_to_retrieve))
+            ranked = ranked[:offset] + [doc_id for doc_id in page if doc_id in documents]
+        hits = [{**documents[doc_id], '_score': fused[doc_id]} for doc_id in ranked[offset:offset + limit]]
+        return _retrieve(hits, attributes_to_retrieve)
+
+    def _fetch(self, ids, filters, attributes_to_retrieve) -> Dict[str, Dict]:
+        """Documents for lexical matches the vector search didn't return, that pass `filters`.
+        When only ids are wanted and there are no filters to check, nothing is fetched."""
+        if not ids:
+            return {}
+        if not filters and attributes_to_retrieve is not None and set(attributes_to_retrieve) <= {'id'}:
+            return {doc_id: {'_id': doc_id, 'id': doc_id} for doc_id in ids}
+        return {doc['_id']: doc for doc in self.backend.get_documents(ids) if matches_filters(doc, filters)}
+
+    def get_documents(self, ids):
+        return self.backend.get_documents(ids)
+
+    def get_stats(self):
+        return self.backend.get_stats()
+
+class RangeBackend(SearchBackend):
+    """Applies the size, date and subject-count ranges and the `sort` filter locally
+    with a range index over the catalogue (data/ranges.py), rather than as Marqo
+    filter clauses. With a query, the inner backend ranks with the exact-match
+    filters only, fetching deep enough for the share of datasets the ranges keep,
+    and its hits are intersected with the range mask; sorting orders the
+    `sort_depth` most relevant of them, the same ones for every page. Without a
+    query, the listing and its records come from the catalogue alone."""
+
+    def __init__(self, backend: SearchBackend, ranges, facets, sort_depth: int = 100, max_depth: int = 1000):
+        self.backend = backend
+        self.ranges = ranges
+        self.facets = facets
+        # Sorting a query's results orders its `sort_depth` most relevant hits
+        self.sort_depth = sort_depth
+        # Marqo's largest page
+        self.max_depth = max_depth
+
+    @property
+    def version(self) -> str:
+        # Listings come from the catalogue, so cached results are only valid for this one
+        return f"{self.backend.version}|{self.ranges.catalogue.meta.get('built_at')}"
+
+    @property
+    def embedding_space(self) -> str:
+        return self.backend.embedding_space
+
+    def embed_queries(self, queries):
+        return self.backend.embed_queries(queries)
+
+    def search(self, query, filters=None, limit=10, offset=0, attributes_to_retrieve=None):
+        sort = (filters or {}).get('sort')
+        mask = self.ranges.mask(filters)
+        exact_filters = self.ranges.strip(filters)
+        if mask is None and not sort:
+            return self.backend.search(query, exact_filters, limit, offset, attributes_to_retrieve)
+        if not query or query == "*":
+            return self._listing(exact_filters, mask, sort, limit, offset, attributes_to_retrieve)
+
+        # A sorted page is a slice of the same sorted hits whatever the offset, so pages neither overlap nor skip
+        wanted = self.sort_depth if sort else offset + limit
+        # Expect to keep the same share of hits as of the catalogue
+        share = 1.0 if mask is None else max(mask.mean(), 1.0 / self.max_depth)
+        depth = min(int(wanted / share) + 1, self.max_depth)
+        while True:
+            hits = self.backend.search(query, exact_filters, limit=depth, attributes_to_retrieve=attributes_to_retrieve)
+            exhausted = len(hits) < depth
+            positions = self.ranges.positions_of(hit['_id'] for hit in hits)
+            if mask is not None:
+                keep = (positions >= 0) & mask[np.maximum(positions, 0)]
+                hits = [hit for hit, kept in zip(hits, keep) if kept]
+                positions = positions[keep]
+            if len(hits) >= wanted or depth >= self.max_depth or exhausted:
+                break
+            depth = min(depth * 4, self.max_depth)
+        if sort:
+            hits, positions = hits[:self.sort_depth], positions[:self.sort_depth]
+            hits = [hits[i] for i in self.ranges.sort(positions, sort)]
+        return hits[offset:offset + limit]
+
+    def _listing(self, exact_filters, mask, sort, limit, offset, attributes_to_retrieve):
+        selections = {field: exact_filters[key] for key, field in FILTER_FIELDS.items() if exact_filters.get(key)}
+        if selections:
+            selected = np.zeros(self.ranges.total, dtype=bool)
+            selected[self.facets.to_indices(self.facets.match(selections))] = True
+            mask = selected if mask is None else mask & selected
+        if sort:
+            positions = self.ranges.ranked(sort, mask)
+        else:
+            positions = np.flatnonzero(mask)
+        page = positions[offset:offset + limit].tolist()
+        catalogue = self.ranges.catalogue
+        if catalogue.has_records:
+            # The catalogue keeps every indexed record, so the page needs no round trip to the index
+            records = [catalogue.record(position) for position in page]
+            hits = [{**record, '_id': record['id'], '_score': 0.0} for record in records]
+        else:
+            ids = self.ranges.ids(page)
+            documents = {doc['_id']: doc for doc in self.backend.get_documents(ids)}
+            hits = [{**documents[doc_id], '_score': 0.0} for doc_id in ids if doc_id in documents]
+        return _retrieve(hits, attributes_to_retrieve)
+
+    def get_documents(self, ids):
+        return self.backend.get_documents(ids)
+
+    def get_stats(self):
+        return self.backend.get_stats()
+
+def _retrieve(hits: List[Dict], attributes_to_retrieve: Optional[List[str]]) -> List[Dict]:
+    if attributes_to_retrieve is None:
+        return hits
+    keep = set(attributes_to_retrieve) | {'_id', '_score'}
+    return [{key: value for key, value in hit.items() if key in keep} for hit in hits]
@@ -0,0 +1,41 @@
+"""Splitting long descriptions into overlapping passages for embedding."""
+import hashlib
+from typing import Dict, List
+
+# Words per passage and words shared between neighbouring passages. 200 words
+# stays well inside e5-base-v2's 512 token window.
+CHUNK_WORDS = 200
+CHUNK_OVERLAP = 40
+
+def chunk_text(text: str, words: int = CHUNK_WORDS, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    tokens = (text or "").split()
+    if not tokens:
+        return []
+    step = max(words - overlap, 1)
+    starts = range(0, max(len(tokens) - overlap, 1), step)
+    return [" ".join(tokens[start:start + words]) for start in starts]
+
+def passage_header(doc: Dict) -> str:
+    """Short metadata line prefixed to every passage so each one still says which dataset it's from"""
+    parts = [doc.get('name') or ""]
+    for field in ['modalities', 'species', 'tasks']:
+        values = [value for value in doc.get(field) or [] if value and value != "Not specified"]
+        if values:
+            parts.append(", ".join(values))
+    return " | ".join(part for part in parts if part)
+
+def document_passages(doc: Dict, words: int = CHUNK_WORDS, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """The texts to embed for one dataset: its description in overlapping
+    passages, each behind the metadata header; just the header if there's no description"""
+    header = passage_header(doc)
+    chunks = chunk_text(doc.get('description') or "", words, overlap)
+    if not chunks:
+        return [header]
+    return [f"{header}\n{chunk}" for chunk in chunks]
+
+def passage_snippet(passage: str) -> str:
+    """The description part of a passage, without its header"""
+    return passage.split("\n", 1)[-1]
+
+def passage_hash(passage: str) -> str:
+    return hashlib.sha256(passage.encode('utf-8')).hexdigest()
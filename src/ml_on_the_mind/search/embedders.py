@@ -0,0 +1,71 @@
+"""Text encoders for the local search backend."""
+from abc import ABC, abstractmethod
+import hashlib
+import re
+from typing import List
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+class Embedder(ABC):
+    """Turns texts into L2-normalised float32 vectors"""
+    name: str
+    dimension: int
+
+    @abstractmethod
+    def embed(self, texts: List[str], kind: str = "query") -> np.ndarray:
+        """Embed `texts`; `kind` is "query" or "passage" for models that encode them differently"""
+        pass
+
+class HashingEmbedder(Embedder):
+    """Deterministic bag-of-words embedder using the hashing trick.
+    No model download and no randomness, so it's suitable for offline tests and
+    benchmarks; relevance is lexical rather than semantic."""
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+        self.name = f"hashing:{dimension}"
+
+    def _features(self, text: str):
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+            digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), 'little')
+            yield digest % self.dimension, 1.0 if digest >> 63 else -1.0
+
+    def embed(self, texts: List[str], kind: str = "query") -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for column, sign in self._features(text):
+                vectors[row, column] += sign
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+class SentenceTransformerEmbedder(Embedder):
+    """The same e5-base-v2 model Marqo uses, run in-process"""
+
+    def __init__(self, model_name: str = "intfloat/e5-base-v2", batch_size: int = 32):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError("The e5 embedder requires sentence-transformers (pip install sentence-transformers)")
+        self.model = SentenceTransformer(model_name)
+        self.batch_size = batch_size
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self.name = f"sentence-transformers:{model_name}"
+
+    def embed(self, texts: List[str], kind: str = "query") -> np.ndarray:
+        # e5 models expect a "query: " / "passage: " prefix
+        prefixed = [f"{kind}: {text}" for text in texts]
+        vectors = self.model.encode(prefixed, batch_size=self.batch_size, normalize_embeddings=True)
+        return np.asarray(vectors, dtype=np.float32)
+
+def load_embedder(name: str) -> Embedder:
+    """Recreate an embedder from its `name`, e.g. "hashing:384" or "e5" """
+    if name.startswith("hashing"):
+        _, _, dimension = name.partition(":")
+        return HashingEmbedder(int(dimension or 384))
+    if name == "e5":
+        return SentenceTransformerEmbedder()
+    if name.startswith("sentence-transformers:"):
+        return SentenceTransformerEmbedder(name.split(":", 1)[1])
+    raise ValueError(f"Unknown embedder {name!r}")
@@ -0,0 +1,60 @@
+"""Filter options read from search hits, for when there is no catalogue to count facets from."""
+from typing import Dict, List
+
+# Without a lexical index, the query's top hits that facet counts are taken over; a vector search
+# ranks everything, so its "match set" is cut off here (Marqo's largest page)
+FACET_QUERY_DEPTH = 1000
+
+def get_unique_field_values(backend, field, limit=1000):
+    hits = backend.search("*", limit=limit, attributes_to_retrieve=[field])
+
+    values = set()
+    for hit in hits:
+        field_value = hit.get(field, [])
+
+        if isinstance(field_value, list):
+            for value in field_value:
+                if value and value != "Not specified":
+                    values.add(value)
+        elif field_value and field_value != "Not specified":
+            values.add(field_value)
+
+    return sorted(list(values))
+
+def get_all_filter_options(backend) -> Dict[str, List[str]]:
+    return {
+        'modalities': get_unique_field_values(backend, "modalities"),
+        'species': get_unique_field_values(backend, "species"),
+        'tasks': get_unique_field_values(backend, "tasks")
+    }
+
+def get_filter_options_from_results(results):
+    modalities = set()
+    species = set()
+    tasks = set()
+
+    for result in results:
+        if isinstance(result.get('modalities'), list):
+            for m in result['modalities']:
+                if m and m != "Not specified":
+                    modalities.add(m)
+
+        # Handle species as either a string or a list
+        if result.get('species'):
+            if isinstance(result.get('species'), list):
+                for s in result['species']:
+                    if s and s != "Not specified":
+                        species.add(s)
+            elif result['species'] != "Not specified":
+                species.add(result['species'])
+
+        if isinstance(result.get('tasks'), list):
+            for t in result['tasks']:
+                if t and t != "Not specified":
+                    tasks.add(t)
+
+    return {
+        'modalities': sorted(list(modalities)),
+        'species': sorted(list(species)),
+        'tasks': sorted(list(tasks))
+    }
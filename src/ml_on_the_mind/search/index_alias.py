@@ -0,0 +1,50 @@
+"""Pointer from the public index name to the versioned index that currently serves it.
+
+The pointer is a single document in a tiny Marqo index, so the indexer and the app
+(which usually run on different machines) read the same record, and switching
+indexes is one document upsert.
+"""
+import re
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+BASE_INDEX_NAME = "neuroscience_datasets"
+ALIAS_INDEX_NAME = f"{BASE_INDEX_NAME}_alias"
+ALIAS_DOC_ID = "active"
+
+def versioned_index_name(base: str = BASE_INDEX_NAME, now: Optional[datetime] = None) -> str:
+    """e.g. neuroscience_datasets_20250101120000"""
+    now = now or datetime.now(timezone.utc)
+    return f"{base}_{now.strftime('%Y%m%d%H%M%S')}"
+
+def list_versioned_indexes(mq, base: str = BASE_INDEX_NAME) -> List[str]:
+    """Versioned indexes for `base`, oldest first"""
+    pattern = re.compile(rf"^{re.escape(base)}_\d{{14}}$")
+    names = [index['indexName'] for index in mq.get_indexes().get('results', [])]
+    return sorted(name for name in names if pattern.match(name))
+
+def get_alias(mq) -> Optional[Dict]:
+    """The alias record, or None if no versioned index has been activated yet"""
+    try:
+        return mq.index(ALIAS_INDEX_NAME).get_document(ALIAS_DOC_ID)
+    except Exception:
+        return None
+
+def resolve_index(mq, default: str = BASE_INDEX_NAME) -> str:
+    """Name of the index queries should go to"""
+    alias = get_alias(mq)
+    if alias and alias.get('index_name'):
+        return alias['index_name']
+    return default
+
+def set_alias(mq, index_name: str, previous_index: Optional[str] = None):
+    """Atomically point the alias at `index_name`, remembering the previous index for rollback"""
+    existing = {index['indexName'] for index in mq.get_indexes().get('results', [])}
+    if ALIAS_INDEX_NAME not in existing:
+        mq.create_index(ALIAS_INDEX_NAME)
+    mq.index(ALIAS_INDEX_NAME).add_documents([{
+        '_id': ALIAS_DOC_ID,
+        'index_name': index_name,
+        'previous_index': previous_index or "",
+        'updated_at': datetime.now(timezone.utc).isoformat(),
+    }], tensor_fields=[])
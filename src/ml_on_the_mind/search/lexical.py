@@ -0,0 +1,180 @@
+"""BM25 inverted index over dataset names, descriptions, tasks and authors.
+
+Built at index time next to the catalogue and stored as flat NumPy postings:
+    meta.json                   total, average document length, BM25 parameters, dataset ids, alias -> id
+    vocabulary.json             terms, in the order of their postings
+    postings_offsets.npy        int64, postings of term t are [offsets[t], offsets[t + 1])
+    postings_docs.npy           int32 document number per posting
+    postings_tf.npy             uint16 term frequency per posting
+    doc_lengths.npy             int32 tokens per document
+"""
+import json
+import os
+import re
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from .storage import replace_directory
+
+LEXICAL_INDEX_DIR = os.path.join("cache", "lexical_index")
+LEXICAL_FIELDS = ["name", "description", "tasks", "authors"]
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+def _field_text(value) -> str:
+    if isinstance(value, list):
+        return " ".join(str(item) for item in value if item)
+    return str(value) if value else ""
+
+def id_keys(dataset_id: str) -> List[str]:
+    """Spellings of an id a user might type: the id itself and, for versioned
+    DANDI ids ("000123/0.230101.1234"), the bare dandiset id"""
+    key = dataset_id.lower()
+    keys = [key]
+    if "/" in key:
+        keys.append(key.split("/", 1)[0])
+    return keys
+
+class LexicalIndexBuilder:
+    def __init__(self):
+        self.ids: List[str] = []
+        self.terms: Dict[str, int] = {}
+        self.postings: List[List[Tuple[int, int]]] = []
+        self.lengths: List[int] = []
+        self.aliases: Dict[str, str] = {}
+
+    def add(self, dataset: Dict):
+        doc = len(self.ids)
+        self.ids.append(str(dataset['id']))
+        for alias in dataset.get('aliases') or []:
+            self.aliases[alias] = str(dataset['id'])
+        tokens = tokenize(" ".join(_field_text(dataset.get(field)) for field in LEXICAL_FIELDS))
+        self.lengths.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            if term not in self.terms:
+                self.terms[term] = len(self.terms)
+                self.postings.append([])
+            self.postings[self.terms[term]].append((doc, min(tf, 65535)))
+
+    def track(self, datasets: Iterable[Dict]) -> Iterator[Dict]:
+        """Pass datasets through while adding them to the index"""
+        for dataset in datasets:
+            self.add(dataset)
+            yield dataset
+
+    def save(self, path: str = LEXICAL_INDEX_DIR, k1: float = 1.2, b: float = 0.75) -> "LexicalIndex":
+        tmp_path = f"{path}.tmp"
+        os.makedirs(tmp_path, exist_ok=True)
+        offsets = np.zeros(len(self.postings) + 1, dtype=np.int64)
+        np.cumsum([len(postings) for postings in self.postings], out=offsets[1:])
+        flat = [posting for postings in self.postings for posting in postings]
+        np.save(os.path.join(tmp_path, "postings_offsets.npy"), offsets)
+        np.save(os.path.join(tmp_path, "postings_docs.npy"), np.array([doc for doc, _ in flat], dtype=np.int32))
+        np.save(os.path.join(tmp_path, "postings_tf.npy"), np.array([tf for _, tf in flat], dtype=np.uint16))
+        np.save(os.path.join(tmp_path, "doc_lengths.npy"), np.array(self.lengths, dtype=np.int32))
+        with open(os.path.join(tmp_path, "vocabulary.json"), 'w') as f:
+            json.dump(list(self.terms), f)
+        with open(os.path.join(tmp_path, "meta.json"), 'w') as f:
+            json.dump({
+                'total': len(self.ids),
+                'average_length': float(np.mean(self.lengths)) if self.lengths else 0.0,
+                'k1': k1,
+                'b': b,
+                'built_at': datetime.now(timezone.utc).isoformat(),
+                'ids': self.ids,
+                'aliases': self.aliases,
+            }, f)
+
+        replace_directory(tmp_path, path)
+        print(f"Saved lexical index of {len(self.ids)} datasets and {len(self.terms)} terms to {path}")
+        return LexicalIndex(path)
+
+class LexicalIndex:
+    def __init__(self, path: str = LEXICAL_INDEX_DIR):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), 'r') as f:
+            self.meta = json.load(f)
+        with open(os.path.join(path, "vocabulary.json"), 'r') as f:
+            self.terms = {term: code for code, term in enumerate(json.load(f))}
+        self.ids: List[str] = self.meta['ids']
+        self.total = self.meta['total']
+        self.offsets = np.load(os.path.join(path, "postings_offsets.npy"), mmap_mode='r')
+        self.docs = np.load(os.path.join(path, "postings_docs.npy"), mmap_mode='r')
+        self.tf = np.load(os.path.join(path, "postings_tf.npy"), mmap_mode='r')
+        lengths = np.load(os.path.join(path, "doc_lengths.npy")).astype(np.float32)
+        k1, b = self.meta['k1'], self.meta['b']
+        average_length = self.meta['average_length'] or 1.0
+        # Per-document part of the BM25 denominator, computed once
+        self.length_norm = k1 * (1 - b + b * lengths / average_length)
+        self.k1 = k1
+
+        self.id_lookup: Dict[str, str] = {}
+        for dataset_id in self.ids:
+            for key in id_keys(dataset_id):
+                self.id_lookup.setdefault(key, dataset_id)
+        # Ids folded into another record by dedup resolve to that record
+        for alias, dataset_id in self.meta.get('aliases', {}).items():
+            for key in id_keys(alias):
+                self.id_lookup.setdefault(key, dataset_id)
+
+    @classmethod
+    def load(cls, path: str = LEXICAL_INDEX_DIR) -> Optional["LexicalIndex"]:
+        """The index at `path`, or None if it hasn't been built"""
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return None
+        return cls(path)
+
+    @property
+    def version(self) -> str:
+        return self.meta['built_at']
+
+    def lookup_id(self, query: str) -> Optional[str]:
+        """The dataset id `query` names exactly, if any"""
+        key = query.strip().lower()
+        if key.startswith("dandi:"):
+            key = key[len("dandi:"):]
+        return self.id_lookup.get(key)
+
+    def matches(self, query: str) -> Optional[List[str]]:
+        """Ids of the datasets containing every query term the index knows, or any of them
+        if no dataset has them all; the query's match set for facet counts, read from the
+        postings alone. An exact id matches just that dataset. None if the index knows
+        none of the query's terms."""
+        dataset_id = self.lookup_id(query)
+        if dataset_id is not None:
+            return [dataset_id]
+        postings = []
+        for term in set(tokenize(query)):
+            code = self.terms.get(term)
+            if code is not None:
+                postings.append(np.asarray(self.docs[self.offsets[code]:self.offsets[code + 1]]))
+        if not postings:
+            return None
+        postings.sort(key=len)
+        docs = postings[0]
+        for other in postings[1:]:
+            docs = np.intersect1d(docs, other, assume_unique=True)
+        if not len(docs):
+            docs = np.unique(np.concatenate(postings))
+        return [self.ids[doc] for doc in docs]
+
+    def search(self, query: str, limit: int = 100) -> List[Tuple[str, float]]:
+        """Top (id, score) pairs for `query` by BM25"""
+        scores = np.zeros(self.total, dtype=np.float32)
+        for term in set(tokenize(query)):
+            code = self.terms.get(term)
+            if code is None:
+                continue
+            start, end = self.offsets[code], self.offsets[code + 1]
+            docs = np.asarray(self.docs[start:end])
+            tf = np.asarray(self.tf[start:end], dtype=np.float32)
+            idf = np.log(1 + (self.total - len(docs) + 0.5) / (len(docs) + 0.5))
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + self.length_norm[docs])
+        matched = np.flatnonzero(scores)
+        if len(matched) > limit:
+            matched = matched[np.argpartition(-scores[matched], limit - 1)[:limit]]
+        matched = matched[np.argsort(-scores[matched], kind='stable')]
+        return [(self.ids[doc], float(scores[doc])) for doc in matched]
@@ -0,0 +1,13 @@
+"""Connection pooling for the Marqo client, shared by the index builds and the search service."""
+from requests.adapters import HTTPAdapter
+
+def size_connection_pool(workers: int):
+    """Make the shared Marqo session keep one pooled connection per worker"""
+    try:
+        # Every marqo.Client talks through this one module-level requests.Session
+        from marqo._httprequests import session
+    except ImportError:
+        return
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(workers, 10))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
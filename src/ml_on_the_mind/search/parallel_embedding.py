@@ -0,0 +1,122 @@
+"""Offline embedding of many texts across a process pool, for full local index rebuilds.
+
+The texts are split into contiguous shards. Each worker process loads the encoder
+once, orders its shard by text length so each batch holds similar-length texts
+(less padding for transformer encoders), and writes vectors straight into a
+memory-mapped .npy file, so they are never pickled back through the parent.
+After every batch a worker records how many of its shard's batches are on disk;
+running again with the same texts and encoder skips whatever is already done.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from typing import Dict, List, Optional
+import numpy as np
+from tqdm import tqdm
+from .embedders import Embedder, load_embedder
+
+SHARD_SIZE = 1024
+
+# The worker process's encoder, loaded once by _init_worker
+_embedder: Optional[Embedder] = None
+
+def _init_worker(embedder_name: str):
+    global _embedder
+    _embedder = load_embedder(embedder_name)
+
+def length_batches(texts: List[str], batch_size: int) -> List[np.ndarray]:
+    """Positions of `texts` in batches of similar length, shortest first"""
+    order = np.argsort([len(text) for text in texts], kind='stable')
+    return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+def _fingerprint(texts: List[str]) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for text in texts:
+        digest.update(text.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def _write_json(path: str, value: Dict):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+def _read_json(path: str) -> Optional[Dict]:
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _progress_path(work_dir: str, shard: int) -> str:
+    return os.path.join(work_dir, f"shard_{shard:05d}.json")
+
+def _batches_done(work_dir: str, shard: int) -> int:
+    progress = _read_json(_progress_path(work_dir, shard))
+    return progress['batches_done'] if progress else 0
+
+def _embed_shard(work_dir: str, shard: int, start: int, texts: List[str], batch_size: int, kind: str) -> int:
+    """Embed one shard in a worker, resuming after its last completed batch; returns the rows embedded"""
+    output = np.load(os.path.join(work_dir, "embeddings.npy"), mmap_mode='r+')
+    batches = length_batches(texts, batch_size)
+    embedded = 0
+    for number in range(_batches_done(work_dir, shard), len(batches)):
+        batch = batches[number]
+        output[start + batch] = _embedder.embed([texts[i] for i in batch], kind=kind)
+        # The vectors must be on disk before the progress record that vouches for them
+        output.flush()
+        _write_json(_progress_path(work_dir, shard), {'batches_done': number + 1})
+        embedded += len(batch)
+    return embedded
+
+def embed_texts(
+    texts: List[str],
+    embedder: Embedder,
+    work_dir: str,
+    workers: int = os.cpu_count() or 1,
+    batch_size: int = 64,
+    shard_size: int = SHARD_SIZE,
+    kind: str = "passage",
+) -> np.ndarray:
+    """Embed `texts` into `work_dir`/embeddings.npy with a pool of `workers` processes
+    and return it memory-mapped read-only, row i being the vector of texts[i].
+    An interrupted run is resumed if called again with the same texts and encoder."""
+    os.makedirs(work_dir, exist_ok=True)
+    output_path = os.path.join(work_dir, "embeddings.npy")
+    meta_path = os.path.join(work_dir, "meta.json")
+    meta = {
+        'embedder': embedder.name,
+        'dimension': embedder.dimension,
+        'count': len(texts),
+        'shard_size': shard_size,
+        'batch_size': batch_size,
+        'kind': kind,
+        'fingerprint': _fingerprint(texts),
+    }
+    shards = [(shard, start, texts[start:start + shard_size])
+              for shard, start in enumerate(range(0, len(texts), shard_size))]
+    if _read_json(meta_path) != meta or not os.path.exists(output_path):
+        # Different texts or settings: progress recorded for them doesn't apply
+        for shard, _, _ in shards:
+            if os.path.exists(_progress_path(work_dir, shard)):
+                os.remove(_progress_path(work_dir, shard))
+        np.lib.format.open_memmap(output_path, mode='w+', dtype=np.float32,
+                                  shape=(len(texts), embedder.dimension)).flush()
+        _write_json(meta_path, meta)
+
+    todo = [(shard, start, shard_texts) for shard, start, shard_texts in shards
+            if _batches_done(work_dir, shard) < -(-len(shard_texts) // batch_size)]
+    if len(todo) < len(shards):
+        print(f"Resuming: {len(shards) - len(todo)} of {len(shards)} shards already embedded")
+    if todo:
+        # spawn rather than fork: encoders (torch) don't survive being forked after use
+        with ProcessPoolExecutor(max_workers=min(workers, len(todo)), mp_context=get_context("spawn"),
+                                 initializer=_init_worker, initargs=(embedder.name,)) as pool:
+            futures = [pool.submit(_embed_shard, work_dir, shard, start, shard_texts, batch_size, kind)
+                       for shard, start, shard_texts in todo]
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Embedding shards", unit="shard"):
+                future.result()
+    return np.load(output_path, mmap_mode='r')
@@ -0,0 +1,148 @@
+"""Cache of query embeddings, persisted across restarts and warmed up from popular queries.
+
+Embedding the query is the dominant per-search cost, and a handful of queries
+make up most traffic, so vectors are kept by normalized query text and reused:
+the local backend skips the encoder, and Marqo searches by vector via `context`.
+"""
+import json
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Iterable, List, Optional
+import numpy as np
+from .result_cache import normalize_query
+
+QUERY_CACHE_PATH = os.path.join("cache", "query_embeddings.npz")
+QUERY_LOG_PATH = os.path.join("cache", "query_log.jsonl")
+TOP_QUERIES_PATH = os.path.join(os.path.dirname(__file__), "top_queries.txt")
+
+class QueryEmbeddingCache:
+    """Thread-safe LRU of query text -> embedding. Entries belong to an embedding
+    space (model or index) and are dropped when it changes."""
+
+    def __init__(self, path: Optional[str] = QUERY_CACHE_PATH, max_size: int = 4096, save_every: int = 32):
+        self.path = path
+        self.max_size = max_size
+        self.save_every = save_every
+        self.space = None
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        if path:
+            self.load()
+
+    def set_space(self, space: str):
+        with self._lock:
+            if space != self.space:
+                self._entries.clear()
+                self.space = space
+
+    def get(self, query: str) -> Optional[np.ndarray]:
+        key = normalize_query(query)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, query: str, vector: np.ndarray):
+        with self._lock:
+            self._entries[normalize_query(query)] = np.asarray(vector, dtype=np.float32)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._unsaved += 1
+            save = self.path and self._unsaved >= self.save_every
+        if save:
+            self.save()
+
+    def missing(self, queries: Iterable[str]) -> List[str]:
+        """Normalized queries that aren't cached yet"""
+        with self._lock:
+            return list(dict.fromkeys(key for key in map(normalize_query, queries) if key and key not in self._entries))
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path) as data:
+                space = str(data['space'])
+                keys = data['keys'].tolist()
+                vectors = data['vectors']
+        except Exception as e:
+            print(f"Could not read query embedding cache {self.path}: {str(e)}")
+            return
+        with self._lock:
+            self.space = space
+            self._entries = OrderedDict(zip(keys, vectors.astype(np.float32)))
+        print(f"Loaded {len(keys)} cached query embeddings from {self.path}")
+
+    def save(self):
+        with self._lock:
+            if not self.path or self.space is None:
+                return
+            keys = list(self._entries)
+            vectors = np.stack(list(self._entries.values())) if keys else np.zeros((0, 0), dtype=np.float32)
+            space = self.space
+            self._unsaved = 0
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp.npz"
+        np.savez(tmp_path, space=np.array(space), keys=np.array(keys, dtype=str), vectors=vectors)
+        os.replace(tmp_path, self.path)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class QueryLog:
+    """Append-only log of searched queries, used to pick warm-up queries"""
+
+    def __init__(self, path: str = QUERY_LOG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, query: str):
+        query = normalize_query(query)
+        if not query or query == "*":
+            return
+        line = json.dumps({'query': query, 'time': time.time()})
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+
+    def top_queries(self, limit: int = 100) -> List[str]:
+        if not os.path.exists(self.path):
+            return []
+        counts = Counter()
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    counts[json.loads(line)['query']] += 1
+                except (ValueError, KeyError):
+                    continue
+        return [query for query, _ in counts.most_common(limit)]
+
+def load_top_queries(path: str = TOP_QUERIES_PATH) -> List[str]:
+    """Configured warm-up queries, one per line; blank lines and # comments are skipped"""
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+def warm_up(backend, cache: QueryEmbeddingCache, queries: Iterable[str], batch_size: int = 32) -> int:
+    """Embed the queries the cache doesn't have yet; returns how many were added"""
+    cache.set_space(backend.embedding_space)
+    missing = cache.missing(queries)
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start:start + batch_size]
+        for query, vector in zip(batch, backend.embed_queries(batch)):
+            cache.put(query, vector)
+    if missing:
+        cache.save()
+        print(f"Warmed up {len(missing)} query embeddings")
+    return len(missing)
@@ -0,0 +1,179 @@
+"""Related datasets: a k-nearest-neighbour graph over document embeddings.
+
+build_vector_db builds it with the index, so a result card's related datasets
+are one row lookup rather than a vector search at query time:
+    meta.json        count, k, embedding space and build time
+    ids.json         dataset id of each row
+    hashes.json      content hash of each row's document when its vector was taken
+    vectors.npy      float16 (count, dim), unit-length document vectors
+    neighbours.npy   int32 (count, k), rows of the most similar documents, best first; -1 pads
+    scores.npy       float16 (count, k), their cosine similarities
+
+A rebuild reuses the vectors of documents whose content is unchanged and only
+recomputes what changed documents touch: their own rows, the rows that listed a
+changed or removed document, and rows where a changed document now outranks a
+neighbour. A full build is a blocked matrix product over all documents.
+"""
+import json
+import os
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+from .storage import replace_directory
+
+RELATED_DIR = os.path.join("cache", "related")
+NEIGHBOURS = 10
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+def _top_k(vectors: np.ndarray, rows: np.ndarray, k: int, block_size: int = 1024) -> Tuple[np.ndarray, np.ndarray]:
+    """Each row's k most similar other rows, best first, with -1 / -inf padding"""
+    neighbours = np.full((len(rows), k), -1, dtype=np.int32)
+    scores = np.full((len(rows), k), -np.inf, dtype=np.float32)
+    width = min(k, len(vectors) - 1)
+    if width <= 0:
+        return neighbours, scores
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        similarities = vectors[block] @ vectors.T
+        similarities[np.arange(len(block)), block] = -np.inf
+        best = np.argpartition(-similarities, width - 1, axis=1)[:, :width]
+        best_scores = np.take_along_axis(similarities, best, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        neighbours[start:start + len(block), :width] = np.take_along_axis(best, order, axis=1)
+        scores[start:start + len(block), :width] = np.take_along_axis(best_scores, order, axis=1)
+    return neighbours, scores
+
+def _merge(neighbours: np.ndarray, scores: np.ndarray, candidates: np.ndarray, candidate_scores: np.ndarray, k: int):
+    """Keep the k best of each row's current neighbours and new candidates"""
+    merged = np.concatenate([neighbours, candidates], axis=1)
+    merged_scores = np.concatenate([scores, candidate_scores], axis=1)
+    order = np.argsort(-merged_scores, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(merged, order, axis=1), np.take_along_axis(merged_scores, order, axis=1)
+
+class RelatedGraph:
+    def __init__(self, ids: List[str], hashes: List[str], vectors: np.ndarray, neighbours: np.ndarray,
+                 scores: np.ndarray, meta: Dict):
+        self.ids = ids
+        self.hashes = hashes
+        self.vectors = vectors
+        self.neighbours = neighbours
+        self.scores = scores
+        self.meta = meta
+        self._rows = None
+
+    @classmethod
+    def load(cls, path: str = RELATED_DIR) -> Optional["RelatedGraph"]:
+        """The saved graph, memory-mapped; None if it hasn't been built"""
+        try:
+            with open(os.path.join(path, "meta.json"), 'r') as f:
+                meta = json.load(f)
+            with open(os.path.join(path, "ids.json"), 'r') as f:
+                ids = json.load(f)
+            with open(os.path.join(path, "hashes.json"), 'r') as f:
+                hashes = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return cls(ids, hashes, np.load(os.path.join(path, "vectors.npy"), mmap_mode='r'),
+                   np.load(os.path.join(path, "neighbours.npy"), mmap_mode='r'),
+                   np.load(os.path.join(path, "scores.npy"), mmap_mode='r'), meta)
+
+    def save(self, path: str = RELATED_DIR):
+        tmp_path = f"{path}.tmp"
+        os.makedirs(tmp_path, exist_ok=True)
+        with open(os.path.join(tmp_path, "ids.json"), 'w') as f:
+            json.dump(self.ids, f)
+        with open(os.path.join(tmp_path, "hashes.json"), 'w') as f:
+            json.dump(self.hashes, f)
+        np.save(os.path.join(tmp_path, "vectors.npy"), np.asarray(self.vectors, dtype=np.float16))
+        np.save(os.path.join(tmp_path, "neighbours.npy"), np.asarray(self.neighbours, dtype=np.int32))
+        np.save(os.path.join(tmp_path, "scores.npy"), np.asarray(self.scores, dtype=np.float16))
+        with open(os.path.join(tmp_path, "meta.json"), 'w') as f:
+            json.dump(self.meta, f)
+        replace_directory(tmp_path, path)
+        print(f"Saved related-datasets graph of {len(self.ids)} datasets to {path}")
+
+    @property
+    def k(self) -> int:
+        return self.meta['k']
+
+    def row(self, dataset_id: str) -> Optional[int]:
+        if self._rows is None:
+            self._rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        return self._rows.get(dataset_id)
+
+    def related(self, dataset_id: str, limit: int = 5) -> List[Tuple[str, float]]:
+        """(id, similarity) of the datasets most like `dataset_id`, most similar first"""
+        row = self.row(dataset_id)
+        if row is None:
+            return []
+        return [(self.ids[neighbour], float(score))
+                for neighbour, score in zip(self.neighbours[row][:limit].tolist(), self.scores[row][:limit].tolist())
+                if neighbour >= 0]
+
+    @classmethod
+    def build(
+        cls,
+        ids: List[str],
+        hashes: List[str],
+        document_vectors: Callable[[List[str]], Dict[str, np.ndarray]],
+        space: str,
+        previous: Optional["RelatedGraph"] = None,
+        k: int = NEIGHBOURS,
+    ) -> "RelatedGraph":
+        """Graph over `ids`, whose documents have content `hashes`. `document_vectors`
+        is only asked for documents that are new or changed since `previous`, if it
+        was built in the same embedding `space`; documents it has no vector for are left out."""
+        reusable = previous is not None and previous.meta.get('space') == space and previous.k == k
+        previous_rows = {}
+        if reusable:
+            for doc_id, content in zip(ids, hashes):
+                row = previous.row(doc_id)
+                if row is not None and previous.hashes[row] == content:
+                    previous_rows[doc_id] = row
+        fetched = document_vectors([doc_id for doc_id in ids if doc_id not in previous_rows])
+
+        kept = [(doc_id, content) for doc_id, content in zip(ids, hashes) if doc_id in previous_rows or doc_id in fetched]
+        graph_ids = [doc_id for doc_id, _ in kept]
+        if fetched:
+            dimension = len(next(iter(fetched.values())))
+        else:
+            dimension = previous.vectors.shape[1] if reusable else 0
+        vectors = np.zeros((len(graph_ids), dimension), dtype=np.float32)
+        clean = np.array([position for position, doc_id in enumerate(graph_ids) if doc_id in previous_rows], dtype=np.int64)
+        dirty = np.array([position for position, doc_id in enumerate(graph_ids) if doc_id not in previous_rows], dtype=np.int64)
+        if len(clean):
+            vectors[clean] = previous.vectors[[previous_rows[graph_ids[position]] for position in clean]]
+        if len(dirty):
+            vectors[dirty] = _normalize(np.stack([np.asarray(fetched[graph_ids[position]], dtype=np.float32)
+                                                  for position in dirty]))
+
+        if not reusable or len(dirty) > len(graph_ids) // 2:
+            neighbours, scores = _top_k(vectors, np.arange(len(graph_ids)), k)
+        else:
+            neighbours = np.full((len(graph_ids), k), -1, dtype=np.int32)
+            scores = np.full((len(graph_ids), k), -np.inf, dtype=np.float32)
+            old_rows = np.array([previous_rows[graph_ids[position]] for position in clean], dtype=np.int64)
+            old_to_new = np.full(len(previous.ids), -1, dtype=np.int64)
+            old_to_new[old_rows] = clean
+            old_neighbours = np.asarray(previous.neighbours[old_rows], dtype=np.int64)
+            remapped = np.where(old_neighbours >= 0, old_to_new[np.maximum(old_neighbours, 0)], -1)
+            neighbours[clean] = remapped
+            scores[clean] = np.where(remapped >= 0, np.asarray(previous.scores[old_rows], dtype=np.float32), -np.inf)
+            # Rows that listed a changed or removed document lost a neighbour they can't get back by merging
+            lost = ((old_neighbours >= 0) & (remapped < 0)).any(axis=1)
+            recompute = np.concatenate([dirty, clean[lost]])
+            merge = clean[~lost]
+            if len(dirty):
+                for start in range(0, len(merge), 1024):
+                    block = merge[start:start + 1024]
+                    candidates = np.broadcast_to(dirty.astype(np.int32), (len(block), len(dirty)))
+                    neighbours[block], scores[block] = _merge(
+                        neighbours[block], scores[block], candidates, vectors[block] @ vectors[dirty].T, k)
+            neighbours[recompute], scores[recompute] = _top_k(vectors, recompute, k)
+            print(f"Related datasets: {len(dirty)} new or changed, {len(recompute)} rows recomputed, "
+                  f"{len(merge)} merged")
+        scores[neighbours < 0] = 0.0
+        meta = {'count': len(graph_ids), 'k': k, 'space': space, 'built_at': datetime.now(timezone.utc).isoformat()}
+        return cls(graph_ids, [content for _, content in kept], vectors, neighbours, scores, meta)
@@ -0,0 +1,56 @@
+"""Process-wide cache of search results, shared by every Streamlit session."""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+def normalize_query(query: str) -> str:
+    """Collapse case and whitespace so equivalent queries share a cache entry.
+    e5-base-v2 is uncased, so this doesn't change what gets embedded."""
+    return " ".join((query or "").lower().split())
+
+class ResultCache:
+    """Thread-safe LRU cache whose entries expire after `ttl` seconds.
+    Entries are tied to an index version and dropped when it changes."""
+
+    def __init__(self, max_size: int = 512, ttl: float = 300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set_version(self, version: Hashable):
+        """Invalidate everything if the index being queried has changed"""
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
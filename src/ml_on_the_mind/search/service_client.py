@@ -0,0 +1,81 @@
+"""Client for the search service (search_service.py), so the app can run without its own backend."""
+from typing import Dict, List, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .backends import SearchBackend
+
+class ServiceBackend(SearchBackend):
+    """Searches through the search service over one pooled HTTP session. The
+    service owns the Marqo client, query cache and result cache; `page` fetches
+    everything a page needs in one round trip."""
+
+    def __init__(self, url: str, timeout: float = 30):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self._version: Optional[str] = None
+        self.session = requests.Session()
+        # The service answers 503 with Retry-After when it is shedding load
+        retry = Retry(total=3, status_forcelist=[503], allowed_methods=None, backoff_factor=0.2,
+                      respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_maxsize=16, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _request(self, method: str, path: str, body: Optional[Dict] = None) -> Dict:
+        response = self.session.request(method, f"{self.url}{path}", json=body, timeout=self.timeout)
+        response.raise_for_status()
+        result = response.json()
+        # Every response carries the index version, so cache invalidation needs no extra request
+        self._version = result.get('version', self._version)
+        return result
+
+    @property
+    def version(self) -> str:
+        if self._version is None:
+            self.get_stats()
+        return self._version
+
+    def search(self, query, filters=None, limit=10, offset=0, attributes_to_retrieve=None, log=False):
+        return self._request("POST", "/search", {
+            'query': query,
+            'filters': filters,
+            'limit': limit,
+            'offset': offset,
+            'attributes_to_retrieve': attributes_to_retrieve,
+            'log': log,
+        })['hits']
+
+    def get_documents(self, ids):
+        if not ids:
+            return []
+        return self._request("POST", "/documents", {'ids': list(ids)})['documents']
+
+    def get_stats(self):
+        return self._request("GET", "/stats")['stats']
+
+    def facets(self, query: str, filters: Optional[Dict] = None, limit: int = 10) -> Dict[str, Dict[str, Optional[int]]]:
+        """Per-value counts for every facet (None where only the values are known)"""
+        return self._request("POST", "/facets", {'query': query, 'filters': filters, 'limit': limit})['facets']
+
+    def page(
+        self,
+        query: str,
+        filters: Optional[Dict] = None,
+        limit: int = 10,
+        offset: int = 0,
+        attributes_to_retrieve: Optional[List[str]] = None,
+        search: bool = True,
+        log: bool = False,
+    ) -> Dict:
+        """{'stats', 'facets', 'hits'} for one page, fetched concurrently by the service.
+        'hits' is None unless `search`."""
+        return self._request("POST", "/page", {
+            'query': query,
+            'filters': filters,
+            'limit': limit,
+            'offset': offset,
+            'attributes_to_retrieve': attributes_to_retrieve,
+            'search': search,
+            'log': log,
+        })
@@ -0,0 +1,52 @@
+"""On-disk helpers shared by the search indexes and the catalogue."""
+import json
+import os
+import re
+import shutil
+import time
+from typing import Optional
+
+def _versions(path: str):
+    """Version directories `<path>.<n>` next to `path`"""
+    parent, name = os.path.split(os.path.abspath(path))
+    pattern = re.compile(re.escape(name) + r"\.\d+$")
+    return [os.path.join(parent, entry) for entry in os.listdir(parent) if pattern.match(entry)]
+
+def built_at(path: str) -> Optional[str]:
+    """When the index or catalogue saved at `path` was built, from its meta.json;
+    None if it hasn't been built. Readers compare it to notice a rebuild."""
+    try:
+        with open(os.path.join(path, "meta.json"), 'r') as f:
+            return json.load(f).get('built_at')
+    except (OSError, ValueError):
+        return None
+
+def replace_directory(tmp_path: str, path: str):
+    """Swap a fully written directory in at once so readers never see a half-written index.
+
+    `path` is a symlink to the current version, `<path>.<n>`, and is replaced with a
+    single rename, so it always exists. Older versions, and anything left behind by
+    an interrupted swap, are removed afterwards."""
+    version_path = f"{path}.{time.time_ns()}"
+    os.replace(tmp_path, version_path)
+    link_path = f"{path}.link"
+    if os.path.lexists(link_path):
+        os.remove(link_path)
+    os.symlink(os.path.basename(version_path), link_path)
+
+    old_path = f"{path}.old"
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+    if os.path.isdir(path) and not os.path.islink(path):
+        # A plain directory, from before indexes were versioned: a symlink can't be renamed
+        # over it, so it is moved aside first, this once
+        os.replace(path, old_path)
+        os.replace(link_path, path)
+        shutil.rmtree(old_path)
+    else:
+        os.replace(link_path, path)
+
+    current = os.path.realpath(path)
+    for stale in _versions(path):
+        if os.path.realpath(stale) != current:
+            shutil.rmtree(stale, ignore_errors=True)
@@ -0,0 +1,422 @@
+"""Async search service: one process owns the Marqo client, query cache and result
+cache, and the app talks to it over HTTP instead of calling Marqo from each rerun.
+
+- The calls a page needs (stats, facet counts, the search) run concurrently, so a
+  page costs the slowest of them rather than their sum
+- Identical requests in flight at the same time (e.g. many users on the landing
+  page) share one upstream call
+- At most `max_concurrency` calls go to the backend at once; once `max_pending`
+  more are queued, requests are turned away with 503 and Retry-After instead of
+  piling up behind a slow Marqo
+
+    python -m src.ml_on_the_mind.search_service --port 8700
+"""
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+import marqo
+from aiohttp import web
+from .data.catalogue import CATALOGUE_DIR, Catalogue
+from .data.facets import FACET_FIELDS, FacetIndex
+from .data.ranges import RangeIndex
+from .search.backends import (
+    FILTER_FIELDS, LOCAL_INDEX_DIR, HybridBackend, LocalBackend, MarqoBackend, RangeBackend, SearchBackend
+)
+from .search.filter_options import FACET_QUERY_DEPTH, get_all_filter_options, get_filter_options_from_results
+from .search.index_alias import resolve_index
+from .search.lexical import LEXICAL_INDEX_DIR, LexicalIndex
+from .search.marqo_pool import size_connection_pool
+from .search.query_cache import TOP_QUERIES_PATH, QueryEmbeddingCache, QueryLog, load_top_queries, warm_up
+from .search.result_cache import ResultCache, normalize_query
+from .search.storage import built_at
+from . import metrics
+
+CONNECTION_URL = os.environ.get("MARQO_URL", "https://74ab-75-50-53-185.ngrok-free.app")
+# Re-resolve the index alias this often, so a switch takes effect without a restart
+ALIAS_TTL = 30
+WARMUP_QUERIES_FILE = os.environ.get("WARMUP_QUERIES_FILE", TOP_QUERIES_PATH)
+WARMUP_LOGGED_QUERIES = int(os.environ.get("WARMUP_LOGGED_QUERIES", "200"))
+FILTER_OPTION_FIELDS = ['modalities', 'species', 'tasks']
+
+class Overloaded(Exception):
+    """More backend calls are queued than the service is willing to hold"""
+
+class UpstreamLimiter:
+    """Runs blocking backend calls on a dedicated thread pool, at most
+    `max_concurrency` at a time, rejecting calls beyond `max_pending` queued ones"""
+
+    def __init__(self, max_concurrency: int = 8, max_pending: int = 64):
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="upstream")
+        self.in_flight = 0
+
+    @property
+    def pending(self) -> int:
+        return max(self.in_flight - self.max_concurrency, 0)
+
+    async def run(self, operation: str, function: Callable, *args):
+        if self.pending >= self.max_pending:
+            metrics.inc("upstream_rejected_total", operation=operation)
+            raise Overloaded(f"{self.pending} backend calls already queued")
+        self.in_flight += 1
+        try:
+            async with self.semaphore:
+                with metrics.timer("upstream_seconds", operation=operation):
+                    return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+        finally:
+            self.in_flight -= 1
+
+class Coalescer:
+    """Shares one call between identical requests: while a call for a key is in
+    flight, further requests for that key wait for its result instead of making
+    their own. Keys start with the operation name, for the metrics."""
+
+    def __init__(self):
+        self.in_flight: Dict[Hashable, asyncio.Future] = {}
+
+    async def run(self, key: tuple, call: Callable[[], Awaitable]):
+        future = self.in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(call())
+            self.in_flight[key] = future
+            future.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            metrics.inc("coalesced_requests_total", operation=key[0])
+        # One client giving up mustn't cancel the call for everyone else waiting on it
+        return await asyncio.shield(future)
+
+    def _finished(self, key: tuple, future: asyncio.Future):
+        self.in_flight.pop(key, None)
+        if not future.cancelled():
+            # Marks the exception retrieved even if every waiter has gone
+            future.exception()
+
+class SearchService:
+    def __init__(
+        self,
+        backend: str = "marqo",
+        search_mode: str = "hybrid",
+        marqo_url: str = CONNECTION_URL,
+        max_concurrency: int = 8,
+        max_pending: int = 64,
+    ):
+        self.query_cache = QueryEmbeddingCache()
+        self.query_log = QueryLog()
+        self.results = ResultCache(max_size=512, ttl=300)
+        self.search_mode = search_mode
+        self.local_backend = backend == "local"
+        self._load_indexes()
+        if self.local_backend:
+            self.client = None
+        else:
+            size_connection_pool(max_concurrency)
+            self.client = marqo.Client(url=marqo_url)
+        self.limiter = UpstreamLimiter(max_concurrency, max_pending)
+        self.coalescer = Coalescer()
+        self._index: Optional[str] = None
+        self._index_resolved = 0.0
+        self._indexes_checked = time.monotonic()
+        self._warmed = set()
+        metrics.REGISTRY.add_collector(self._cache_counters)
+
+    def _index_versions(self) -> tuple:
+        paths = [CATALOGUE_DIR, LEXICAL_INDEX_DIR] + ([LOCAL_INDEX_DIR] if self.local_backend else [])
+        return tuple(built_at(path) for path in paths)
+
+    def _load_indexes(self):
+        """(Re)load the catalogue, the indexes built from it and the local ones"""
+        versions = self._index_versions()
+        catalogue = Catalogue.load()
+        facet_index = FacetIndex(catalogue) if catalogue is not None else None
+        ranges = RangeIndex(catalogue) if catalogue is not None else None
+        # Loaded in either mode: facet counts take a query's match set from its postings
+        lexical = LexicalIndex.load()
+        local = LocalBackend(LOCAL_INDEX_DIR, query_cache=self.query_cache) if self.local_backend else None
+        # Swapped in together, so a request never pairs indexes from two builds
+        self.catalogue, self.facet_index, self.ranges, self.lexical, self.local = \
+            catalogue, facet_index, ranges, lexical, local
+        self.loaded_versions = versions
+
+    def _cache_counters(self):
+        counters = {}
+        for name, cache in [("results", self.results), ("query_embeddings", self.query_cache)]:
+            counters[('cache_hits_total', (('cache', name),))] = cache.hits
+            counters[('cache_misses_total', (('cache', name),))] = cache.misses
+        return counters
+
+    async def call(self, key: tuple, function: Callable, *args):
+        """A blocking backend call, shared with identical calls in flight and run under the limiter"""
+        return await self.coalescer.run(key, lambda: self.limiter.run(key[0], function, *args))
+
+    async def local_call(self, key: tuple, function: Callable, *args):
+        """CPU-bound work on in-memory indexes: off the event loop, but not counted against Marqo"""
+        return await self.coalescer.run(key, lambda: asyncio.to_thread(function, *args))
+
+    async def backend(self) -> SearchBackend:
+        # Checked as often as the alias, so a rebuild is served without a restart
+        if time.monotonic() - self._indexes_checked > ALIAS_TTL:
+            self._indexes_checked = time.monotonic()
+            if await asyncio.to_thread(self._index_versions) != self.loaded_versions:
+                await asyncio.to_thread(self._load_indexes)
+        if self.local is not None:
+            backend = self.local
+        else:
+            if self._index is None or time.monotonic() - self._index_resolved > ALIAS_TTL:
+                self._index = await self.call(("alias",), resolve_index, self.client)
+                self._index_resolved = time.monotonic()
+            backend = MarqoBackend(self.client, self._index, query_cache=self.query_cache)
+        if self.lexical is not None and self.search_mode == "hybrid":
+            backend = HybridBackend(backend, self.lexical)
+        if self.ranges is not None:
+            backend = RangeBackend(backend, self.ranges, self.facet_index)
+        if backend.embedding_space not in self._warmed:
+            self._warmed.add(backend.embedding_space)
+            # In the background; until it finishes, searches embed their query on demand
+            asyncio.get_running_loop().run_in_executor(None, self._warm_up, backend)
+        self.results.set_version(backend.version)
+        return backend
+
+    def _warm_up(self, backend: SearchBackend):
+        queries = load_top_queries(WARMUP_QUERIES_FILE) + self.query_log.top_queries(WARMUP_LOGGED_QUERIES)
+        try:
+            warm_up(backend, self.query_cache, queries)
+        except Exception as e:
+            # Warm-up is an optimization; searches still embed on demand
+            print(f"Could not warm up query embeddings: {str(e)}")
+
+    async def cached(self, key: tuple, function: Callable, *args):
+        """A backend call through the result cache"""
+        value = self.results.get(key)
+        if value is None:
+            value = await self.call((*key, self.results.version), function, *args)
+            self.results.set(key, value)
+        return value
+
+    async def stats(self) -> Dict:
+        if self.catalogue is not None:
+            return {'numberOfDocuments': self.catalogue.total}
+        backend = await self.backend()
+        return await self.cached(("stats",), backend.get_stats)
+
+    async def search(
+        self,
+        query: str,
+        filters: Optional[Dict] = None,
+        limit: int = 10,
+        offset: int = 0,
+        attributes_to_retrieve: Optional[List[str]] = None,
+        log: bool = False,
+    ) -> List[Dict]:
+        query = normalize_query(query) or "*"
+        backend = await self.backend()
+        if log:
+            await asyncio.to_thread(self.query_log.record, query)
+        key = ("search", query, tuple(sorted((filters or {}).items())), limit, offset, tuple(attributes_to_retrieve or ()))
+        return await self.cached(key, backend.search, query, filters, limit, offset, attributes_to_retrieve)
+
+    async def facets(self, query: str, filters: Optional[Dict] = None, limit: int = 10) -> Dict[str, Dict]:
+        """Per-value counts for every facet over everything the query and filters match
+        (for a query, the datasets its terms match in the lexical index, or without one
+        its top FACET_QUERY_DEPTH hits). Without a catalogue, only the values are known
+        (counts are None), read from the query's hits."""
+        filters = filters or {}
+        query = normalize_query(query) or "*"
+        if self.facet_index is not None:
+            ids = None
+            if query != "*" and self.lexical is not None:
+                ids = await self.local_call(("matches", query, self.lexical.version), self.lexical.matches, query)
+            elif query != "*":
+                # Unfiltered: counts apply the filters themselves, each except its own
+                hits = await self.search(query, None, FACET_QUERY_DEPTH, attributes_to_retrieve=['id'])
+                ids = [hit['_id'] for hit in hits]
+            selections = {field: filters.get(key, "") for key, field in FILTER_FIELDS.items()}
+            size_range = (filters.get('min_size'), filters.get('max_size'))
+            # Sizes are counted per bucket by the facet index itself; the other ranges narrow what is counted
+            ranges = self.ranges.constraints(filters, fields=['date_created', 'subject_count'])
+            key = ("facets", query, tuple(sorted(selections.items())), size_range, tuple(sorted(ranges.items())),
+                   self.results.version)
+            return await self.local_call(key, self._facet_counts, selections, size_range, filters, ids)
+
+        backend = await self.backend()
+        if query == "*":
+            options = await self.cached(("filter_options",), get_all_filter_options, backend)
+        else:
+            results = await self.search(query, None, limit, attributes_to_retrieve=FILTER_OPTION_FIELDS)
+            options = get_filter_options_from_results(results)
+        return {field: dict.fromkeys(options.get(field, [])) for field in FACET_FIELDS}
+
+    def _facet_counts(self, selections: Dict, size_range: tuple, filters: Dict,
+                      ids: Optional[List[str]]) -> Dict[str, Dict[str, int]]:
+        candidates = None
+        if ids is not None:
+            positions = [self.catalogue.index_of(doc_id) for doc_id in ids]
+            candidates = self.facet_index.from_indices(position for position in positions if position is not None)
+        mask = self.ranges.mask(filters, fields=['date_created', 'subject_count'])
+        if mask is not None:
+            mask_bitmap = self.facet_index.from_mask(mask)
+            candidates = mask_bitmap if candidates is None else candidates & mask_bitmap
+        return self.facet_index.counts(selections, size_range, candidates)
+
+    async def documents(self, ids: List[str]) -> List[Dict]:
+        backend = await self.backend()
+        return await self.call(("documents", tuple(ids), self.results.version), backend.get_documents, ids)
+
+    async def page(
+        self,
+        query: str,
+        filters: Optional[Dict] = None,
+        limit: int = 10,
+        offset: int = 0,
+        attributes_to_retrieve: Optional[List[str]] = None,
+        search: bool = True,
+        log: bool = False,
+    ) -> Dict:
+        calls = [self.stats(), self.facets(query, filters, limit)]
+        if search:
+            calls.append(self.search(query, filters, limit, offset, attributes_to_retrieve, log))
+        results = await asyncio.gather(*calls)
+        return {'stats': results[0], 'facets': results[1], 'hits': results[2] if search else None}
+
+    def close(self):
+        self.limiter.executor.shutdown(wait=False, cancel_futures=True)
+        self.query_cache.save()
+
+class InvalidRequest(Exception):
+    """A request body with missing or mistyped arguments; answered with 400"""
+
+def _integer(body: Dict, key: str, default: int, maximum: int = 10_000) -> int:
+    value = body.get(key, default)
+    # bool is an int, but never a sensible page size
+    if not isinstance(value, int) or isinstance(value, bool) or not 0 <= value <= maximum:
+        raise InvalidRequest(f"'{key}' must be an integer from 0 to {maximum}")
+    return value
+
+def _string(body: Dict, key: str, default: str) -> str:
+    value = body.get(key, default)
+    if value is None:
+        return default
+    if not isinstance(value, str):
+        raise InvalidRequest(f"'{key}' must be a string")
+    return value
+
+def _strings(body: Dict, key: str) -> Optional[List[str]]:
+    value = body.get(key)
+    if value is not None and (not isinstance(value, list) or not all(isinstance(item, str) for item in value)):
+        raise InvalidRequest(f"'{key}' must be a list of strings")
+    return value
+
+def _filters(body: Dict) -> Optional[Dict]:
+    filters = body.get('filters')
+    if filters is None:
+        return None
+    # Filter values end up in cache keys, so they must be scalars
+    if not isinstance(filters, dict) or not all(isinstance(value, (str, int, float, type(None))) for value in filters.values()):
+        raise InvalidRequest("'filters' must be an object of strings and numbers")
+    return filters
+
+def _search_args(body: Dict) -> Dict:
+    return {
+        'query': _string(body, 'query', "*"),
+        'filters': _filters(body),
+        'limit': _integer(body, 'limit', 10),
+        'offset': _integer(body, 'offset', 0),
+        'attributes_to_retrieve': _strings(body, 'attributes_to_retrieve'),
+        'log': bool(body.get('log', False)),
+    }
+
+async def _stats(service: SearchService, body: Dict) -> Dict:
+    return {'stats': await service.stats()}
+
+async def _search(service: SearchService, body: Dict) -> Dict:
+    return {'hits': await service.search(**_search_args(body))}
+
+async def _facets(service: SearchService, body: Dict) -> Dict:
+    return {'facets': await service.facets(_string(body, 'query', ""), _filters(body), _integer(body, 'limit', 10))}
+
+async def _documents(service: SearchService, body: Dict) -> Dict:
+    return {'documents': await service.documents(_strings(body, 'ids') or [])}
+
+async def _page(service: SearchService, body: Dict) -> Dict:
+    return await service.page(**_search_args(body), search=bool(body.get('search', True)))
+
+SERVICE = web.AppKey("service", SearchService)
+
+def _endpoint(name: str, method: Callable[[SearchService, Dict], Awaitable[Dict]]):
+    async def handle(request: web.Request) -> web.Response:
+        service = request.app[SERVICE]
+        try:
+            body = await request.json() if request.can_read_body else {}
+        except ValueError:
+            raise web.HTTPBadRequest(text="Request body must be JSON")
+        if not isinstance(body, dict):
+            raise web.HTTPBadRequest(text="Request body must be a JSON object")
+        try:
+            with metrics.timer("service_request_seconds", endpoint=name):
+                result = await method(service, body)
+                # Lets clients invalidate their own caches without asking separately. The call
+                # above resolved the backend and recorded its version, unless it was answered
+                # from the catalogue alone before any backend was resolved
+                version = service.results.version
+                if version is None:
+                    version = (await service.backend()).version
+        except InvalidRequest as e:
+            raise web.HTTPBadRequest(text=str(e))
+        except Overloaded as e:
+            raise web.HTTPServiceUnavailable(text=str(e), headers={'Retry-After': "1"})
+        except Exception as e:
+            print(f"Error handling {name} request: {str(e)}")
+            return web.json_response({'error': str(e)}, status=502)
+        return web.json_response({**result, 'version': version})
+    return handle
+
+async def _health(request: web.Request) -> web.Response:
+    limiter = request.app[SERVICE].limiter
+    return web.json_response({'status': "ok", 'in_flight': limiter.in_flight, 'pending': limiter.pending})
+
+async def _metrics(request: web.Request) -> web.Response:
+    return web.Response(text=metrics.REGISTRY.to_prometheus(), content_type="text/plain")
+
+def create_app(**service_options) -> web.Application:
+    app = web.Application()
+
+    async def start(app):
+        # The semaphore and futures belong to the running event loop, so the service is created inside it
+        app[SERVICE] = SearchService(**service_options)
+
+    async def stop(app):
+        app[SERVICE].close()
+
+    app.on_startup.append(start)
+    app.on_cleanup.append(stop)
+    app.router.add_get("/stats", _endpoint("stats", _stats))
+    app.router.add_post("/search", _endpoint("search", _search))
+    app.router.add_post("/facets", _endpoint("facets", _facets))
+    app.router.add_post("/documents", _endpoint("documents", _documents))
+    app.router.add_post("/page", _endpoint("page", _page))
+    app.router.add_get("/health", _health)
+    app.router.add_get("/metrics", _metrics)
+    return app
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve searches, stats and facet counts for the app over HTTP")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--backend", choices=["marqo", "local"], default=os.environ.get("SEARCH_BACKEND", "marqo"))
+    parser.add_argument("--search-mode", choices=["hybrid", "vector"], default=os.environ.get("SEARCH_MODE", "hybrid"))
+    parser.add_argument("--marqo-url", default=CONNECTION_URL)
+    parser.add_argument("--max-concurrency", type=int, default=8, help="Backend calls in flight at once")
+    parser.add_argument("--max-pending", type=int, default=64,
+                        help="Backend calls allowed to queue before requests get 503")
+    args = parser.parse_args()
+    web.run_app(create_app(
+        backend=args.backend,
+        search_mode=args.search_mode,
+        marqo_url=args.marqo_url,
+        max_concurrency=args.max_concurrency,
+        max_pending=args.max_pending,
+    ), host=args.host, port=args.port)
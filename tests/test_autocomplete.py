@@ -0,0 +1,55 @@
+from src.ml_on_the_mind.data.catalogue import build_catalogue
+from src.ml_on_the_mind.search.autocomplete import PrefixIndex
+
+DATASETS = [
+    {'id': "ds000001", 'name': "Mouse visual cortex imaging", 'modalities': ["Calcium imaging"],
+     'species': ["Mouse"], 'tasks': ["passive viewing"]},
+    {'id': "ds000002", 'name': "Motor learning in humans", 'modalities': ["MRI"], 'species': ["Human"],
+     'tasks': ["motor sequence"]},
+    {'id': "ds000003", 'name': "Visual search", 'modalities': ["EEG"], 'species': ["Human"], 'tasks': ["visual search"]},
+]
+
+def texts(suggestions):
+    return [(suggestion['text'], suggestion['kind']) for suggestion in suggestions]
+
+def catalogue_index(tmp_path):
+    catalogue = build_catalogue(DATASETS, path=str(tmp_path / "catalogue"))
+    return PrefixIndex.from_catalogue(catalogue)
+
+def test_suggest_ranks_facet_values_first(tmp_path):
+    index = catalogue_index(tmp_path)
+    assert texts(index.suggest("mo")) == [
+        ("Mouse", 'species'),
+        ("motor sequence", 'task'),
+        ("Motor learning in humans", 'name'),
+        ("Mouse visual cortex imaging", 'name'),
+    ]
+
+def test_suggest_matches_name_words_and_ids(tmp_path):
+    index = catalogue_index(tmp_path)
+    assert ("Mouse visual cortex imaging", 'name') in texts(index.suggest("visual cortex"))
+    # A name's first word outranks a later one
+    assert texts(index.suggest("visual"))[-2:] == [("Visual search", 'name'), ("Mouse visual cortex imaging", 'name')]
+    assert texts(index.suggest("DS000002")) == [("ds000002", 'id')]
+    assert index.suggest("  ") == []
+    assert index.suggest("zebrafish") == []
+
+def test_suggest_respects_limit(tmp_path):
+    index = catalogue_index(tmp_path)
+    assert len(index.suggest("ds", limit=2)) == 2
+
+def test_saved_index_suggests_the_same(tmp_path):
+    index = catalogue_index(tmp_path)
+    index.save(str(tmp_path / "prefix_index"), catalogue_version="v1")
+    loaded = PrefixIndex.load(str(tmp_path / "prefix_index"))
+    assert len(loaded) == len(index)
+    for prefix in ["mo", "visual", "ds0000", "h", "mri"]:
+        assert loaded.suggest(prefix) == index.suggest(prefix)
+    assert PrefixIndex.load(str(tmp_path / "prefix_index"), catalogue_version="v2") is None
+
+def test_short_prefix_reaches_facet_values_past_many_names():
+    # Far more "mo..." name keys than one scan looks at
+    entries = [(f"Motion study {i:04d}", f"Motion study {i:04d}", 'name', 1) for i in range(1000)]
+    entries.append(("Mouse", "Mouse", 'species', 1_000_000 + 5))
+    index = PrefixIndex(entries)
+    assert index.suggest("mo", scan=200)[0] == {'text': "Mouse", 'kind': 'species'}
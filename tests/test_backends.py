@@ -0,0 +1,185 @@
+import pytest
+from src.ml_on_the_mind.data.catalogue import build_catalogue
+from src.ml_on_the_mind.data.facets import FacetIndex
+from src.ml_on_the_mind.data.ranges import RangeIndex
+from src.ml_on_the_mind.search.backends import (
+    HybridBackend, RangeBackend, SearchBackend, build_local_index, matches_filters
+)
+from src.ml_on_the_mind.search.embedders import HashingEmbedder
+from src.ml_on_the_mind.search.lexical import LexicalIndexBuilder
+
+DATASETS = [
+    ('ds000001', "Mouse visual cortex calcium imaging", "two photon calcium imaging of mouse visual cortex",
+     ['Calcium imaging'], ['Mouse'], 10),
+    ('ds000002', "Human language fMRI", "fmri of human language comprehension", ['fMRI'], ['Human'], 1000),
+    ('000003/draft', "Rat hippocampus place cells", "electrophysiology of rat hippocampus place cells",
+     ['Electrophysiology'], ['Rat'], 100),
+    ('ds000004', "Mouse hippocampus calcium imaging", "calcium imaging of mouse hippocampus place cells",
+     ['Calcium imaging'], ['Mouse'], 50),
+    ('ds000005', "Human EEG sleep", "eeg recordings of human sleep stages", ['EEG'], ['Human'], 5),
+]
+
+def make_documents():
+    documents = []
+    for dataset_id, name, description, modalities, species, size in DATASETS:
+        documents.append({
+            'id': dataset_id,
+            '_id': dataset_id,
+            'name': name,
+            'description': description,
+            'modalities': modalities,
+            'species': species,
+            'tasks': ["Not specified"],
+            'source': "dandi" if "/" in dataset_id else "openneuro",
+            'data_standard': "BIDS",
+            'size': size,
+            'searchable_content': f"{name}. {description}",
+        })
+    return documents
+
+@pytest.fixture
+def local_backend(tmp_path):
+    return build_local_index(make_documents(), HashingEmbedder(64), path=str(tmp_path / "local_index"))
+
+@pytest.fixture
+def lexical_index(tmp_path):
+    builder = LexicalIndexBuilder()
+    for doc in make_documents():
+        builder.add(doc)
+    return builder.save(str(tmp_path / "lexical_index"))
+
+def ids(hits):
+    return [hit['_id'] for hit in hits]
+
+def test_local_search_ranks_matching_documents_first(local_backend):
+    hits = local_backend.search("mouse visual cortex calcium imaging", limit=5)
+    assert ids(hits)[0] == 'ds000001'
+    assert [hit['_score'] for hit in hits] == sorted((hit['_score'] for hit in hits), reverse=True)
+
+def test_local_search_applies_filters(local_backend):
+    hits = local_backend.search("imaging", {'modality': "Calcium imaging"}, limit=10)
+    assert sorted(ids(hits)) == ['ds000001', 'ds000004']
+    hits = local_backend.search("recordings", {'species': "Human", 'min_size': 10}, limit=10)
+    assert ids(hits) == ['ds000002']
+    hits = local_backend.search("*", {'max_size': 50}, limit=10)
+    assert ids(hits) == ['ds000001', 'ds000004', 'ds000005']
+
+def test_local_search_pages_with_offset(local_backend):
+    everything = ids(local_backend.search("mouse hippocampus", limit=5))
+    pages = ids(local_backend.search("mouse hippocampus", limit=2)) + \
+        ids(local_backend.search("mouse hippocampus", limit=2, offset=2)) + \
+        ids(local_backend.search("mouse hippocampus", limit=2, offset=4))
+    assert pages == everything
+    assert len(set(everything)) == len(DATASETS)
+
+def test_local_search_retrieves_requested_attributes(local_backend):
+    hit = local_backend.search("sleep", limit=1, attributes_to_retrieve=['name'])[0]
+    # _highlights carries the best passage, like Marqo's
+    assert set(hit) - {'_highlights'} == {'name', '_id', '_score'}
+
+def test_local_index_rebuild_matches(local_backend, tmp_path):
+    rebuilt = build_local_index(make_documents(), HashingEmbedder(64), path=str(tmp_path / "local_index"))
+    assert ids(rebuilt.search("rat place cells", limit=5)) == ids(local_backend.search("rat place cells", limit=5))
+
+class FixedRanking(SearchBackend):
+    """Vector backend stand-in that ranks documents in a fixed order"""
+
+    def __init__(self, order):
+        self.documents = {doc['id']: doc for doc in make_documents()}
+        self.order = order
+
+    @property
+    def version(self):
+        return "fixed"
+
+    def search(self, query, filters=None, limit=10, offset=0, attributes_to_retrieve=None):
+        hits = [{**self.documents[doc_id], '_score': 1.0} for doc_id in self.order
+                if matches_filters(self.documents[doc_id], filters)]
+        return hits[offset:offset + limit]
+
+    def get_documents(self, ids):
+        return [self.documents[doc_id] for doc_id in ids if doc_id in self.documents]
+
+    def get_stats(self):
+        return {'numberOfDocuments': len(self.documents)}
+
+def test_hybrid_fuses_rankings_with_rrf(lexical_index):
+    # "sleep" only matches ds000005 lexically; the vector ranking has it last
+    backend = HybridBackend(FixedRanking(['ds000001', 'ds000002', 'ds000004', 'ds000005']), lexical_index, rrf_k=60)
+    hits = backend.search("sleep", limit=4)
+    assert ids(hits) == ['ds000005', 'ds000001', 'ds000002', 'ds000004']
+    assert hits[0]['_score'] == pytest.approx(1 / 61 + 1 / 64)
+    assert hits[1]['_score'] == pytest.approx(1 / 61)
+
+def test_hybrid_adds_lexical_only_matches_that_pass_filters(lexical_index):
+    backend = HybridBackend(FixedRanking(['ds000001']), lexical_index)
+    assert set(ids(backend.search("place cells", limit=5))) == {'000003/draft', 'ds000004', 'ds000001'}
+    assert ids(backend.search("place cells", {'species': "Rat"}, limit=5)) == ['000003/draft']
+
+def test_hybrid_fetches_only_the_lexical_matches_it_returns(lexical_index):
+    fetched = []
+    vector = FixedRanking(['ds000001'])
+    get_documents = vector.get_documents
+    vector.get_documents = lambda ids: fetched.extend(ids) or get_documents(ids)
+    backend = HybridBackend(vector, lexical_index)
+    assert len(backend.search("place cells", limit=2)) == 2
+    assert len(fetched) == 1
+    fetched.clear()
+    hits = backend.search("place cells", limit=5, attributes_to_retrieve=['id'])
+    assert set(ids(hits)) == {'000003/draft', 'ds000004', 'ds000001'}
+    assert fetched == []
+
+@pytest.mark.parametrize("query, expected", [
+    ("place cells", ['000003/draft', 'ds000004']),
+    ("mouse place cells", ['ds000004']),
+    # No dataset has every term, so any of them will do
+    ("mouse sleep", ['ds000001', 'ds000004', 'ds000005']),
+    ("DS000002", ['ds000002']),
+    ("zebrafish", None),
+])
+def test_lexical_matches(lexical_index, query, expected):
+    assert lexical_index.matches(query) == expected
+
+@pytest.mark.parametrize("query, expected", [
+    ("ds000002", 'ds000002'),
+    ("DS000002", 'ds000002'),
+    ("000003", '000003/draft'),
+    ("dandi:000003", '000003/draft'),
+])
+def test_hybrid_exact_id_lookup(lexical_index, query, expected):
+    backend = HybridBackend(FixedRanking(['ds000001', 'ds000004']), lexical_index)
+    hits = backend.search(query, limit=5)
+    assert ids(hits) == [expected]
+    assert hits[0]['_score'] == 1.0
+
+def test_hybrid_exact_id_lookup_respects_filters(lexical_index):
+    backend = HybridBackend(FixedRanking([]), lexical_index)
+    assert backend.search("ds000002", {'species': "Mouse"}) == []
+
+@pytest.fixture
+def range_backend(local_backend, tmp_path):
+    datasets = [{key: value for key, value in doc.items() if key not in ('_id', 'searchable_content')}
+                for doc in make_documents()]
+    catalogue = build_catalogue(datasets, path=str(tmp_path / "catalogue"))
+    return RangeBackend(local_backend, RangeIndex(catalogue), FacetIndex(catalogue), sort_depth=3)
+
+def test_range_listing_reads_records_from_the_catalogue(range_backend, monkeypatch):
+    def get_documents(ids):
+        raise AssertionError("listing fetched documents from the index")
+    monkeypatch.setattr(range_backend.backend, "get_documents", get_documents)
+    hits = range_backend.search("*", {'sort': "size"}, limit=3, attributes_to_retrieve=['name', 'size'])
+    assert ids(hits) == ['ds000002', '000003/draft', 'ds000004']
+    assert set(hits[0]) == {'_id', '_score', 'name', 'size'}
+    hits = range_backend.search("*", {'min_size': 10, 'max_size': 100, 'species': "Mouse"}, limit=10)
+    assert ids(hits) == ['ds000001', 'ds000004']
+    assert hits[0]['description'] == DATASETS[0][2]
+
+def test_sorted_query_pages_slice_one_sorted_list(range_backend):
+    everything = range_backend.search("imaging calcium mouse", {'sort': "size"}, limit=10)
+    # Sorting orders the sort_depth most relevant hits
+    assert len(everything) == 3
+    sizes = [hit['size'] for hit in everything]
+    assert sizes == sorted(sizes, reverse=True)
+    pages = [range_backend.search("imaging calcium mouse", {'sort': "size"}, limit=2, offset=offset)
+             for offset in (0, 2, 4)]
+    assert ids(pages[0]) + ids(pages[1]) + ids(pages[2]) == ids(everything)
@@ -0,0 +1,143 @@
+import random
+import numpy as np
+import pytest
+from src.ml_on_the_mind.data.catalogue import NOT_SPECIFIED, build_catalogue
+from src.ml_on_the_mind.data.facets import FACET_FIELDS, GB, SIZE_BUCKETS, FacetIndex
+from src.ml_on_the_mind.data.normalize import Normalizer, synthetic_records
+from src.ml_on_the_mind.data.ranges import RangeIndex
+from src.ml_on_the_mind.data.utils import parse_timestamp
+
+def make_datasets(count=500):
+    rng = random.Random(1)
+    records = synthetic_records(count, seed=3)
+    for record in records:
+        # A spread of dates, some unknown
+        record['date_created'] = rng.choice([None, f"20{rng.randint(10, 24)}-{rng.randint(1, 12):02d}-01T00:00:00Z"])
+    return Normalizer().normalize(records)
+
+DATASETS = make_datasets()
+
+@pytest.fixture(scope="module")
+def catalogue(tmp_path_factory):
+    return build_catalogue(DATASETS, path=str(tmp_path_factory.mktemp("cache") / "catalogue"))
+
+def values(dataset, field):
+    value = dataset[field]
+    return value if isinstance(value, list) else [value]
+
+def date_of(dataset):
+    created = parse_timestamp(dataset['date_created']) if dataset['date_created'] != NOT_SPECIFIED else None
+    return created.timestamp() if created else None
+
+def brute_force_counts(selections, size_range=(None, None), candidates=None):
+    def passes(position, dataset, skip):
+        if candidates is not None and position not in candidates:
+            return False
+        if skip != 'size' and size_range != (None, None):
+            low, high = size_range
+            if (low is not None and dataset['size'] < low) or (high is not None and dataset['size'] > high):
+                return False
+        return all(value in values(dataset, field) for field, value in selections.items() if field != skip)
+
+    results = {}
+    for field in FACET_FIELDS:
+        counts = {}
+        for position, dataset in enumerate(DATASETS):
+            if passes(position, dataset, field):
+                for value in values(dataset, field):
+                    if value != NOT_SPECIFIED:
+                        counts[value] = counts.get(value, 0) + 1
+        results[field] = counts
+    sizes = {}
+    for label, low, high in SIZE_BUCKETS:
+        count = sum(1 for position, dataset in enumerate(DATASETS) if passes(position, dataset, 'size')
+                    and dataset['size'] >= low and (high is None or dataset['size'] < high))
+        if count:
+            sizes[label] = count
+    results['size'] = sizes
+    return results
+
+@pytest.mark.parametrize("selections, size_range", [
+    ({}, (None, None)),
+    ({'modalities': "EEG"}, (None, None)),
+    ({'species': "Human", 'source': "openneuro"}, (None, None)),
+    ({'modalities': "MRI", 'data_standard': "BIDS"}, (None, 500 * GB)),
+    ({}, (100 * GB, None)),
+])
+def test_facet_counts_match_brute_force(catalogue, selections, size_range):
+    counts = FacetIndex(catalogue).counts(selections, size_range)
+    assert counts == brute_force_counts(selections, size_range)
+    for field in FACET_FIELDS:
+        assert list(counts[field].values()) == sorted(counts[field].values(), reverse=True)
+
+def test_facet_counts_over_candidates(catalogue):
+    facets = FacetIndex(catalogue)
+    candidates = set(random.Random(2).sample(range(len(DATASETS)), 60))
+    counts = facets.counts({'species': "Mouse"}, candidates=facets.from_indices(candidates))
+    assert counts == brute_force_counts({'species': "Mouse"}, candidates=candidates)
+
+def test_facet_match_round_trips_indices(catalogue):
+    facets = FacetIndex(catalogue)
+    bitmap = facets.match({'modalities': "EEG", 'source': "dandi"})
+    expected = [position for position, dataset in enumerate(DATASETS)
+                if "EEG" in dataset['modalities'] and dataset['source'] == "dandi"]
+    assert facets.to_indices(bitmap).tolist() == expected
+    assert facets.count(bitmap) == len(expected)
+    assert facets.count(facets.value_bitmap('species', "Unicorn")) == 0
+
+@pytest.mark.parametrize("filters", [
+    {'min_size': 10**11},
+    {'min_size': 10**11, 'max_size': 5 * 10**11},
+    {'min_subjects': 20, 'max_subjects': 100},
+    {'min_date': parse_timestamp("2015-01-01").timestamp(), 'max_date': parse_timestamp("2020-06-01").timestamp()},
+    {'max_date': parse_timestamp("2012-01-01").timestamp(), 'min_subjects': 5},
+])
+def test_range_mask_matches_brute_force(catalogue, filters):
+    def passes(dataset):
+        checks = [
+            ('min_size', lambda bound: dataset['size'] >= bound),
+            ('max_size', lambda bound: dataset['size'] <= bound),
+            ('min_subjects', lambda bound: dataset['subject_count'] >= bound),
+            ('max_subjects', lambda bound: dataset['subject_count'] <= bound),
+            ('min_date', lambda bound: date_of(dataset) is not None and date_of(dataset) >= bound),
+            ('max_date', lambda bound: date_of(dataset) is not None and date_of(dataset) <= bound),
+        ]
+        return all(check(filters[key]) for key, check in checks if key in filters)
+
+    mask = RangeIndex(catalogue).mask(filters)
+    assert np.flatnonzero(mask).tolist() == [i for i, dataset in enumerate(DATASETS) if passes(dataset)]
+
+def test_range_mask_is_none_without_range_filters(catalogue):
+    ranges = RangeIndex(catalogue)
+    assert ranges.mask({'species': "Human", 'sort': "newest"}) is None
+    assert ranges.strip({'species': "Human", 'min_size': 1, 'sort': "size"}) == {'species': "Human"}
+
+def test_ranked_lists_newest_first_with_unknown_dates_last(catalogue):
+    ranked = RangeIndex(catalogue).ranked('newest').tolist()
+    assert sorted(ranked) == list(range(len(DATASETS)))
+    dates = [date_of(DATASETS[position]) for position in ranked]
+    known = [date for date in dates if date is not None]
+    assert dates[:len(known)] == known
+    assert known == sorted(known, reverse=True)
+
+def test_ranked_within_mask(catalogue):
+    ranges = RangeIndex(catalogue)
+    mask = ranges.mask({'min_subjects': 50})
+    ranked = ranges.ranked('subjects', mask).tolist()
+    assert sorted(ranked) == np.flatnonzero(mask).tolist()
+    subjects = [DATASETS[position]['subject_count'] for position in ranked]
+    assert subjects == sorted(subjects, reverse=True)
+
+def test_sort_is_a_stable_permutation(catalogue):
+    ranges = RangeIndex(catalogue)
+    positions = np.array(random.Random(4).sample(range(len(DATASETS)), 100))
+    order = ranges.sort(positions, 'size')
+    assert sorted(order.tolist()) == list(range(len(positions)))
+    # Ties keep their incoming order, like a relevance ranking
+    expected = sorted(range(len(positions)), key=lambda i: -DATASETS[positions[i]]['size'])
+    assert order.tolist() == expected
+
+def test_positions_of_ids(catalogue):
+    ranges = RangeIndex(catalogue)
+    assert ranges.positions_of([DATASETS[7]['id'], "missing", DATASETS[0]['id']]).tolist() == [7, -1, 0]
+    assert ranges.ids([7, 0]) == [DATASETS[7]['id'], DATASETS[0]['id']]
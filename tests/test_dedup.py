@@ -0,0 +1,66 @@
+from src.ml_on_the_mind.data.dedup import collapse_versions, dedupe_datasets, find_duplicate_groups, normalize_doi
+
+STUDY = ("Simultaneous recordings from primary visual cortex and hippocampus of head fixed mice "
+         "running on a treadmill through a virtual corridor with drifting grating stimuli presented "
+         "at eight orientations while pupil diameter and running speed were tracked across sessions")
+OTHER_STUDY = ("Resting state functional magnetic resonance imaging of healthy adult volunteers scanned "
+               "twice a week apart to estimate test retest reliability of connectivity measures across "
+               "several commonly used parcellations and preprocessing pipelines")
+
+def dataset(dataset_id, source, name="Untitled", description="Not specified", doi="Not specified",
+            date_created="2023-01-01T00:00:00+00:00"):
+    return {'id': dataset_id, 'source': source, 'name': name, 'description': description,
+            'doi': doi, 'date_created': date_created}
+
+def ids(datasets):
+    return sorted(dataset['id'] for dataset in datasets)
+
+def test_collapse_versions_keeps_newest_published():
+    collapsed = collapse_versions([
+        dataset("000123/draft", "dandi", date_created="2024-01-01T00:00:00+00:00"),
+        dataset("000123/0.230101.1200", "dandi"),
+        dataset("000123/0.230601.1200", "dandi"),
+        dataset("000456/draft", "dandi"),
+        dataset("ds000123", "openneuro"),
+    ])
+    assert ids(collapsed) == ["000123/0.230601.1200", "000456/draft", "ds000123"]
+    newest = next(record for record in collapsed if record['id'].startswith("000123"))
+    assert sorted(newest['aliases']) == ["000123/0.230101.1200", "000123/draft"]
+
+def test_normalize_doi():
+    assert normalize_doi("https://doi.org/10.1000/ABC") == "10.1000/abc"
+    assert normalize_doi("doi:10.1000/abc ") == "10.1000/abc"
+    assert normalize_doi("Not specified") is None
+
+def test_doi_links_records_from_different_sources_only():
+    datasets = [
+        dataset("ds000001", "openneuro", doi="10.1000/paper"),
+        dataset("ds000002", "openneuro", doi="10.1000/paper"),
+        dataset("000003/draft", "dandi", doi="https://doi.org/10.1000/PAPER"),
+    ]
+    # Two OpenNeuro datasets citing the same paper stay apart; the DANDI copy joins one
+    assert find_duplicate_groups(datasets) == [[0, 2]]
+
+def test_near_duplicates_are_merged_into_the_most_complete_record():
+    deduped = dedupe_datasets([
+        dataset("ds000001", "openneuro", "Visual cortex and hippocampus", STUDY),
+        dataset("000002/draft", "dandi", "Visual cortex and hippocampus", STUDY + " in total"),
+        dataset("ds000003", "openneuro", "Test retest fMRI", OTHER_STUDY),
+    ])
+    assert ids(deduped) == ["000002/draft", "ds000003"]
+    merged = next(record for record in deduped if record['id'] == "000002/draft")
+    assert merged['aliases'] == ["ds000001"]
+    assert merged['alias_sources'] == ["openneuro"]
+
+def test_duplicate_groups_never_hold_two_records_of_one_source():
+    datasets = [
+        dataset("ds000001", "openneuro", "Visual cortex and hippocampus", STUDY),
+        dataset("ds000002", "openneuro", "Visual cortex and hippocampus", STUDY + " again"),
+        dataset("000003/draft", "dandi", "Visual cortex and hippocampus", STUDY),
+    ]
+    groups = find_duplicate_groups(datasets)
+    assert len(groups) == 1
+    assert sorted(datasets[i]['source'] for i in groups[0]) == ["dandi", "openneuro"]
+    # The DANDI copy is identical to ds000001, so it joins that one
+    assert sorted(groups[0]) == [0, 2]
+    assert len(dedupe_datasets(datasets)) == 2
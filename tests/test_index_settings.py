@@ -0,0 +1,36 @@
+from src.ml_on_the_mind import build_vector_db
+from src.ml_on_the_mind.build_vector_db import TEXT_PREPROCESSING, changed_settings, load_manifest, save_manifest
+
+class FakeIndex:
+    def __init__(self, settings):
+        self.settings = settings
+
+    def get_settings(self):
+        return self.settings
+
+class FakeMarqo:
+    """Just enough of marqo.Client to read an index's settings"""
+
+    def __init__(self, settings):
+        self.settings = settings
+
+    def index(self, index_name):
+        return FakeIndex(self.settings)
+
+def marqo_settings(**chunking):
+    return {'model': build_vector_db.MODEL, 'textPreprocessing': {**TEXT_PREPROCESSING, **chunking}}
+
+def test_unchanged_settings(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    save_manifest("index_a", {'ds1': {'content': "a", 'record': "b"}}, path=path)
+    assert changed_settings(FakeMarqo(marqo_settings()), "index_a", path=path) == []
+    assert load_manifest("index_a", path=path) == {'ds1': {'content': "a", 'record': "b"}}
+
+def test_changed_tensor_fields_and_chunking(tmp_path, monkeypatch):
+    path = str(tmp_path / "manifest.json")
+    save_manifest("index_a", {}, path=path)
+    monkeypatch.setattr(build_vector_db, "TENSOR_FIELDS", ["searchable_content"])
+    assert changed_settings(FakeMarqo(marqo_settings()), "index_a", path=path) == ['tensor_fields']
+    # Marqo's own settings count even without a manifest for the index
+    assert changed_settings(FakeMarqo(marqo_settings(splitLength=2)), "index_b", path=path) == ['text_preprocessing']
+    assert load_manifest("index_a", path=path) == {}
@@ -0,0 +1,35 @@
+import random
+import pytest
+from src.ml_on_the_mind.metrics import BUCKETS, Histogram
+
+def test_empty_histogram_quantile_is_zero():
+    assert Histogram().quantile(0.5) == 0.0
+
+def test_single_value_quantiles_are_that_value():
+    histogram = Histogram()
+    histogram.observe(0.0042)
+    for q in (0.0, 0.5, 0.99, 1.0):
+        assert histogram.quantile(q) == pytest.approx(0.0042)
+
+def test_quantiles_fall_in_the_right_bucket():
+    rng = random.Random(0)
+    values = sorted(rng.lognormvariate(-4, 1.5) for _ in range(10_000))
+    histogram = Histogram()
+    for value in values:
+        histogram.observe(value)
+    for q in (0.5, 0.9, 0.99):
+        exact = values[int(q * len(values)) - 1]
+        # Buckets double in width, so an estimate is within a factor of two
+        assert exact / 2 <= histogram.quantile(q) <= exact * 2
+    quantiles = [histogram.quantile(q / 100) for q in range(101)]
+    assert quantiles == sorted(quantiles)
+    assert quantiles[0] >= values[0]
+    assert quantiles[-1] == pytest.approx(values[-1])
+
+def test_values_beyond_the_largest_bucket():
+    histogram = Histogram()
+    for value in (1.0, BUCKETS[-1] * 3):
+        histogram.observe(value)
+    assert histogram.counts[-1] == 1
+    assert histogram.quantile(1.0) == pytest.approx(BUCKETS[-1] * 3)
+    assert BUCKETS[-1] <= histogram.quantile(0.75) <= BUCKETS[-1] * 3
@@ -0,0 +1,43 @@
+from src.ml_on_the_mind.data.normalize import CANONICAL_FIELDS, Normalizer, coerce_counts, load_synonyms, synthetic_records
+from src.ml_on_the_mind.data.utils import clean_dataset
+
+RECORDS = synthetic_records(2000)
+
+def canonical(synonyms, field, value):
+    """What the Normalizer should make of a clean_dataset value: synonyms mapped,
+    spellings that differ only in case folded together"""
+    values = value if isinstance(value, list) else [value]
+    return list(dict.fromkeys(synonyms.get(field, {}).get(item.lower(), item).lower() for item in values))
+
+def test_normalizer_matches_clean_dataset():
+    normalized = Normalizer().normalize(RECORDS)
+    assert len(normalized) == len(RECORDS)
+    for record, dataset in zip(RECORDS, normalized):
+        expected = clean_dataset(record)
+        assert list(dataset) == list(expected)
+        for field in expected:
+            if field not in CANONICAL_FIELDS:
+                assert dataset[field] == expected[field], (record['id'], field)
+
+def test_normalizer_maps_synonyms_and_spellings():
+    synonyms = load_synonyms()
+    normalized = Normalizer().normalize(RECORDS)
+    for record, dataset in zip(RECORDS, normalized):
+        expected = clean_dataset(record)
+        for field in CANONICAL_FIELDS:
+            assert canonical(synonyms, field, dataset[field]) == canonical(synonyms, field, expected[field])
+    species = {value for dataset in normalized for value in dataset['species']}
+    assert {"Human", "Mouse", "Rat"} <= species
+    assert not {"human", "Homo sapiens", "mouse"} & species
+
+def test_normalizer_keeps_vocabularies_across_batches():
+    normalizer = Normalizer({})
+    first = normalizer.normalize([{'modalities': ["eeg"]}])
+    second = normalizer.normalize([{'modalities': ["EEG", "eeg"]}])
+    # The first spelling seen wins, for the whole load
+    assert first[0]['modalities'] == ["eeg"]
+    assert second[0]['modalities'] == ["eeg"]
+
+def test_coerce_counts_handles_mixed_columns():
+    assert coerce_counts([1, "2", None, "", 3.7, float('nan')]) == [1, 2, 0, 0, 3, 0]
+    assert coerce_counts([1, "unknown", "5"]) == [1, 0, 5]
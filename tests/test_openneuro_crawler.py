@@ -0,0 +1,103 @@
+import json
+import os
+import pytest
+from src.ml_on_the_mind.bench.corpus import source_count, source_record
+from src.ml_on_the_mind.bench.stubs import OpenNeuroHandler, StubServer
+from src.ml_on_the_mind.data.cache_io import iter_records
+from src.ml_on_the_mind.download.base_downloader import create_session
+from src.ml_on_the_mind.download.openneuro_downloader import OpenNeuroDownloader
+
+RECORDS = 50
+DATASETS = source_count(RECORDS, "openneuro")
+
+class FlakyOpenNeuroHandler(OpenNeuroHandler):
+    """The OpenNeuro stub, recording every request and answering the ones numbered
+    in `failures` (counted from 1) with GraphQL errors and that status instead"""
+    calls = None
+    failures = None
+
+    def do_POST(self):
+        request = self._body() or {}
+        self.calls.append(request)
+        status = self.failures.get(len(self.calls))
+        if status:
+            self._reply({'errors': [{'message': "Unavailable"}]}, status)
+        elif "datasets(" in request.get('query', ""):
+            self._reply(self._datasets_page(request.get('variables') or {}))
+        else:
+            self._reply({'data': self._readmes(request.get('variables') or {})})
+
+@pytest.fixture
+def stub(tmp_path, monkeypatch):
+    # The downloaders write to ./cache
+    monkeypatch.chdir(tmp_path)
+    with StubServer(FlakyOpenNeuroHandler, count=RECORDS, calls=[], failures={}) as server:
+        yield server
+
+def downloader(stub):
+    crawler = OpenNeuroDownloader(api_url=f"{stub.url}/crn/graphql", page_size=10, readme_workers=2)
+    # Retry straight away rather than backing off for seconds
+    crawler.session = create_session(backoff_factor=0, pool_size=2)
+    return crawler
+
+def listing_cursors(stub):
+    calls = stub.server.RequestHandlerClass.calls
+    return [call['variables']['after'] for call in calls if "datasets(" in call['query']]
+
+def cached_datasets(crawler):
+    return list(iter_records(f"cache/{crawler.output_file}"))
+
+def expected_ids():
+    return [source_record(k, "openneuro")['id'] for k in range(DATASETS)]
+
+def test_crawl_walks_every_page(stub):
+    crawler = downloader(stub)
+    datasets = crawler.fetch_datasets()
+    assert listing_cursors(stub) == [None, "10", "20"]
+    assert [dataset['id'] for dataset in datasets] == expected_ids()
+    assert [dataset['id'] for dataset in cached_datasets(crawler)] == expected_ids()
+    # Readmes come from the second pass
+    assert [dataset['description'] for dataset in datasets] == \
+        [source_record(k, "openneuro")['description'] for k in range(DATASETS)]
+
+@pytest.mark.parametrize("status", [429, 500, 502, 503, 504])
+def test_crawl_retries_rate_limits_and_server_errors(stub, status):
+    stub.server.RequestHandlerClass.failures.update({1: status, 2: status, 4: status})
+    crawler = downloader(stub)
+    datasets = crawler.fetch_datasets()
+    assert [dataset['id'] for dataset in datasets] == expected_ids()
+    # The failed first page was asked for again
+    assert listing_cursors(stub)[:3] == [None, None, None]
+
+def test_interrupted_crawl_resumes_from_checkpoint(stub):
+    handler = stub.server.RequestHandlerClass
+    # The third listing page keeps failing, past every retry
+    handler.failures.update({number: 500 for number in range(3, 10)})
+    crawler = downloader(stub)
+    with pytest.raises(Exception):
+        crawler.fetch_datasets()
+    with open(f"cache/{crawler.checkpoint_file}") as f:
+        checkpoint = json.load(f)
+    assert checkpoint['cursor'] == "20"
+    assert len(checkpoint['nodes']) == 20
+
+    handler.failures.clear()
+    del handler.calls[:]
+    datasets = downloader(stub).fetch_datasets()
+    # Only the page after the checkpoint is fetched again
+    assert listing_cursors(stub) == ["20"]
+    assert [dataset['id'] for dataset in datasets] == expected_ids()
+    assert [dataset['id'] for dataset in cached_datasets(crawler)] == expected_ids()
+    assert not os.path.exists(f"cache/{crawler.checkpoint_file}")
+
+def test_graphql_error_keeps_the_checkpoint(stub):
+    # GraphQL reports errors with a 200, which isn't retried
+    stub.server.RequestHandlerClass.failures.update({3: 200})
+    crawler = downloader(stub)
+    with pytest.raises(Exception):
+        crawler.fetch_datasets()
+    with open(f"cache/{crawler.checkpoint_file}") as f:
+        assert json.load(f)['cursor'] == "20"
+    # Neither the cache nor the high-water mark claim a finished crawl
+    assert not os.path.exists(f"cache/{crawler.output_file}")
+    assert crawler.load_high_water_mark('openneuro') is None
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+from src.ml_on_the_mind.search.related import RelatedGraph
+
+SPACE = "hashing:16"
+
+def make_vectors(count, seed=0, dimension=16):
+    rng = np.random.default_rng(seed)
+    return {f"ds{i:06d}": rng.normal(size=dimension).astype(np.float32) for i in range(count)}
+
+class VectorSource:
+    """document_vectors callback that records which ids it was asked for"""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.requested = []
+
+    def __call__(self, ids):
+        self.requested.extend(ids)
+        return {doc_id: self.vectors[doc_id] for doc_id in ids if doc_id in self.vectors}
+
+def brute_force(vectors, k):
+    ids = list(vectors)
+    matrix = np.stack([vectors[doc_id] for doc_id in ids])
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    similarities = matrix @ matrix.T
+    np.fill_diagonal(similarities, -np.inf)
+    return {doc_id: [ids[j] for j in np.argsort(-similarities[i], kind='stable')[:k]] for i, doc_id in enumerate(ids)}
+
+def neighbour_ids(graph):
+    return {doc_id: [doc for doc, _ in graph.related(doc_id, graph.k)] for doc_id in graph.ids}
+
+def test_full_build_matches_brute_force():
+    vectors = make_vectors(300)
+    graph = RelatedGraph.build(list(vectors), ["v1"] * len(vectors), VectorSource(vectors), SPACE, k=5)
+    assert neighbour_ids(graph) == brute_force(vectors, 5)
+    scores = [score for _, score in graph.related("ds000000", 5)]
+    assert scores == sorted(scores, reverse=True)
+
+def test_incremental_build_matches_full_build():
+    vectors = make_vectors(300)
+    hashes = {doc_id: "v1" for doc_id in vectors}
+    previous = RelatedGraph.build(list(vectors), list(hashes.values()), VectorSource(vectors), SPACE, k=5)
+
+    # Change 10 documents, remove 5 and add 5
+    changed = make_vectors(10, seed=1)
+    updated = dict(vectors)
+    for doc_id, vector in zip(list(vectors)[:10], changed.values()):
+        updated[doc_id] = vector
+        hashes[doc_id] = "v2"
+    for doc_id in list(vectors)[100:105]:
+        del updated[doc_id]
+        del hashes[doc_id]
+    for i, vector in enumerate(make_vectors(5, seed=2).values()):
+        updated[f"ds9{i:05d}"] = vector
+        hashes[f"ds9{i:05d}"] = "v1"
+
+    source = VectorSource(updated)
+    incremental = RelatedGraph.build(list(updated), [hashes[doc_id] for doc_id in updated], source, SPACE,
+                                     previous=previous, k=5)
+    # Only new and changed documents were embedded again
+    assert sorted(source.requested) == sorted(list(vectors)[:10] + [f"ds9{i:05d}" for i in range(5)])
+    full = RelatedGraph.build(list(updated), [hashes[doc_id] for doc_id in updated], VectorSource(updated), SPACE, k=5)
+    assert incremental.ids == full.ids
+    assert neighbour_ids(incremental) == neighbour_ids(full) == brute_force(updated, 5)
+
+def test_other_embedding_space_rebuilds_in_full():
+    vectors = make_vectors(50)
+    previous = RelatedGraph.build(list(vectors), ["v1"] * 50, VectorSource(vectors), SPACE, k=5)
+    source = VectorSource(vectors)
+    RelatedGraph.build(list(vectors), ["v1"] * 50, source, "hashing:32", previous=previous, k=5)
+    assert source.requested == list(vectors)
+
+def test_save_and_load(tmp_path):
+    vectors = make_vectors(40)
+    graph = RelatedGraph.build(list(vectors), ["v1"] * 40, VectorSource(vectors), SPACE, k=3)
+    graph.save(str(tmp_path / "related"))
+    loaded = RelatedGraph.load(str(tmp_path / "related"))
+    assert loaded.ids == graph.ids
+    assert loaded.k == 3
+    for doc_id in graph.ids:
+        assert [doc for doc, _ in loaded.related(doc_id)] == [doc for doc, _ in graph.related(doc_id)]
+        assert [score for _, score in loaded.related(doc_id)] == \
+            pytest.approx([score for _, score in graph.related(doc_id)], abs=1e-3)
+    assert loaded.related("missing") == []
+    assert RelatedGraph.load(str(tmp_path / "nothing")) is None
+
+def test_small_graphs_pad_neighbours():
+    vectors = make_vectors(3)
+    graph = RelatedGraph.build(list(vectors), ["v1"] * 3, VectorSource(vectors), SPACE, k=5)
+    assert all(len(graph.related(doc_id, 5)) == 2 for doc_id in graph.ids)
@@ -0,0 +1,49 @@
+import pytest
+from src.ml_on_the_mind.search import result_cache
+from src.ml_on_the_mind.search.result_cache import ResultCache, normalize_query
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(result_cache.time, "monotonic", lambda: now[0])
+    return now
+
+def test_normalize_query():
+    assert normalize_query("  Mouse   Visual\tCortex ") == "mouse visual cortex"
+    assert normalize_query(None) == ""
+
+def test_get_counts_hits_and_misses():
+    cache = ResultCache()
+    assert cache.get("a") is None
+    cache.set("a", [1])
+    assert cache.get("a") == [1]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResultCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert len(cache) == 2
+
+def test_entries_expire(clock):
+    cache = ResultCache(ttl=10)
+    cache.set("a", 1)
+    clock[0] += 9
+    assert cache.get("a") == 1
+    clock[0] += 2
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+def test_new_version_invalidates_entries():
+    cache = ResultCache()
+    cache.set_version("v1")
+    cache.set("a", 1)
+    cache.set_version("v1")
+    assert cache.get("a") == 1
+    cache.set_version("v2")
+    assert cache.get("a") is None
+    assert cache.version == "v2"
@@ -0,0 +1,56 @@
+import asyncio
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from src.ml_on_the_mind.data.catalogue import build_catalogue
+from src.ml_on_the_mind.search.backends import build_local_index
+from src.ml_on_the_mind.search.embedders import HashingEmbedder
+from src.ml_on_the_mind.search_service import create_app
+from .test_backends import make_documents
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    # The service loads its indexes from ./cache
+    monkeypatch.chdir(tmp_path)
+    documents = make_documents()
+    build_local_index(documents, HashingEmbedder(64), path="cache/local_index")
+    build_catalogue([{key: value for key, value in doc.items() if key not in ('_id', 'searchable_content')}
+                     for doc in documents], path="cache/catalogue")
+    return tmp_path
+
+def post_all(requests):
+    """(status, body) for each (method, path, json) request, against one service"""
+    async def run():
+        responses = []
+        async with TestClient(TestServer(create_app(backend="local", search_mode="vector"))) as client:
+            for method, path, body in requests:
+                response = await client.request(method, path, json=body)
+                responses.append((response.status, await response.json() if response.status == 200 else None))
+        return responses
+    return asyncio.run(run())
+
+def test_search_returns_hits_and_version(cache_dir):
+    [(status, body)] = post_all([("POST", "/search", {'query': "mouse calcium imaging", 'limit': 2})])
+    assert status == 200
+    assert len(body['hits']) == 2
+    assert body['version']
+
+def test_stats_carry_a_version(cache_dir):
+    [(status, body)] = post_all([("GET", "/stats", None)])
+    assert status == 200
+    assert body['stats'] == {'numberOfDocuments': 5}
+    assert body['version']
+
+@pytest.mark.parametrize("path, body", [
+    ("/search", {'query': "mouse", 'limit': "x"}),
+    ("/search", {'query': "mouse", 'offset': -1}),
+    ("/search", {'query': 5}),
+    ("/search", {'filters': ["species", "Mouse"]}),
+    ("/search", {'filters': {'species': ["Mouse"]}}),
+    ("/page", {'attributes_to_retrieve': "name"}),
+    ("/facets", {'limit': 2.5}),
+    ("/documents", {'ids': "ds000001"}),
+    ("/search", ["mouse"]),
+])
+def test_malformed_requests_are_rejected(cache_dir, path, body):
+    [(status, _)] = post_all([("POST", path, body)])
+    assert status == 400
@@ -0,0 +1,40 @@
+import os
+from src.ml_on_the_mind.data.catalogue import Catalogue, build_catalogue
+from src.ml_on_the_mind.search.storage import built_at, replace_directory
+
+def write_directory(path, content):
+    os.makedirs(path)
+    with open(os.path.join(path, "data.txt"), 'w') as f:
+        f.write(content)
+
+def read(path):
+    with open(os.path.join(path, "data.txt")) as f:
+        return f.read()
+
+def test_replace_directory_swaps_in_new_contents(tmp_path):
+    path = str(tmp_path / "index")
+    for version in ["1", "2", "3"]:
+        write_directory(f"{path}.tmp", version)
+        replace_directory(f"{path}.tmp", path)
+        assert read(path) == version
+    # Only the current version is kept
+    assert sorted(os.listdir(tmp_path)) == ["index", os.path.basename(os.path.realpath(path))]
+
+def test_replace_directory_recovers_from_an_interrupted_swap(tmp_path):
+    path = str(tmp_path / "index")
+    # A plain directory from an older build, and the leftover of a swap that crashed
+    write_directory(path, "old")
+    write_directory(f"{path}.old", "stale")
+    write_directory(f"{path}.tmp", "new")
+    replace_directory(f"{path}.tmp", path)
+    assert read(path) == "new"
+    assert not os.path.exists(f"{path}.old")
+
+def test_catalogue_save_replaces_previous_build(tmp_path):
+    path = str(tmp_path / "catalogue")
+    first = build_catalogue([{'id': "ds000001", 'name': "First"}], path=path)
+    os.makedirs(f"{path}.old")
+    second = build_catalogue([{'id': "ds000002", 'name': "Second"}, {'id': "ds000003", 'name': "Third"}], path=path)
+    assert len(Catalogue.load(path)) == 2
+    assert built_at(path) == second.meta['built_at'] != first.meta['built_at']
+    assert built_at(str(tmp_path / "missing")) is None